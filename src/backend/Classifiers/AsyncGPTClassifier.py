@@ -0,0 +1,270 @@
+import asyncio
+from typing import Callable, Iterable, List, Sequence
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
+import tqdm
+from Classifiers.GPTClassifier import GPTClassifier
+from utils.constants import (
+    CLASSIFIER_MODEL, CLASSIFICATION_CACHE_PATH, CLASSIFIER_MAX_CONCURRENCY,
+    CLASSIFIER_REQUESTS_PER_MINUTE, CLASSIFIER_TOKENS_PER_MINUTE,
+    CLASSIFIER_CONTEXT, CLASSIFIER_CONTEXT_SIZE, CLASSIFIER_SUMMARY_EVERY,
+    CLASSIFIER_BATCH_SIZE, CLASSIFIER_BATCH_ATTEMPTS,
+    CLASSIFIER_FALLBACK_LABEL, CLASSIFIER_FALLBACK_DESCRIPTION
+)
+from utils.rate_limit import estimate_tokens, shared_limiters
+
+
+class AsyncGPTClassifier(GPTClassifier):
+    """
+    An asyncio variant of the GPTClassifier that classifies many notebooks concurrently.
+
+    All notebooks share one AsyncOpenAI client (and therefore one connection pool). The limiter of
+    in-flight requests and the rate limiter for requests and tokens per minute are shared by all the
+    classifiers of the process with the same API key and model, so concurrent jobs respect the limits together.
+    The cells of a notebook stay sequential, since each prediction depends on the previous ones, so
+    every notebook has at most one request in flight. The semaphore wakes its waiters in FIFO order,
+    which serves the notebooks round-robin instead of letting one notebook monopolize the pool.
+
+    Attributes:
+        async_client (AsyncOpenAI): The client shared by all notebooks.
+        semaphore (ConcurrencyLimiter): Bounds the number of concurrent requests.
+        rate_limiter (RateLimiter): Keeps the request and token rates below the API limits.
+    """
+
+    def __init__(
+        self, api_key: str, prompt: str, labels: List[str],
+        model: str = CLASSIFIER_MODEL,
+        cache_path: str = CLASSIFICATION_CACHE_PATH,
+        context: str = CLASSIFIER_CONTEXT,
+        context_size: int = CLASSIFIER_CONTEXT_SIZE,
+        summary_every: int = CLASSIFIER_SUMMARY_EVERY,
+        batch_size: int = CLASSIFIER_BATCH_SIZE,
+        max_concurrency: int = CLASSIFIER_MAX_CONCURRENCY,
+        requests_per_minute: int = CLASSIFIER_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = CLASSIFIER_TOKENS_PER_MINUTE
+    ):
+        """
+        Initializes an AsyncGPTClassifier object. It has to be created inside the event loop it is used in.
+
+        Args:
+            api_key (str): The API key used for authentication with the OpenAI service.
+            prompt (str): The initial prompt for the GPT model.
+            labels (List[str]): A list of labels used for classification.
+            model (str, optional): The chat model used for classification. Defaults to CLASSIFIER_MODEL.
+            cache_path (str, optional): The path of the prediction cache. Defaults to CLASSIFICATION_CACHE_PATH.
+            context (str, optional): The context strategy. Defaults to CLASSIFIER_CONTEXT.
+            context_size (int, optional): The number of previous cells sent with the "last_k" strategy. Defaults to CLASSIFIER_CONTEXT_SIZE.
+            summary_every (int, optional): The number of cells between summary refreshes with the "summary" strategy. Defaults to CLASSIFIER_SUMMARY_EVERY.
+            batch_size (int, optional): The number of consecutive cells classified by one request. Defaults to CLASSIFIER_BATCH_SIZE.
+            max_concurrency (int, optional): The maximum number of in-flight requests. Defaults to CLASSIFIER_MAX_CONCURRENCY.
+            requests_per_minute (int, optional): The request rate limit. Defaults to CLASSIFIER_REQUESTS_PER_MINUTE.
+            tokens_per_minute (int, optional): The token rate limit. Defaults to CLASSIFIER_TOKENS_PER_MINUTE.
+        """
+        # Retries are handled by the request policy
+        super().__init__(
+            api_key, prompt, labels, model=model, cache_path=cache_path,
+            context=context, context_size=context_size, summary_every=summary_every, batch_size=batch_size
+        )
+        self.async_client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+            )
+        )
+        self.rate_limiter, self.semaphore = shared_limiters(api_key, model, requests_per_minute, tokens_per_minute, max_concurrency)
+
+    async def aclassify_notebooks(
+        self, notebooks: Iterable[dict], verbose: bool = False,
+        on_notebook: Callable[[int, List[dict]], None] = None
+    ) -> List[List[dict]]:
+        """
+        Classifies the code cells of several notebooks concurrently.
+
+        `notebooks` may be a generator producing the notebooks while they are classified (e.g. downloading them):
+        it is advanced in a worker thread, and each notebook is classified as soon as it is produced.
+
+        Args:
+            notebooks (Iterable[dict]): The JSON representations of the notebooks.
+            verbose (bool, optional): Whether to print verbose output. Defaults to False.
+            on_notebook (Callable[[int, List[dict]], None], optional): Called with the index and the classified cells
+                of each notebook as soon as it is done, e.g. to checkpoint it. It runs in a worker thread, so that
+                its disk I/O does not stall the requests in flight, and must be thread-safe. Defaults to None.
+
+        Returns:
+            List[List[dict]]: The classified cells of each notebook, in the order of `notebooks`.
+        """
+        if isinstance(notebooks, Sequence):
+            progress = tqdm.tqdm(total=sum(len(self._code_cells(notebook)) for notebook in notebooks), desc="Classifying cells")
+            try:
+                return await asyncio.gather(*[
+                    self._aclassify_indexed(i, notebook, verbose, progress, on_notebook) for i, notebook in enumerate(notebooks)
+                ])
+            finally:
+                progress.close()
+
+        progress = tqdm.tqdm(total=0, desc="Classifying cells")
+        iterator = iter(notebooks)
+        tasks = []
+        try:
+            while (notebook := await asyncio.to_thread(next, iterator, None)) is not None:
+                progress.total += len(self._code_cells(notebook))
+                progress.refresh()
+                tasks.append(asyncio.create_task(self._aclassify_indexed(len(tasks), notebook, verbose, progress, on_notebook)))
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            progress.close()
+
+    async def aclassify_ipynb(self, notebook: dict, verbose: bool = False, progress: tqdm.tqdm = None) -> List[dict]:
+        """
+        Classifies the code cells of a notebook, like `classify_ipynb` without embeddings.
+
+        Args:
+            notebook (dict): The JSON representation of the notebook.
+            verbose (bool, optional): Whether to print verbose output. Defaults to False.
+            progress (tqdm.tqdm, optional): A progress bar updated after every cell. Defaults to None.
+
+        Returns:
+            List[dict]: The classified cells.
+        """
+        history = []
+        summary = None
+        summarized = 0
+        cells = self._code_cells(notebook)
+        classified_cells = []
+        for start in range(0, len(cells), self.batch_size):
+            if self._refresh_summary(len(history), summarized):
+                summary = await self._asummarize(summary, history[summarized:])
+                summarized = len(history)
+            window = cells[start:start + self.batch_size]
+            if len(window) == 1:
+                messages = self._context_messages(history, summary, summarized) + [{"role": "user", "content": window[0]["source"]}]
+                predictions = {start: await self._amake_prediction(messages, verbose=verbose)}
+            else:
+                predictions = await self._apredict_window(history, summary, summarized, start, window, verbose=verbose)
+            
+            for i, cell in enumerate(window, start=start):
+                prediction, description = predictions[i]
+                history.append((cell["source"], prediction, description))
+                classified_cells.append(self._build_cell(cell, i, prediction, description))
+            if progress is not None: progress.update(len(window))
+        return classified_cells
+
+    async def aclose(self) -> None:
+        """Closes the shared connection pool."""
+        await self.async_client.close()
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    async def _aclassify_indexed(
+        self, index: int, notebook: dict, verbose: bool, progress: tqdm.tqdm,
+        on_notebook: Callable[[int, List[dict]], None]
+    ) -> List[dict]:
+        classified_cells = await self.aclassify_ipynb(notebook, verbose=verbose, progress=progress)
+        if on_notebook is not None: await asyncio.to_thread(on_notebook, index, classified_cells)
+        return classified_cells
+
+    async def _amake_prediction(self, messages: List[dict], verbose: bool = False) -> tuple[str, str]:
+        """
+        Makes a prediction based on the provided messages, within the concurrency and rate limits.
+
+        Args:
+            messages (List[dict]): A list of messages exchanged between the user and the assistant.
+
+        Returns:
+            tuple[str, str]: The predicted label and the description.
+        """
+        context, source = messages[1:-1], messages[-1]["content"]
+        # The SQLite cache is read and written in a worker thread, off the event loop
+        cached = await asyncio.to_thread(self.cache.get, context, source)
+        if cached is not None:
+            return cached
+
+        prediction, description = await self.policy.acall(
+            "classify",
+            lambda timeout: self._acreate(messages, timeout),
+            lambda response: self._parse_response(response, verbose=verbose),
+            fallback=(CLASSIFIER_FALLBACK_LABEL, CLASSIFIER_FALLBACK_DESCRIPTION)
+        )
+        if prediction != CLASSIFIER_FALLBACK_LABEL:
+            await asyncio.to_thread(self.cache.put, context, source, prediction, description)
+        return prediction, description
+
+    async def _apredict_window(
+        self, history: List[tuple[str, str, str]], summary: str, summarized: int,
+        start: int, window: List[dict], verbose: bool = False
+    ) -> dict[int, tuple[str, str]]:
+        """
+        Classifies several consecutive cells with one request and a JSON answer, like `_predict_window`.
+
+        Returns:
+            dict[int, tuple[str, str]]: The predicted label and description of each cell id.
+        """
+        context = self._batch_context_messages(history, summary, summarized)
+        predictions, pending = await asyncio.to_thread(self._cached_window, context, start, window)
+
+        attempts = 0
+        while pending and attempts < CLASSIFIER_BATCH_ATTEMPTS:
+            messages = context + [self._batch_message(pending)]
+            response = await self.policy.acall(
+                "classify_batch",
+                lambda timeout: self._acreate(messages, timeout, response_format={"type": "json_object"}),
+                lambda response: response
+            )
+            if response is None: break
+            pending = await asyncio.to_thread(self._collect_window, context, pending, response, predictions, verbose)
+            attempts += 1
+
+        for cell_id, source in pending:
+            messages = self._context_messages(history, summary, summarized) + [{"role": "user", "content": source}]
+            predictions[cell_id] = await self._amake_prediction(messages, verbose=verbose)
+        return predictions
+
+    async def _asummarize(self, summary: str, recent: List[tuple[str, str, str]]) -> str:
+        """
+        Refreshes the rolling summary of a notebook, like `_summarize`.
+
+        Args:
+            summary (str): The previous summary, None for the first refresh.
+            recent (List[tuple[str, str, str]]): The (source, class, description) of the cells classified since.
+
+        Returns:
+            str: The new summary.
+        """
+        messages = self._summary_messages(summary, recent)
+        return await self.policy.acall(
+            "summary",
+            lambda timeout: self._acreate(messages, timeout),
+            lambda response: response or None,
+            fallback=summary
+        )
+
+    async def _acreate(self, messages: List[dict], timeout: float, **kwargs) -> str:
+        """
+        Sends a chat completion request within the concurrency and rate limits.
+
+        Args:
+            messages (List[dict]): The messages sent to the model.
+            timeout (float): The timeout of the request in seconds.
+            **kwargs: Additional arguments of the chat completion request.
+
+        Returns:
+            str: The content of the model response.
+        """
+        estimated_tokens = estimate_tokens(messages)
+        async with self.semaphore:
+            await self.rate_limiter.acquire(estimated_tokens)
+            chat_completion = await self.async_client.chat.completions.create(
+                messages=messages,
+                model=self.model,
+                timeout=timeout,
+                **kwargs
+            )
+        self._record_usage(chat_completion)
+        if chat_completion.usage is not None:
+            self.rate_limiter.settle(estimated_tokens, chat_completion.usage.total_tokens)
+        return chat_completion.choices[0].message.content
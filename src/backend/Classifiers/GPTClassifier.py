@@ -1,9 +1,17 @@
 from openai import OpenAI, BadRequestError
 from typing import List
 import re
-from chromadb.utils import embedding_functions
+import json
 import tqdm
 from utils.helper_functions import clean_code
+from utils.constants import (
+    CLASSIFIER_MODEL, CLASSIFICATION_CACHE_PATH, CLASSIFICATION_CACHE_SIZE,
+    CONTEXT_STRATEGIES, CLASSIFIER_CONTEXT, CLASSIFIER_CONTEXT_SIZE, CLASSIFIER_SUMMARY_EVERY,
+    CLASSIFIER_BATCH_SIZE, CLASSIFIER_BATCH_ATTEMPTS, batch_classifier_prompt,
+    CLASSIFIER_FALLBACK_LABEL, CLASSIFIER_FALLBACK_DESCRIPTION
+)
+from utils.request_policy import RequestPolicy, request_policy
+from Classifiers.prediction_cache import PredictionCache
 import multiprocessing
 
 
@@ -18,9 +26,27 @@ class GPTClassifier():
         client (OpenAI): The OpenAI client used for API communication.
         labels (List[str]): A list of labels used for classification.
         messages (List[dict]): A list of messages exchanged between the user and the assistant.
+        cache (PredictionCache): The persistent cache of parsed predictions.
+        context (str): The strategy deciding which previous cells are sent along with a cell, one of CONTEXT_STRATEGIES:
+            "full" resends the whole conversation, "last_k" only the last `context_size` cells, "summary" a rolling
+            summary refreshed every `summary_every` cells plus the cells since, and "labels" only the list of prior classes.
+        usage (List[dict]): The prompt and completion token counts of every chat completion request.
+        batch_size (int): The number of consecutive cells classified by one request. With more than one cell per
+            request, the model answers in JSON and only the cells with a missing or invalid answer are requested again.
+        policy (RequestPolicy): The retry, timeout and backoff policy of the chat API calls. A cell that cannot be
+            classified within the policy is labeled CLASSIFIER_FALLBACK_LABEL.
     """
     
-    def __init__(self, api_key: str, prompt: str, labels: List[str]):
+    def __init__(
+        self, api_key: str, prompt: str, labels: List[str],
+        model: str = CLASSIFIER_MODEL,
+        cache_path: str = CLASSIFICATION_CACHE_PATH,
+        context: str = CLASSIFIER_CONTEXT,
+        context_size: int = CLASSIFIER_CONTEXT_SIZE,
+        summary_every: int = CLASSIFIER_SUMMARY_EVERY,
+        batch_size: int = CLASSIFIER_BATCH_SIZE,
+        policy: RequestPolicy = request_policy
+    ):
         """
         Initializes a GPTClassifier object.
 
@@ -28,8 +54,30 @@ class GPTClassifier():
             api_key (str): The API key used for authentication with the OpenAI service.
             prompt (str): The initial prompt for the GPT model.
             labels (List[str]): A list of labels used for classification.
+            model (str, optional): The chat model used for classification. Defaults to CLASSIFIER_MODEL.
+            cache_path (str, optional): The path of the prediction cache. Defaults to CLASSIFICATION_CACHE_PATH.
+            context (str, optional): The context strategy. Defaults to CLASSIFIER_CONTEXT.
+            context_size (int, optional): The number of previous cells sent with the "last_k" strategy. Defaults to CLASSIFIER_CONTEXT_SIZE.
+            summary_every (int, optional): The number of cells between summary refreshes with the "summary" strategy. Defaults to CLASSIFIER_SUMMARY_EVERY.
+            batch_size (int, optional): The number of consecutive cells classified by one request. Defaults to CLASSIFIER_BATCH_SIZE.
+            policy (RequestPolicy, optional): The request policy. Defaults to the policy shared by the process.
+
+        Raises:
+            ValueError: If the context strategy is unknown.
         """
-        self.client = OpenAI(api_key=api_key)
+        if context not in CONTEXT_STRATEGIES:
+            raise ValueError(f"Unknown context strategy '{context}', expected one of {CONTEXT_STRATEGIES}")
+        self.context = context
+        self.context_size = context_size
+        self.summary_every = summary_every
+        self.batch_size = max(1, batch_size)
+        self.policy = policy
+        self.usage = []
+        # The clients are created on first use, see `client` and `embedder`
+        self._api_key = api_key
+        self._client = None
+        self._embedder = None
+        self.model = model
         self.labels = labels
         self.messages = [
             {
@@ -37,10 +85,25 @@ class GPTClassifier():
                 "content": prompt
             },
         ]
-        self.embedder = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=api_key,
-            model_name="text-embedding-ada-002"
-        )
+        self.cache = PredictionCache(cache_path, prompt, labels, model, max_entries=CLASSIFICATION_CACHE_SIZE)
+        
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            # Retries are handled by the request policy
+            self._client = OpenAI(api_key=self._api_key, max_retries=0)
+        return self._client
+    
+    @property
+    def embedder(self):
+        # chromadb is slow to import and only needed to embed descriptions
+        if self._embedder is None:
+            from chromadb.utils import embedding_functions
+            self._embedder = embedding_functions.OpenAIEmbeddingFunction(
+                api_key=self._api_key,
+                model_name="text-embedding-ada-002"
+            )
+        return self._embedder
     
     def train(self, X: List[str], y: List[str]) -> True:
         """
@@ -111,50 +174,43 @@ class GPTClassifier():
         return classes
     
     def classify_ipynb(self, notebook: dict, embed: bool = True, verbose: bool = False) -> list[dict]:
-        # Copy clear message history
-        messages = self.messages.copy()
+        # Previously classified cells, sent as context according to the context strategy
+        history = []
+        summary = None
+        summarized = 0
+        usage_start = len(self.usage)
                 
-        cells = [cell for cell in notebook["cells"] if cell["cell_type"] == "code" and len(cell["source"])]
+        cells = self._code_cells(notebook)
         classified_cells = []
-        i = 0
-        for cell in tqdm.tqdm(cells):
-            if isinstance(cell["source"], list): cell["source"] = "\n".join(cell["source"])
-            if cell["cell_type"] == "code" and len(cell["source"]):
-                messages.append({"role": "user","content": cell["source"]})
-                prediction, description = self._make_prediction(messages, verbose=verbose)
-                messages.append({
-                    "role": "assistant", 
-                    "content": f"Class: {prediction}\nDescription: {description}"
-                })
-                
-                new_cell = {
-                    "cell_id": i,
-                    "code": cell["source"],
-                    "class": prediction,
-                    "desc": description,
-                }
+        progress = tqdm.tqdm(total=len(cells))
+        for start in range(0, len(cells), self.batch_size):
+            if self._refresh_summary(len(history), summarized):
+                summary = self._summarize(summary, history[summarized:])
+                summarized = len(history)
+            window = cells[start:start + self.batch_size]
+            if len(window) == 1:
+                messages = self._context_messages(history, summary, summarized) + [{"role": "user", "content": window[0]["source"]}]
+                predictions = {start: self._make_prediction(messages, verbose=verbose)}
+            else:
+                predictions = self._predict_window(history, summary, summarized, start, window, verbose=verbose)
+            
+            for i, cell in enumerate(window, start=start):
+                prediction, description = predictions[i]
+                history.append((cell["source"], prediction, description))
+                new_cell = self._build_cell(cell, i, prediction, description)
                 if embed: new_cell["embedding"] = self.embedder([description])[0]
-                if "class" in cell["metadata"] and "subclass" in cell["metadata"] and "subclass_id" in cell["metadata"]:
-                    new_cell["testing"] = {
-                        "class": cell["metadata"]["class"],
-                        "subclass": cell["metadata"]["subclass"],
-                        "subclass_id": cell["metadata"]["subclass_id"],
-                        "predicted_subclass_probability": cell["metadata"]["predicted_subclass_probability"]
-                    }
                 classified_cells.append(new_cell)
+            progress.update(len(window))
+        progress.close()
 
-                i += 1
-            elif cell["cell_type"] == "markdown" and len(cell["source"]):
-                messages.append({
-                    "role": "user",
-                    "content": self._markdown_prompt(cell["source"])
-                })
-
+        if verbose: self._print_usage(self.usage[usage_start:])
         return classified_cells 
             
 
     def evaluate(self, notebook: dict, verbose: bool = False):
-        messages = self.messages.copy()
+        history = []
+        summary = None
+        summarized = 0
         cells = [cell for cell in notebook["cells"] if cell["cell_type"] == "code"]
         misclassification_dict = {label: {"count": 0, "misclassified": 0} for label in self.labels}
         correct_count = 0
@@ -165,12 +221,12 @@ class GPTClassifier():
         for cell in tqdm.tqdm(cells, desc=f"Evaluating"):
             if not isinstance(cell["source"], str): print(cell["source"])
             if cell["cell_type"] == "code" and len(cell["source"]): 
-                messages.append({"role": "user", "content": cell["source"]})
+                if self._refresh_summary(len(history), summarized):
+                    summary = self._summarize(summary, history[summarized:])
+                    summarized = len(history)
+                messages = self._context_messages(history, summary, summarized) + [{"role": "user", "content": cell["source"]}]
                 prediction, description = self._make_prediction(messages, verbose=verbose)
-                messages.append({
-                    "role": "assistant", 
-                    "content": f"Class: {prediction}\nDescription: {description}"
-                })
+                history.append((cell["source"], prediction, description))
             
                 if verbose: print(f"Predicted label {cell_count}/{len(cells)}: {prediction}")
                 
@@ -185,12 +241,6 @@ class GPTClassifier():
                 
                 misclassification_dict[true_class]["count"] += 1
                 cell_count += 1
-                
-            elif cell["cell_type"] == "markdown" and len(cell["source"]):
-                messages.append({
-                    "role": "user",
-                    "content": self._markdown_prompt(cell["source"])
-                })
             
         accuracy = correct_count / len(cells) * 100
         if verbose: print(f"Accuracy: {accuracy:.2f}%")
@@ -207,6 +257,7 @@ class GPTClassifier():
     def _make_prediction(self, messages: List[dict], verbose: bool = False) -> str:
         """
         Makes a prediction based on the provided messages.
+        The prediction cache is consulted first, the chat API is only called on a miss.
 
         Args:
             messages (List[dict]): A list of messages exchanged between the user and the assistant.
@@ -214,31 +265,290 @@ class GPTClassifier():
         Returns:
             str: The predicted label.
         """
+        context, source = messages[1:-1], messages[-1]["content"]
+        cached = self.cache.get(context, source)
+        if cached is not None:
+            return cached
     
-        prediction = None
-        description = None
-        while not prediction:   
-            # TODO: add timeout mechanism 
-            chat_completion = self.client.chat.completions.create(
-                messages=messages,
-                model="gpt-4o"
-            )
-            response = chat_completion.choices[0].message.content
-            
-            found_label = False
-            match = re.search(r"Class: (.+)\nDescription: (.+)", response)
-            
-            if match:
-                class_label = match.group(1)
-                if class_label in self.labels:
-                    prediction = class_label
-                    found_label = True
-                    description = match.group(2)
-
-            if verbose and not found_label: print(f"[ERROR] Response string invalid:\n{response}\n\nRetrying...", end="\r") 
-            
+        prediction, description = self.policy.call(
+            "classify",
+            lambda timeout: self._create(messages, timeout),
+            lambda response: self._parse_response(response, verbose=verbose),
+            fallback=(CLASSIFIER_FALLBACK_LABEL, CLASSIFIER_FALLBACK_DESCRIPTION)
+        )
+        if prediction != CLASSIFIER_FALLBACK_LABEL:
+            self.cache.put(context, source, prediction, description)
         return prediction, description
     
+    def _create(self, messages: List[dict], timeout: float, **kwargs) -> str:
+        """
+        Sends a chat completion request and records its token usage.
+
+        Args:
+            messages (List[dict]): The messages sent to the model.
+            timeout (float): The timeout of the request in seconds.
+            **kwargs: Additional arguments of the chat completion request.
+
+        Returns:
+            str: The content of the model response.
+        """
+        chat_completion = self.client.chat.completions.create(
+            messages=messages,
+            model=self.model,
+            timeout=timeout,
+            **kwargs
+        )
+        self._record_usage(chat_completion)
+        return chat_completion.choices[0].message.content
+    
+    def _predict_window(
+        self, history: List[tuple[str, str, str]], summary: str, summarized: int,
+        start: int, window: List[dict], verbose: bool = False
+    ) -> dict[int, tuple[str, str]]:
+        """
+        Classifies several consecutive cells with one request and a JSON answer.
+        Cells with a missing or invalid answer are requested again, up to CLASSIFIER_BATCH_ATTEMPTS requests,
+        after which the remaining cells are classified one by one.
+
+        Args:
+            history (List[tuple[str, str, str]]): The (source, class, description) of the previously classified cells.
+            summary (str): The rolling summary, used by the "summary" strategy.
+            summarized (int): The number of cells covered by the summary.
+            start (int): The cell id of the first cell of the window.
+            window (List[dict]): The cells to classify.
+
+        Returns:
+            dict[int, tuple[str, str]]: The predicted label and description of each cell id.
+        """
+        context = self._batch_context_messages(history, summary, summarized)
+        predictions, pending = self._cached_window(context, start, window)
+        
+        attempts = 0
+        while pending and attempts < CLASSIFIER_BATCH_ATTEMPTS:
+            messages = context + [self._batch_message(pending)]
+            response = self.policy.call(
+                "classify_batch",
+                lambda timeout: self._create(messages, timeout, response_format={"type": "json_object"}),
+                lambda response: response
+            )
+            if response is None: break
+            pending = self._collect_window(context, pending, response, predictions, verbose=verbose)
+            attempts += 1
+        
+        for cell_id, source in pending:
+            messages = self._context_messages(history, summary, summarized) + [{"role": "user", "content": source}]
+            predictions[cell_id] = self._make_prediction(messages, verbose=verbose)
+        return predictions
+    
+    def _batch_context_messages(self, history: List[tuple[str, str, str]], summary: str, summarized: int) -> List[dict]:
+        messages = self._context_messages(history, summary, summarized)
+        return messages[:1] + [{"role": "system", "content": batch_classifier_prompt(self.labels)}] + messages[1:]
+    
+    def _batch_message(self, pending: List[tuple[int, str]]) -> dict:
+        return {"role": "user", "content": json.dumps([{"cell_id": cell_id, "code": source} for cell_id, source in pending])}
+    
+    def _cached_window(self, context: List[dict], start: int, window: List[dict]) -> tuple[dict, List[tuple[int, str]]]:
+        """
+        Looks up the cells of a window in the prediction cache.
+
+        Returns:
+            tuple[dict, List[tuple[int, str]]]: The cached predictions by cell id and the (cell id, source) of the other cells.
+        """
+        predictions = {}
+        pending = []
+        for cell_id, cell in enumerate(window, start=start):
+            cached = self.cache.get(context[1:], cell["source"])
+            if cached is not None: predictions[cell_id] = cached
+            else: pending.append((cell_id, cell["source"]))
+        return predictions, pending
+    
+    def _collect_window(
+        self, context: List[dict], pending: List[tuple[int, str]], response: str,
+        predictions: dict, verbose: bool = False
+    ) -> List[tuple[int, str]]:
+        """
+        Stores the valid answers of a JSON response in `predictions` and in the cache.
+
+        Returns:
+            List[tuple[int, str]]: The (cell id, source) of the cells still without a valid answer.
+        """
+        answers = self._parse_batch_response(response)
+        still_pending = []
+        for cell_id, source in pending:
+            if cell_id in answers:
+                predictions[cell_id] = answers[cell_id]
+                self.cache.put(context[1:], source, *answers[cell_id])
+            else:
+                still_pending.append((cell_id, source))
+        if still_pending: self.policy.record("classify_batch", "parse_failures")
+        if verbose and still_pending: print(f"[ERROR] {len(still_pending)}/{len(pending)} cells without a valid answer, retrying...", end="\r")
+        return still_pending
+    
+    def _parse_batch_response(self, response: str) -> dict[int, tuple[str, str]]:
+        """
+        Extracts the valid answers from a JSON model response.
+
+        Args:
+            response (str): The content of the model response.
+
+        Returns:
+            dict[int, tuple[str, str]]: The predicted label and description of each answered cell id.
+        """
+        try:
+            cells = json.loads(response)["cells"]
+        except (json.JSONDecodeError, TypeError, KeyError):
+            return {}
+        
+        answers = {}
+        for cell in cells if isinstance(cells, list) else []:
+            if not isinstance(cell, dict): continue
+            cell_id, label, description = cell.get("cell_id"), cell.get("class"), cell.get("description")
+            if isinstance(cell_id, int) and label in self.labels and isinstance(description, str) and description.strip():
+                answers[cell_id] = (label, description.strip())
+        return answers
+    
+    def _summarize(self, summary: str, recent: List[tuple[str, str, str]]) -> str:
+        """
+        Refreshes the rolling summary of a notebook with the most recently classified cells.
+
+        Args:
+            summary (str): The previous summary, None for the first refresh.
+            recent (List[tuple[str, str, str]]): The (source, class, description) of the cells classified since.
+
+        Returns:
+            str: The new summary.
+        """
+        messages = self._summary_messages(summary, recent)
+        return self.policy.call(
+            "summary",
+            lambda timeout: self._create(messages, timeout),
+            lambda response: response or None,
+            fallback=summary
+        )
+    
+    def _context_messages(self, history: List[tuple[str, str, str]], summary: str = None, summarized: int = 0) -> List[dict]:
+        """
+        Builds the messages sent before the next cell, according to the context strategy.
+
+        Args:
+            history (List[tuple[str, str, str]]): The (source, class, description) of the previously classified cells.
+            summary (str, optional): The rolling summary, used by the "summary" strategy. Defaults to None.
+            summarized (int, optional): The number of cells covered by the summary. Defaults to 0.
+
+        Returns:
+            List[dict]: The system prompt followed by the context messages.
+        """
+        messages = self.messages.copy()
+        if self.context == "labels":
+            if history:
+                labels = "\n".join(f"{i+1}. {prediction}" for i, (_, prediction, _) in enumerate(history))
+                messages.append({"role": "user", "content": f"The previous code cells of this notebook were classified as:\n{labels}"})
+            return messages
+        
+        if self.context == "last_k":
+            history = history[-self.context_size:] if self.context_size > 0 else []
+        elif self.context == "summary":
+            if summary:
+                messages.append({"role": "user", "content": f"Summary of the previous code cells of this notebook:\n{summary}"})
+            history = history[summarized:]
+        
+        for source, prediction, description in history:
+            messages += [
+                {"role": "user", "content": source},
+                {"role": "assistant", "content": f"Class: {prediction}\nDescription: {description}"}
+            ]
+        return messages
+    
+    def _refresh_summary(self, n_classified: int, summarized: int) -> bool:
+        return self.context == "summary" and n_classified - summarized >= self.summary_every
+    
+    def _summary_messages(self, summary: str, recent: List[tuple[str, str, str]]) -> List[dict]:
+        descriptions = "\n".join(f"- {prediction}: {description}" for _, prediction, description in recent)
+        content = f"Previous summary:\n{summary}\n\n" if summary else ""
+        content += f"Newly classified code cells:\n{descriptions}"
+        return [
+            {
+                "role": "system",
+                "content": "Summarize what a jupyter notebook of a machine learning task has done so far in at most 5 sentences. "
+                           "Mention explicitly the name of the technologies, data and models used."
+            },
+            {"role": "user", "content": content}
+        ]
+    
+    def _record_usage(self, chat_completion) -> None:
+        if chat_completion.usage is not None:
+            self.usage.append({
+                "prompt_tokens": chat_completion.usage.prompt_tokens,
+                "completion_tokens": chat_completion.usage.completion_tokens
+            })
+    
+    def _print_usage(self, usage: List[dict]) -> None:
+        if not usage: return
+        prompt_tokens = [call["prompt_tokens"] for call in usage]
+        completion_tokens = sum(call["completion_tokens"] for call in usage)
+        print(f"Token usage ({self.context} context): {len(usage)} calls, {sum(prompt_tokens)} prompt tokens "
+              f"(max {max(prompt_tokens)} per call), {completion_tokens} completion tokens")
+    
+    def _parse_response(self, response: str, verbose: bool = False) -> tuple[str, str]:
+        """
+        Extracts the class and the description from a model response.
+
+        Args:
+            response (str): The content of the model response.
+            verbose (bool, optional): Whether to print invalid responses. Defaults to False.
+
+        Returns:
+            tuple[str, str]: The predicted label and the description, or None if the response is invalid.
+        """
+        match = re.search(r"Class: (.+)\nDescription: (.+)", response or "")
+        if match and match.group(1) in self.labels:
+            return match.group(1), match.group(2)
+        if verbose: print(f"[ERROR] Response string invalid:\n{response}\n\nRetrying...", end="\r")
+        return None
+    
+    def _code_cells(self, notebook: dict) -> List[dict]:
+        """
+        Returns the non-empty code cells of a notebook, with their source joined into a single string.
+
+        Args:
+            notebook (dict): The JSON representation of the notebook.
+
+        Returns:
+            List[dict]: The code cells to classify.
+        """
+        cells = [cell for cell in notebook["cells"] if cell["cell_type"] == "code" and len(cell["source"])]
+        for cell in cells:
+            if isinstance(cell["source"], list): cell["source"] = "\n".join(cell["source"])
+        return cells
+    
+    def _build_cell(self, cell: dict, cell_id: int, prediction: str, description: str) -> dict:
+        """
+        Builds the classified cell stored in a .viz file.
+
+        Args:
+            cell (dict): The original notebook cell.
+            cell_id (int): The index of the cell among the classified cells.
+            prediction (str): The predicted label.
+            description (str): The generated description.
+
+        Returns:
+            dict: The classified cell.
+        """
+        new_cell = {
+            "cell_id": cell_id,
+            "code": cell["source"],
+            "class": prediction,
+            "desc": description,
+        }
+        if "class" in cell["metadata"] and "subclass" in cell["metadata"] and "subclass_id" in cell["metadata"]:
+            new_cell["testing"] = {
+                "class": cell["metadata"]["class"],
+                "subclass": cell["metadata"]["subclass"],
+                "subclass_id": cell["metadata"]["subclass_id"],
+                "predicted_subclass_probability": cell["metadata"]["predicted_subclass_probability"]
+            }
+        return new_cell
+    
     
     def _markdown_prompt(markdown_text: str) -> str:
         """
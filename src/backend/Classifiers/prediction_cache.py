@@ -0,0 +1,76 @@
+import json
+from typing import List, Optional
+from utils.cache import SQLiteCache, hash_key
+
+
+class PredictionCache():
+    """A persistent cache of parsed cell classifications.
+
+    A prediction is addressed by the system prompt, the label set, the model, the context window
+    sent before the cell and the cell source itself.
+
+    Invalidation policy: the cache file is stamped with a fingerprint of the system prompt, the label
+    set and the model. Opening it with a different prompt (e.g. after editing `classifier_prompt`),
+    different labels (e.g. after editing `FIRST_LAYER_LABELS`) or another model drops every stored
+    prediction, instead of keeping unreachable entries around until they are evicted.
+    """
+
+    def __init__(self, path: str, prompt: str, labels: List[str], model: str, max_entries: int = 1_000_000) -> None:
+        """Opens the prediction cache.
+
+        Args:
+            path (str): The path of the SQLite database file.
+            prompt (str): The system prompt of the classifier.
+            labels (List[str]): The labels used for classification.
+            model (str): The name of the chat model.
+            max_entries (int, optional): The maximum number of predictions kept on disk. Defaults to 1000000.
+        """
+        self._namespace = hash_key(prompt, json.dumps(list(labels)), model)
+        self._store = SQLiteCache(path, max_entries=max_entries, fingerprint=self._namespace)
+
+    @property
+    def hits(self) -> int:
+        return self._store.hits
+
+    @property
+    def misses(self) -> int:
+        return self._store.misses
+
+    def get(self, context: List[dict], source: str) -> Optional[tuple[str, str]]:
+        """Looks up the prediction for a cell.
+
+        Args:
+            context (List[dict]): The messages sent before the cell, excluding the system prompt.
+            source (str): The source of the cell.
+
+        Returns:
+            Optional[tuple[str, str]]: The cached (class, description) pair, or None if it is not cached.
+        """
+        value = self._store.get(self._key(context, source))
+        return tuple(json.loads(value)) if value is not None else None
+
+    def put(self, context: List[dict], source: str, prediction: str, description: str) -> None:
+        """Stores the prediction for a cell.
+
+        Args:
+            context (List[dict]): The messages sent before the cell, excluding the system prompt.
+            source (str): The source of the cell.
+            prediction (str): The predicted class.
+            description (str): The generated description.
+        """
+        self._store.put(self._key(context, source), json.dumps([prediction, description]).encode("utf-8"))
+
+    def clear(self) -> None:
+        """Drops every stored prediction."""
+        self._store.clear()
+
+    def stats(self) -> dict:
+        return self._store.stats()
+
+    #######################################
+    ########### Private methods ###########
+    #######################################
+
+    def _key(self, context: List[dict], source: str) -> str:
+        context_hash = hash_key(json.dumps(context, sort_keys=True))
+        return hash_key(self._namespace, context_hash, source)
@@ -0,0 +1,109 @@
+from typing import List, Optional
+import numpy as np
+
+
+class CellTable():
+    """A columnar view of the cells of a final JSON, for the clustering stages.
+
+    Every cell is a row, in notebook order, stored in NumPy arrays instead of a dict per cell. The
+    descriptions are interned: each distinct description is stored and embedded once, and the cells
+    refer to it through `desc_ids`. The stages select the rows of a class or a cluster with index
+    arrays and read their embeddings from the one contiguous matrix `embeddings`.
+
+    Attributes:
+        classes (List[str]): The class vocabulary, class id -1 is a cell of none of them.
+        notebook_idx (np.ndarray): The int32 index of the notebook of every cell.
+        cell_idx (np.ndarray): The int32 index of every cell in its notebook.
+        class_ids (np.ndarray): The int16 class id of every cell.
+        clusters (np.ndarray): The int32 cluster of every cell, -1 if unclustered.
+        desc_ids (np.ndarray): The int32 index of the description of every cell into `descs`.
+        descs (List[str]): The distinct descriptions.
+        embeddings (Optional[np.ndarray]): The (len(descs), dim) float32 embeddings of the descriptions, see `embed`.
+    """
+
+    def __init__(self, data: dict, classes: List[str]) -> None:
+        """Builds the table of the cells of a final JSON in one pass.
+
+        Args:
+            data (dict): The final JSON.
+            classes (List[str]): The classes of the cells, other classes get the id -1.
+        """
+        self.classes = list(classes)
+        class_ids = {class_name: i for i, class_name in enumerate(self.classes)}
+        n_cells = sum(len(notebook["cells"]) for notebook in data["notebooks"])
+        self.notebook_idx = np.empty(n_cells, dtype=np.int32)
+        self.cell_idx = np.empty(n_cells, dtype=np.int32)
+        self.class_ids = np.empty(n_cells, dtype=np.int16)
+        self.clusters = np.empty(n_cells, dtype=np.int32)
+        self.desc_ids = np.empty(n_cells, dtype=np.int32)
+        desc_ids = {}
+
+        row = 0
+        for notebook_idx, notebook in enumerate(data["notebooks"]):
+            for cell_idx, cell in enumerate(notebook["cells"]):
+                self.notebook_idx[row] = notebook_idx
+                self.cell_idx[row] = cell_idx
+                self.class_ids[row] = class_ids.get(cell["class"], -1)
+                self.clusters[row] = cell.get("cluster", -1)
+                self.desc_ids[row] = desc_ids.setdefault(cell["desc"], len(desc_ids))
+                row += 1
+        self.descs = list(desc_ids)
+        self.embeddings = None
+
+    def __len__(self) -> int:
+        return len(self.notebook_idx)
+
+    def embed(self, embed_cells) -> None:
+        """Embeds the distinct descriptions.
+
+        Args:
+            embed_cells (Callable[[List[str]], np.ndarray]): Embeds a list of descriptions, e.g. `ClassCluster.embed_cells`.
+        """
+        self.embeddings = np.ascontiguousarray(embed_cells(self.descs), dtype=np.float32)
+
+    def class_indices(self, class_id: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Returns the rows of the cells of a class.
+
+        Args:
+            class_id (int): The class id.
+            rows (Optional[np.ndarray], optional): A boolean mask restricting the rows. Defaults to None (all rows).
+
+        Returns:
+            np.ndarray: The int64 row indices, in notebook order.
+        """
+        mask = self.class_ids == class_id
+        return np.flatnonzero(mask if rows is None else mask & rows)
+
+    def cell_embeddings(self, indices: np.ndarray) -> np.ndarray:
+        """Returns the embeddings of some cells, one row per cell.
+
+        Args:
+            indices (np.ndarray): The row indices of the cells.
+
+        Returns:
+            np.ndarray: A (len(indices), dim) copy of their embeddings.
+        """
+        return self.embeddings[self.desc_ids[indices]]
+
+    def cell_descs(self, indices: np.ndarray) -> List[str]:
+        """Returns the descriptions of some cells.
+
+        Args:
+            indices (np.ndarray): The row indices of the cells.
+
+        Returns:
+            List[str]: Their descriptions, shared with `descs`.
+        """
+        return [self.descs[i] for i in self.desc_ids[indices]]
+
+    def write_clusters(self, data: dict, indices: Optional[np.ndarray] = None) -> None:
+        """Writes the clusters of the table into the cells of the final JSON it was built from.
+
+        Args:
+            data (dict): The final JSON.
+            indices (Optional[np.ndarray], optional): The rows to write. Defaults to None (all rows).
+        """
+        rows = range(len(self)) if indices is None else indices
+        notebooks = data["notebooks"]
+        for i in rows:
+            notebooks[self.notebook_idx[i]]["cells"][self.cell_idx[i]]["cluster"] = int(self.clusters[i])
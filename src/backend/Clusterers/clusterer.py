@@ -1,38 +1,83 @@
 import json
+import os
 import itertools
+import multiprocessing
+import threading
+from typing import TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 from tqdm import tqdm
 from sklearn.cluster import HDBSCAN
 import sys; sys.path.insert(0, '../')
 from utils.helper_functions import clean_code
-from Clusterers.title_generator import TitleGenerator
-import torch
-from transformers import AutoTokenizer, AutoModel
+from utils.constants import (
+    EMBEDDING_MODEL, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_SIZE, TITLE_MODE, REDUCER, CLUSTER_N_JOBS, CLUSTER_EVALUATION,
+    INCREMENTAL_MAX_GROWTH, INCREMENTAL_MAX_OUTLIER_RATE, INCREMENTAL_RADIUS_PERCENTILE, POOL_START_METHOD
+)
+from Clusterers.reducers import Reducer, make_reducer
+from Clusterers.title_generator import TitleGenerator, TITLE_MODES
+from Clusterers.embedding_cache import EmbeddingCache
+from Clusterers.cell_table import CellTable
+from Clusterers.evaluation import clustering_scores
 import numpy as np
-from sklearn.metrics import confusion_matrix    
-from scipy.optimize import linear_sum_assignment
-from sklearn.manifold import TSNE
-from sklearn.metrics import silhouette_score
-from sklearn.metrics import calinski_harabasz_score
-from sklearn.metrics import davies_bouldin_score
+if TYPE_CHECKING:
+    import torch
 
 
+# Pooling modes, part of the embedding cache keys
+SUMMARY_POOLING = "masked-mean"
+CODE_POOLING = "chunked-mean"
+
 
 class ClassCluster():
     
-    def __init__(self) -> None:
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self._tokenizer = AutoTokenizer.from_pretrained("microsoft/codebert-base")
-        self._model = AutoModel.from_pretrained("microsoft/codebert-base")
-        self._model.to(self.device)
-        self.clusterer = HDBSCAN(
-            min_cluster_size=10,
-            min_samples=2,
-            cluster_selection_epsilon=.0,
-            max_cluster_size=None,
-            alpha=1.0
-        )
+    def __init__(
+        self,
+        embedding_cache_path: str = EMBEDDING_CACHE_PATH,
+        title_mode: str = TITLE_MODE,
+        reducer: str | Reducer = REDUCER,
+        n_jobs: int = CLUSTER_N_JOBS,
+        evaluate: bool = CLUSTER_EVALUATION
+    ) -> None:
+        if title_mode not in TITLE_MODES:
+            raise ValueError(f"Unknown title mode '{title_mode}', expected one of {TITLE_MODES}")
+        self.title_mode = title_mode
+        self.reducer = make_reducer(reducer) if isinstance(reducer, str) else reducer
+        self.n_jobs = n_jobs
+        # Whether the clusters of every class are scored, see Clusterers/evaluation.py
+        self.evaluate = evaluate
+        # CodeBERT is loaded on first use, see `warmup`
+        self._embedding_model = None
+        self._embedding_model_lock = threading.Lock()
+        self.embedding_cache = EmbeddingCache(embedding_cache_path, EMBEDDING_MODEL, max_entries=EMBEDDING_CACHE_SIZE)
+        self.hdbscan_params = {
+            "min_cluster_size": 10,
+            "min_samples": 2,
+            "cluster_selection_epsilon": .0,
+            "max_cluster_size": None,
+            "alpha": 1.0
+        }
+        self.clusterer = HDBSCAN(**self.hdbscan_params)
         self.title_generator = TitleGenerator()
         
+    def warmup(self) -> None:
+        """
+        Loads the embedding model (and imports torch) ahead of the first embedding call.
+        """
+        self._load_embedding_model()
+        
+    @property
+    def device(self) -> "torch.device":
+        return self._load_embedding_model()[2]
+    
+    @property
+    def _tokenizer(self):
+        return self._load_embedding_model()[0]
+    
+    @property
+    def _model(self):
+        return self._load_embedding_model()[1]
+        
     def embed_cell(self, code_str: str, desc_str: str) -> list[float]:
         """
         Embeds a code snippet and its description into a vector representation.
@@ -44,11 +89,60 @@ class ClassCluster():
         """
         
         # code_embedding = self._process_code(code_str)
-        desc_embedding = self._process_summary(desc_str)
+        desc_embedding = self.embedding_cache.get(SUMMARY_POOLING, desc_str)
+        if desc_embedding is None:
+            desc_embedding = self._process_summary(desc_str).detach().cpu().numpy().reshape(-1)
+            self.embedding_cache.put(SUMMARY_POOLING, desc_str, desc_embedding)
         # return torch.mean(torch.stack([code_embedding, desc_embedding]), dim=0).detach().numpy().reshape(-1).tolist()
-        return desc_embedding.detach().numpy().reshape(-1).tolist()
+        return desc_embedding.tolist()
+    
+    def embed_cells(self, descs: list[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Embeds a list of cell descriptions in batches.
+        Descriptions are sorted by token length so that each batch is padded as little as possible,
+        and the padding is excluded from the mean pooling through the attention mask. The result is
+        numerically equivalent to calling `embed_cell` for each description.
+        Descriptions found in the embedding cache are not passed through the model.
+        Args:
+            descs (list[str]): The descriptions to be embedded.
+            batch_size (int, optional): The number of descriptions per forward pass. Defaults to 32.
+        Returns:
+            np.ndarray: A float32 matrix of shape (len(descs), hidden_size), in the order of `descs`.
+        """
+        
+        if not len(descs):
+            return np.zeros((0, self._model.config.hidden_size), dtype=np.float32)
+        
+        # Read through the embedding cache, embedding every distinct missing description once.
+        # The model is only loaded if some description is missing.
+        cached = self.embedding_cache.get_many(SUMMARY_POOLING, descs)
+        hidden_size = next((len(embedding) for embedding in cached if embedding is not None), None)
+        embeddings = np.zeros((len(descs), hidden_size or self._model.config.hidden_size), dtype=np.float32)
+        missing = {}
+        for i, (desc, embedding) in enumerate(zip(descs, cached)):
+            if embedding is None:
+                missing.setdefault(desc, []).append(i)
+            else:
+                embeddings[i] = embedding
+        if not missing:
+            return embeddings
+        missing_descs = list(missing)
         
+        # Sort by token length to minimize padding inside a batch
+        lengths = [len(ids) for ids in self._tokenizer(missing_descs, truncation=True, max_length=512)["input_ids"]]
+        order = np.argsort(lengths, kind="stable")
+        
+        for start in tqdm(range(0, len(order), batch_size), desc="Embedding cell descriptions"):
+            batch = [missing_descs[i] for i in order[start:start + batch_size]]
+            tokens = self._tokenizer(batch, return_tensors='pt', padding=True, truncation=True, max_length=512).to(self.device)
+            batch_embeddings = self._masked_mean(tokens).cpu().numpy()
+            self.embedding_cache.put_many(SUMMARY_POOLING, batch, batch_embeddings)
+            for desc, embedding in zip(batch, batch_embeddings):
+                embeddings[missing[desc]] = embedding
+        
+        return embeddings
     
+
     def cluster(self, data: dict, classes: list[str]) -> dict:
         """
         Clusters code cells in the given data dictionary based on their class.
@@ -58,53 +152,102 @@ class ClassCluster():
             dict: A dictionary with clustered code cells.
         """
         
-        cells = []
-        for notebook_idx, notebook in enumerate(data["notebooks"]):
-            cells += [{**cell, "index": cell_idx, "notebook_idx": notebook_idx} for cell_idx, cell in enumerate(notebook["cells"])]
+        # The cells are read into columns once, and every stage works on index slices of them
+        table = CellTable(data, classes)
         
-        # Generate embeddings for each code cell
-        for cell in tqdm(cells, desc="Embedding code cells and their descriptions"):
-            cell["embedding"] = self.embed_cell(clean_code(cell["code"]), cell["desc"])
+        # Generate embeddings for the distinct descriptions of all code cells in batches
+        table.embed(self.embed_cells)
+        print(f"Embedding cache: {self.embedding_cache.hits} hits, {self.embedding_cache.misses} misses")
         
-        # Group cells by class
-        grouped_cells = {label: [] for label in classes}
-        for cell in cells:
-            grouped_cells[cell["class"]].append(cell)
-        # grouped_cells = {k: list(v) for k, v in itertools.groupby(cells, lambda x: x["class"])}
+        # Group cells by class, cells without a valid class (e.g. the classifier fallback label) stay unclustered
+        table.clusters[:] = -1
+        class_indices = {class_name: table.class_indices(class_id) for class_id, class_name in enumerate(classes)}
+        
+        # Reduce, cluster and score the classes in parallel, on the embedding rows of their cells
+        results = self._cluster_classes(
+            table.embeddings, {class_name: table.desc_ids[idx] for class_name, idx in class_indices.items()}
+        )
         
-        # Cluster the cells for each class
-        clusters = {}
         descriptions_per_cluster = {}
-        for class_name, class_cells in grouped_cells.items(): 
-            print(f"Class {class_name}: {len(class_cells)} cells")
-            
-            labels = []
-            if len(class_cells) < 10:
-                labels = [-1] * len(class_cells)
-            else:
-                labels = self.cluster_class(class_cells)
-            embeddings = [cell["embedding"] for cell in class_cells]
-            descs = [cell["desc"] for cell in class_cells]
-            sil_score, ch_index, db_index = self._evaluate_clustering_accuracy(embeddings, labels)
-            
-            clusters[class_name] = {str(i): "" for i in set(labels)}
+        class_clusters = {}
+        for class_name, idx in class_indices.items(): 
+            print(f"Class {class_name}: {len(idx)} cells")
+            labels, scores = results[class_name]
+            table.clusters[idx] = labels
+            class_clusters[class_name] = (labels, table.cell_descs(idx))
+            descriptions_per_cluster[class_name] = {"titles": {}}
+            # Empty when the evaluation is disabled, so that every class has the same keys
+            descriptions_per_cluster[class_name]["accuracy"] = scores if scores is not None else {}
+        table.write_clusters(data)
         
-            for i, cell in enumerate(class_cells):
-                notebook_idx = cell["notebook_idx"]
-                cell_idx = cell["index"]
-                data["notebooks"][notebook_idx]["cells"][cell_idx]["cluster"] = int(labels[i])
-            
-            descriptions_per_cluster[class_name] = {
-                "titles": self.title_generator.generate_titles_from_descs(labels, descs),
-                "accuracy": {
-                    "silhouette_score": sil_score,
-                    "ch_index": ch_index,
-                    "db_index": db_index
-                }
+        # Title the clusters of all classes concurrently, or offline from the embeddings
+        if self.title_mode == "llm":
+            titles = self.title_generator.generate_titles_for_classes(class_clusters)
+        else:
+            titles = {
+                class_name: self.title_generator.generate_titles_from_embeddings(
+                    table.cell_embeddings(class_indices[class_name]), labels, descs, keywords=self.title_mode == "keywords"
+                )
+                for class_name, (labels, descs) in class_clusters.items()
             }
+        for class_name, class_titles in titles.items():
+            descriptions_per_cluster[class_name]["titles"] = class_titles
                     
         data["metadata"]["clusters"] = descriptions_per_cluster
+        data["metadata"]["incremental"] = {"clustered_cells": len(table), "added_cells": 0, "outlier_cells": 0}
         return data
+    
+    def add_notebooks(self, data: dict, notebooks: list[dict], classes: list[str]) -> tuple[dict, bool]:
+        """
+        Adds classified notebooks to already clustered data without reclustering everything.
+        The centroid and radius of every existing cluster are computed from the embeddings of its cells, which
+        come from the embedding cache. Each new cell joins the cluster of its class with the nearest centroid
+        (cosine distance) if it lies within that cluster's radius, otherwise it is an outlier (-1).
+        A full recluster is only run once the drift since the last one crosses a threshold: the corpus grew by
+        more than INCREMENTAL_MAX_GROWTH, or more than INCREMENTAL_MAX_OUTLIER_RATE of the added cells are outliers.
+        Args:
+            data (dict): The clustered data, as returned by `cluster`.
+            notebooks (list[dict]): The new classified notebooks.
+            classes (list[str]): The classes of the cells.
+        Returns:
+            tuple[dict, bool]: The updated data and whether a full recluster was run.
+        """
+        
+        stats = data["metadata"].get("incremental")
+        data["notebooks"] += notebooks
+        if stats is None or "clusters" not in data["metadata"]:
+            # Not clustered by this version yet, the centroids cannot be trusted
+            return self.cluster(data, classes), True
+        
+        table = CellTable(data, classes)
+        table.embed(self.embed_cells)
+        old = table.notebook_idx < len(data["notebooks"]) - len(notebooks)
+        
+        outliers = 0
+        for class_id in range(len(classes)):
+            new_idx = table.class_indices(class_id, ~old)
+            if not len(new_idx): continue
+            old_idx = table.class_indices(class_id, old)
+            labels = _assign_to_centroids(table.cell_embeddings(old_idx), table.clusters[old_idx], table.cell_embeddings(new_idx))
+            table.clusters[new_idx] = labels
+            outliers += int(np.sum(labels == -1))
+        
+        # Only the new cells and the cells without a valid class change
+        unclassified = table.class_ids == -1
+        table.clusters[unclassified] = -1
+        table.write_clusters(data, np.flatnonzero(unclassified | ~old))
+        n_new = int(np.count_nonzero(~unclassified & ~old))
+        
+        stats["added_cells"] += n_new
+        stats["outlier_cells"] += outliers
+        print(f"Assigned {n_new} new cells to existing clusters, {outliers} outliers")
+        
+        growth = stats["added_cells"] / max(stats["clustered_cells"], 1)
+        outlier_rate = stats["outlier_cells"] / max(stats["added_cells"], 1)
+        if growth > INCREMENTAL_MAX_GROWTH or outlier_rate > INCREMENTAL_MAX_OUTLIER_RATE:
+            print(f"Drift threshold crossed (growth {growth:.0%}, outliers {outlier_rate:.0%}), reclustering all cells")
+            return self.cluster(data, classes), True
+        return data, False
         
     def cluster_class(self, cells: list[dict]) -> list[int]:
         """
@@ -116,56 +259,95 @@ class ClassCluster():
         """
         
         embeddings = np.array([cell["embedding"] for cell in cells])
+        return self.cluster_embeddings(embeddings)
+    
+    def cluster_embeddings(self, embeddings: np.ndarray) -> list[int]:
+        """
+        Reduces the given embeddings with the configured reducer and clusters them with HDBSCAN,
+        reclustering the outliers once.
+        Args:
+            embeddings (np.ndarray): The embeddings to be clustered, of shape (n_samples, n_features).
+        Returns:
+            list[int]: A list of cluster labels.
+        """
         
         # Dimension reduction
-        tsne = TSNE(n_components=2, perplexity=min(len(embeddings)-1, 30), max_iter=3000)
-        reduced_embeddings = tsne.fit_transform(embeddings)
+        reduced_embeddings = self.reducer.fit_transform(embeddings)
         
         # Clustering all reduced embeddings
-        labels = []
-        if len(reduced_embeddings):
-            self.clusterer.fit(reduced_embeddings)
-            labels = self.clusterer.labels_
-            
-            # Reclustering outliers only
-            outlier_idx = np.where(labels == -1)[0]
-            outliers = reduced_embeddings[outlier_idx]
-            if len(outliers):
-                self.clusterer.fit(outliers)
-                outlier_labels = self.clusterer.labels_
-                
-                # Relabel clustererd outliers
-                max_cluster = max(labels)+1
-                for i, idx in enumerate(outlier_idx):
-                    if outlier_labels[i] != -1:
-                        labels[idx] = max_cluster + outlier_labels[i]
-        
-        return labels
+        return _hdbscan_labels(reduced_embeddings, self.hdbscan_params)
     
     
     ##############################################
     ########### Private/Helper methods ###########
     ##############################################
     
-    def _evaluate_clustering_accuracy(self, embeddings: list[list[float]], labels: list[int]) -> float:
-        sil_score = 0
-        ch_index = 0
-        db_index = 0
+    def _cluster_classes(self, embeddings: np.ndarray, class_indices: dict) -> dict:
+        """
+        Reduces, clusters and scores the cells of every class.
+        Classes are independent, so they are dispatched to a process pool. The embedding matrix is placed
+        in shared memory once and every worker reads the rows of its class from there, instead of
+        receiving a pickled copy of them. The largest classes are submitted first.
+        Args:
+            embeddings (np.ndarray): The embedding matrix.
+            class_indices (dict): The rows of `embeddings` of the cells of each class.
+        Returns:
+            dict: The (cluster labels, scores) of each class, see `clustering_scores`, the scores None if evaluation is off.
+        """
+        
+        large_classes = [class_name for class_name, idx in class_indices.items() if len(idx) >= 10]
+        n_jobs = min(self.n_jobs or os.cpu_count() or 1, len(large_classes))
+        if n_jobs <= 1:
+            return {
+                class_name: _cluster_class_job(embeddings[idx], self.reducer, self.hdbscan_params, self.evaluate)
+                for class_name, idx in class_indices.items()
+            }
+        
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        shm = SharedMemory(create=True, size=max(embeddings.nbytes, 1))
+        shared = np.ndarray(embeddings.shape, dtype=embeddings.dtype, buffer=shm.buf)
         try:
-            sil_score = silhouette_score(embeddings, labels)
-            ch_index = calinski_harabasz_score(embeddings, labels)
-            db_index = davies_bouldin_score(embeddings, labels)
-
-        except Exception as e:
-            print("[EVALUATION ERROR]", e.with_traceback())
-            sil_score = 0
-            ch_index = 0
-            db_index = 0
+            shared[:] = embeddings
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context(POOL_START_METHOD)) as executor:
+                futures = {
+                    class_name: executor.submit(
+                        _cluster_shared_class_job, shm.name, embeddings.shape, embeddings.dtype.str,
+                        class_indices[class_name], self.reducer, self.hdbscan_params, self.evaluate
+                    )
+                    for class_name in sorted(large_classes, key=lambda name: -len(class_indices[name]))
+                }
+                results = {class_name: future.result() for class_name, future in futures.items()}
         finally:
-            return sil_score, ch_index, db_index
+            # The view has to be released before the shared memory can be closed
+            del shared
+            shm.close()
+            shm.unlink()
+        
+        # Classes too small to be clustered are scored in-process
+        for class_name, idx in class_indices.items():
+            if class_name not in results:
+                results[class_name] = _cluster_class_job(embeddings[idx], self.reducer, self.hdbscan_params, self.evaluate)
+        return results
+        
         
+    def _load_embedding_model(self) -> tuple:
+        """
+        Imports torch and loads CodeBERT on first use.
+        Returns:
+            tuple: The tokenizer, the model and the device.
+        """
+        with self._embedding_model_lock:
+            if self._embedding_model is None:
+                import torch
+                from transformers import AutoTokenizer, AutoModel
+                device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+                model = AutoModel.from_pretrained(EMBEDDING_MODEL)
+                model.to(device)
+                self._embedding_model = (tokenizer, model, device)
+            return self._embedding_model
         
-    def _process_code(self, code_str, max_length=512, stride=256) -> torch.Tensor:
+    def _process_code(self, code_str, max_length=512, stride=256) -> "torch.Tensor":
         """
         Process the given code string by tokenizing it with chunking for long code strings.
         Args:
@@ -175,22 +357,30 @@ class ClassCluster():
         Returns:
             torch.Tensor: The final output tensor after processing the code string.
         """
+        import torch
+        
+        pooling = f"{CODE_POOLING}-{max_length}-{stride}"
+        cached = self.embedding_cache.get(pooling, code_str)
+        if cached is not None:
+            return torch.from_numpy(cached.copy()).unsqueeze(0).to(self.device)
         
         # Tokenization with chunking for long code strings
         tokens = self._tokenizer(code_str, return_tensors='pt', max_length=max_length, stride=stride, truncation=True).to(self.device)
         
         outputs = []
-        for i in range(0, tokens.input_ids.size(1), stride):
-            chunk = tokens.input_ids[:, i:i + max_length]
-            attention_mask_chunk = tokens.attention_mask[:, i:i + max_length]
-            output_chunk = self._model(chunk, attention_mask=attention_mask_chunk)[0]
-            outputs.append(torch.mean(output_chunk, dim=1))  # Average over the sequence length
-        
-        # Average across all chunks
-        final_output = torch.mean(torch.stack(outputs), dim=0)
+        with torch.inference_mode():
+            for i in range(0, tokens.input_ids.size(1), stride):
+                chunk = tokens.input_ids[:, i:i + max_length]
+                attention_mask_chunk = tokens.attention_mask[:, i:i + max_length]
+                output_chunk = self._model(chunk, attention_mask=attention_mask_chunk)[0]
+                outputs.append(torch.mean(output_chunk, dim=1))  # Average over the sequence length
+        
+            # Average across all chunks
+            final_output = torch.mean(torch.stack(outputs), dim=0)
+        self.embedding_cache.put(pooling, code_str, final_output.cpu().numpy())
         return final_output 
     
-    def _process_summary(self, summary_str) -> torch.Tensor:
+    def _process_summary(self, summary_str) -> "torch.Tensor":
         """
         Process the summary string by tokenizing it and passing it through the model.
         Args:
@@ -203,38 +393,118 @@ class ClassCluster():
         tokens = self._tokenizer(summary_str, return_tensors='pt', truncation=True, max_length=512).to(self.device)
         
         # Directly pass through the model
-        outputs = self._model(**tokens)
-        summary_output = torch.mean(outputs.last_hidden_state, dim=1)  # Average over the sequence length
-        return summary_output
+        return self._masked_mean(tokens)
     
-def evaluate_clustering(true_labels: np.ndarray, predicted_labels: np.ndarray) -> float:
-        
-        assert len(true_labels) == len(predicted_labels)
-        
-        unique_true_labels = np.unique(true_labels)
-        unique_predicted_labels = np.unique(predicted_labels)
-        
-        cost_matrix = np.zeros((len(unique_true_labels), len(unique_predicted_labels)), dtype=int)
-        
-        for i, true_label in enumerate(unique_true_labels):
-            for j, predicted_label in enumerate(unique_predicted_labels):
-                cost_matrix[i, j] = np.sum((true_labels == true_label) & (predicted_labels != predicted_label))
-        
-        row_ind, col_ind = linear_sum_assignment(cost_matrix)
+    def _masked_mean(self, tokens) -> "torch.Tensor":
+        """
+        Passes the tokenized batch through the model and averages the last hidden state over the
+        non-padding tokens of each sequence.
+        Args:
+            tokens (BatchEncoding): The tokenized (and possibly padded) batch.
+        Returns:
+            torch.Tensor: A tensor of shape (batch_size, hidden_size).
+        """
+        import torch
         
-        misclustered_count = cost_matrix[row_ind, col_ind].sum()
+        with torch.inference_mode():
+            last_hidden_state = self._model(**tokens).last_hidden_state
+            mask = tokens["attention_mask"].unsqueeze(-1).to(last_hidden_state.dtype)
+            summed = (last_hidden_state * mask).sum(dim=1)
+            counts = mask.sum(dim=1).clamp(min=1)
+            return (summed / counts).float()  # Average over the sequence length
+    
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _hdbscan_labels(reduced_embeddings: np.ndarray, hdbscan_params: dict) -> np.ndarray:
+    """
+    Clusters the reduced embeddings with HDBSCAN, then reclusters the outliers only.
+    Args:
+        reduced_embeddings (np.ndarray): The reduced embeddings.
+        hdbscan_params (dict): The parameters of HDBSCAN.
+    Returns:
+        np.ndarray: The cluster labels.
+    """
+    labels = []
+    if len(reduced_embeddings):
+        clusterer = HDBSCAN(**hdbscan_params)
+        clusterer.fit(reduced_embeddings)
+        labels = clusterer.labels_
         
-        return 1-(misclustered_count/len(true_labels))
+        # Reclustering outliers only
+        outlier_idx = np.where(labels == -1)[0]
+        outliers = reduced_embeddings[outlier_idx]
+        if len(outliers):
+            clusterer.fit(outliers)
+            outlier_labels = clusterer.labels_
+            
+            # Relabel clustererd outliers
+            max_cluster = max(labels)+1
+            for i, idx in enumerate(outlier_idx):
+                if outlier_labels[i] != -1:
+                    labels[idx] = max_cluster + outlier_labels[i]
     
+    return labels
+
+def _assign_to_centroids(embeddings: np.ndarray, labels: np.ndarray, new_embeddings: np.ndarray) -> np.ndarray:
+    """
+    Assigns new embeddings to the nearest cluster centroid (cosine distance), or to -1 if they lie
+    outside the radius of that cluster, i.e. farther than INCREMENTAL_RADIUS_PERCENTILE of its members.
+    Args:
+        embeddings (np.ndarray): The embeddings of the clustered cells.
+        labels (np.ndarray): The cluster labels of the clustered cells.
+        new_embeddings (np.ndarray): The embeddings to assign.
+    Returns:
+        np.ndarray: The cluster label of each new embedding.
+    """
+    clustered = labels != -1
+    if not np.any(clustered):
+        return np.full(len(new_embeddings), -1)
+    clusters, inverse = np.unique(labels[clustered], return_inverse=True)
+    members = _normalize(embeddings[clustered])
     
-def hungarian_clustering_accuracy(true_labels, predicted_labels):
-        # Create a confusion matrix
-        cm = confusion_matrix(true_labels, predicted_labels)
-        
-        # Use the Hungarian algorithm to find the optimal assignment
-        row_indices, col_indices = linear_sum_assignment(-cm)
-        
-        # Calculate the accuracy based on the optimal assignment
-        accuracy = cm[row_indices, col_indices].sum() / len(true_labels)
-        
-        return accuracy
\ No newline at end of file
+    centroids = np.zeros((len(clusters), members.shape[1]), dtype=np.float64)
+    np.add.at(centroids, inverse, members)
+    centroids = _normalize(centroids)
+    
+    # Radius of each cluster: a percentile of the cosine distances of its members to the centroid
+    member_distances = 1 - np.einsum("ij,ij->i", members, centroids[inverse])
+    radii = np.array([
+        np.percentile(member_distances[inverse == i], INCREMENTAL_RADIUS_PERCENTILE) for i in range(len(clusters))
+    ])
+    
+    distances = 1 - _normalize(new_embeddings) @ centroids.T
+    nearest = np.argmin(distances, axis=1)
+    within = distances[np.arange(len(nearest)), nearest] <= radii[nearest]
+    return np.where(within, clusters[nearest], -1)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def _cluster_class_job(embeddings: np.ndarray, reducer: Reducer, hdbscan_params: dict, evaluate: bool = True) -> tuple:
+    """
+    Reduces, clusters and scores the cells of one class. Classes with less than 10 cells are not clustered.
+    Returns:
+        tuple: The cluster labels and their scores (see `clustering_scores`), None if `evaluate` is False.
+    """
+    if len(embeddings) < 10:
+        labels = np.full(len(embeddings), -1)
+        reduced_embeddings = embeddings
+    else:
+        reduced_embeddings = reducer.fit_transform(embeddings)
+        labels = np.asarray(_hdbscan_labels(reduced_embeddings, hdbscan_params))
+    return labels, clustering_scores(embeddings, reduced_embeddings, labels) if evaluate else None
+
+def _cluster_shared_class_job(shm_name: str, shape: tuple, dtype: str, indices: np.ndarray, reducer: Reducer, hdbscan_params: dict, evaluate: bool) -> tuple:
+    """
+    Runs `_cluster_class_job` in a worker process on the rows `indices` of an embedding matrix in shared memory.
+    """
+    shm = SharedMemory(name=shm_name)
+    try:
+        # Fancy indexing copies the rows of the class out of the shared buffer
+        embeddings = np.ndarray(shape, dtype=dtype, buffer=shm.buf)[indices]
+    finally:
+        shm.close()
+    return _cluster_class_job(embeddings, reducer, hdbscan_params, evaluate)
@@ -0,0 +1,92 @@
+import numpy as np
+from typing import List, Optional
+from utils.cache import SQLiteCache, hash_key
+
+
+class EmbeddingCache():
+    """An on-disk store of embedding vectors, addressed by the content that was embedded.
+
+    Keys are derived from the model name, the pooling mode and the exact text passed to the model,
+    so a vector is only reused when it would be recomputed identically.
+
+    Attributes:
+        model_name (str): The name of the model producing the embeddings.
+    """
+
+    def __init__(self, path: str, model_name: str, max_entries: int = 500_000) -> None:
+        """Opens the embedding cache.
+
+        Args:
+            path (str): The path of the SQLite database file.
+            model_name (str): The name of the model producing the embeddings.
+            max_entries (int, optional): The maximum number of vectors kept on disk. Defaults to 500000.
+        """
+        self.model_name = model_name
+        self._store = SQLiteCache(path, max_entries=max_entries)
+
+    @property
+    def hits(self) -> int:
+        return self._store.hits
+
+    @property
+    def misses(self) -> int:
+        return self._store.misses
+
+    def get(self, pooling: str, text: str) -> Optional[np.ndarray]:
+        """Looks up the embedding of a single text.
+
+        Args:
+            pooling (str): The pooling mode used to produce the embedding.
+            text (str): The text passed to the model.
+
+        Returns:
+            Optional[np.ndarray]: The float32 embedding, or None if it is not cached.
+        """
+        return self.get_many(pooling, [text])[0]
+
+    def get_many(self, pooling: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Looks up the embeddings of several texts.
+
+        Args:
+            pooling (str): The pooling mode used to produce the embeddings.
+            texts (List[str]): The texts passed to the model.
+
+        Returns:
+            List[Optional[np.ndarray]]: The float32 embeddings in the order of `texts`, None for misses.
+        """
+        keys = [self._key(pooling, text) for text in texts]
+        found = self._store.get_many(keys)
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    def put(self, pooling: str, text: str, embedding: np.ndarray) -> None:
+        """Stores the embedding of a single text.
+
+        Args:
+            pooling (str): The pooling mode used to produce the embedding.
+            text (str): The text passed to the model.
+            embedding (np.ndarray): The embedding vector.
+        """
+        self.put_many(pooling, [text], [embedding])
+
+    def put_many(self, pooling: str, texts: List[str], embeddings) -> None:
+        """Stores the embeddings of several texts.
+
+        Args:
+            pooling (str): The pooling mode used to produce the embeddings.
+            texts (List[str]): The texts passed to the model.
+            embeddings (Iterable[np.ndarray]): The embedding vectors, in the order of `texts`.
+        """
+        self._store.put_many(
+            (self._key(pooling, text), np.asarray(embedding, dtype=np.float32).reshape(-1).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        )
+
+    def stats(self) -> dict:
+        return self._store.stats()
+
+    #######################################
+    ########### Private methods ###########
+    #######################################
+
+    def _key(self, pooling: str, text: str) -> str:
+        return hash_key(self.model_name, pooling, text)
@@ -0,0 +1,138 @@
+from typing import List, Optional
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, silhouette_score
+from utils.constants import EVALUATION_SAMPLE_SIZE, EVALUATION_SEED
+
+
+def contingency_matrix(true_labels: np.ndarray, predicted_labels: np.ndarray) -> np.ndarray:
+    """
+    Counts the samples of every (true label, predicted label) pair in one pass.
+    Args:
+        true_labels (np.ndarray): The ground truth labels.
+        predicted_labels (np.ndarray): The predicted cluster labels.
+    Returns:
+        np.ndarray: The matrix of shape (n_true_labels, n_predicted_labels), rows and columns in sorted label order.
+    """
+    true_labels = np.asarray(true_labels)
+    predicted_labels = np.asarray(predicted_labels)
+    if len(true_labels) != len(predicted_labels):
+        raise ValueError(f"Got {len(true_labels)} true labels and {len(predicted_labels)} predicted labels")
+    true_values, true_idx = np.unique(true_labels, return_inverse=True)
+    predicted_values, predicted_idx = np.unique(predicted_labels, return_inverse=True)
+    counts = np.bincount(true_idx * len(predicted_values) + predicted_idx, minlength=len(true_values) * len(predicted_values))
+    return counts.reshape(len(true_values), len(predicted_values))
+
+
+def hungarian_clustering_accuracy(true_labels: np.ndarray, predicted_labels: np.ndarray) -> float:
+    """
+    The accuracy of a clustering under the one-to-one matching of clusters to true labels that maximizes it.
+    Args:
+        true_labels (np.ndarray): The ground truth labels.
+        predicted_labels (np.ndarray): The predicted cluster labels.
+    Returns:
+        float: The fraction of samples whose cluster is matched to their true label, 0 without samples.
+    """
+    if not len(true_labels):
+        return 0.0
+    counts = contingency_matrix(true_labels, predicted_labels)
+    rows, cols = linear_sum_assignment(counts, maximize=True)
+    return float(counts[rows, cols].sum() / len(true_labels))
+
+
+def class_cluster_ids(class_ids: np.ndarray, clusters: np.ndarray) -> np.ndarray:
+    """
+    Numbers the clusters of all classes at once, since cluster labels are only unique within their class.
+    Args:
+        class_ids (np.ndarray): The class index of every sample.
+        clusters (np.ndarray): The cluster label of every sample within its class, -1 for outliers.
+    Returns:
+        np.ndarray: The int64 ids `class_id * stride + cluster + 1`, with the stride above every cluster + 1, so ids never collide.
+    """
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    clusters = np.asarray(clusters, dtype=np.int64)
+    if not len(clusters):
+        return np.zeros(0, dtype=np.int64)
+    stride = int(clusters.max()) + 2
+    return class_ids * stride + clusters + 1
+
+
+def labelled_clusters(final_json: dict, labels: List[str]) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Pairs the ground truth subclass of the labelled cells of a final JSON with their predicted cluster.
+    Cells whose class is not one of `labels` (e.g. the fallback label of a failed prediction) are not
+    clustered, so they are left out and counted instead.
+    Args:
+        final_json (dict): The final JSON, labelled cells have a "testing" entry with their "subclass_id".
+        labels (List[str]): The classes that were clustered.
+    Returns:
+        tuple[np.ndarray, np.ndarray, int]: The true subclass ids, the predicted clusters (see `class_cluster_ids`) and the number of skipped cells.
+    """
+    truths, class_ids, clusters = [], [], []
+    skipped = 0
+    for notebook in final_json["notebooks"]:
+        for cell in notebook["cells"]:
+            if "testing" not in cell:
+                continue
+            if cell["class"] not in labels or "cluster" not in cell:
+                skipped += 1
+                continue
+            class_ids.append(labels.index(cell["class"]))
+            clusters.append(int(cell["cluster"]))
+            truths.append(cell["testing"]["subclass_id"])
+    return np.array(truths), class_cluster_ids(class_ids, clusters), skipped
+
+
+def sampled_silhouette_score(
+    embeddings: np.ndarray, labels: np.ndarray, sample_size: Optional[int] = EVALUATION_SAMPLE_SIZE, seed: int = EVALUATION_SEED
+) -> float:
+    """
+    The silhouette score, computed on a fixed random sample of the embeddings when there are more than `sample_size`,
+    since the exact score takes time and memory quadratic in the number of samples.
+    Args:
+        embeddings (np.ndarray): The embeddings of the samples.
+        labels (np.ndarray): Their cluster labels.
+        sample_size (Optional[int], optional): The maximum number of samples, None for the exact score. Defaults to EVALUATION_SAMPLE_SIZE.
+        seed (int, optional): The seed of the sample, fixed so that runs are comparable. Defaults to EVALUATION_SEED.
+    Returns:
+        float: The silhouette score, 0 if it is undefined (a single cluster, or one cluster per sample).
+    """
+    if not _scorable(labels):
+        return 0.0
+    if sample_size is not None and len(labels) > sample_size:
+        sample = np.random.default_rng(seed).choice(len(labels), size=sample_size, replace=False)
+        if _scorable(np.asarray(labels)[sample]):
+            return float(silhouette_score(np.asarray(embeddings)[sample], np.asarray(labels)[sample]))
+    return float(silhouette_score(embeddings, labels))
+
+
+def clustering_scores(embeddings: np.ndarray, reduced_embeddings: np.ndarray, labels: np.ndarray) -> dict:
+    """
+    Scores the clustering of one class.
+    Args:
+        embeddings (np.ndarray): The embeddings of the cells, for the (sampled) silhouette score.
+        reduced_embeddings (np.ndarray): The reduced embeddings that were clustered, for the Calinski-Harabasz and Davies-Bouldin indices.
+        labels (np.ndarray): The cluster labels, outliers (-1) included as a cluster.
+    Returns:
+        dict: The "silhouette_score", "ch_index" and "db_index", all 0 if they are undefined or fail.
+    """
+    scores = {"silhouette_score": 0.0, "ch_index": 0.0, "db_index": 0.0}
+    if not _scorable(labels):
+        return scores
+    try:
+        scores["silhouette_score"] = sampled_silhouette_score(embeddings, labels)
+        scores["ch_index"] = float(calinski_harabasz_score(reduced_embeddings, labels))
+        scores["db_index"] = float(davies_bouldin_score(reduced_embeddings, labels))
+    except Exception as e:
+        print("[EVALUATION ERROR]", e)
+        scores = {"silhouette_score": 0.0, "ch_index": 0.0, "db_index": 0.0}
+    return scores
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _scorable(labels: np.ndarray) -> bool:
+    # The scores need between 2 and n_samples - 1 clusters
+    return 2 <= len(np.unique(labels)) <= len(labels) - 1
@@ -0,0 +1,142 @@
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+
+# Dimensionality reduction backends run before HDBSCAN, see `make_reducer`
+REDUCERS = ["tsne", "pca", "pca_tsne", "umap", "none"]
+
+
+class Reducer():
+    """Base class of the dimensionality reduction backends."""
+
+    name = None
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Reduces the given embeddings.
+        Args:
+            embeddings (np.ndarray): The embeddings, of shape (n_samples, n_features).
+        Returns:
+            np.ndarray: The reduced embeddings, of shape (n_samples, n_components).
+        """
+        raise NotImplementedError
+
+
+class TSNEReducer(Reducer):
+    """t-SNE on the full embeddings with a fixed number of iterations (the original behaviour)."""
+
+    name = "tsne"
+
+    def __init__(self, n_components: int = 2, max_iter: int = 3000) -> None:
+        self.n_components = n_components
+        self.max_iter = max_iter
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        tsne = TSNE(n_components=self.n_components, perplexity=_perplexity(embeddings), max_iter=self.max_iter)
+        return tsne.fit_transform(embeddings)
+
+
+class PCAReducer(Reducer):
+    """Linear projection on the first principal components."""
+
+    name = "pca"
+
+    def __init__(self, n_components: int = 2) -> None:
+        self.n_components = n_components
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return PCA(n_components=_components(embeddings, self.n_components)).fit_transform(embeddings)
+
+
+class PCATSNEReducer(Reducer):
+    """
+    PCA down to `pca_components` dimensions, then t-SNE with early stopping.
+    The PCA step removes most of the cost of the t-SNE neighbour search on 768-d vectors, and the
+    optimization stops once the gradient norm or the KL divergence stops improving.
+    """
+
+    name = "pca_tsne"
+
+    def __init__(
+        self, n_components: int = 2, pca_components: int = 50, max_iter: int = 1000,
+        n_iter_without_progress: int = 100, min_grad_norm: float = 1e-5
+    ) -> None:
+        self.n_components = n_components
+        self.pca_components = pca_components
+        self.max_iter = max_iter
+        self.n_iter_without_progress = n_iter_without_progress
+        self.min_grad_norm = min_grad_norm
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        reduced = PCA(n_components=_components(embeddings, self.pca_components)).fit_transform(embeddings)
+        tsne = TSNE(
+            n_components=self.n_components,
+            perplexity=_perplexity(reduced),
+            max_iter=self.max_iter,
+            n_iter_without_progress=self.n_iter_without_progress,
+            min_grad_norm=self.min_grad_norm,
+            init="pca"
+        )
+        return tsne.fit_transform(reduced)
+
+
+class UMAPReducer(Reducer):
+    """UMAP, requires the optional `umap-learn` package."""
+
+    name = "umap"
+
+    def __init__(self, n_components: int = 2, n_neighbors: int = 15, min_dist: float = 0.0, metric: str = "cosine") -> None:
+        self.n_components = n_components
+        self.n_neighbors = n_neighbors
+        self.min_dist = min_dist
+        self.metric = metric
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        try:
+            import umap
+        except ImportError as e:
+            raise ImportError("The 'umap' reducer requires the umap-learn package: pip install umap-learn") from e
+        reducer = umap.UMAP(
+            n_components=self.n_components,
+            n_neighbors=min(self.n_neighbors, len(embeddings) - 1),
+            min_dist=self.min_dist,
+            metric=self.metric
+        )
+        return reducer.fit_transform(embeddings)
+
+
+class NoReducer(PCAReducer):
+    """No 2-D projection, HDBSCAN runs directly on PCA-reduced vectors."""
+
+    name = "none"
+
+    def __init__(self, n_components: int = 50) -> None:
+        super().__init__(n_components=n_components)
+
+
+def make_reducer(name: str, **kwargs) -> Reducer:
+    """
+    Creates a dimensionality reduction backend.
+    Args:
+        name (str): One of REDUCERS.
+        **kwargs: The parameters of the backend.
+    Returns:
+        Reducer: The reducer.
+    Raises:
+        ValueError: If the name is unknown.
+    """
+    reducers = {reducer.name: reducer for reducer in [TSNEReducer, PCAReducer, PCATSNEReducer, UMAPReducer, NoReducer]}
+    if name not in reducers:
+        raise ValueError(f"Unknown reducer '{name}', expected one of {REDUCERS}")
+    return reducers[name](**kwargs)
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _perplexity(embeddings: np.ndarray) -> float:
+    return min(len(embeddings) - 1, 30)
+
+def _components(embeddings: np.ndarray, n_components: int) -> int:
+    return max(1, min(n_components, embeddings.shape[0], embeddings.shape[1]))
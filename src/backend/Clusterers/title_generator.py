@@ -1,13 +1,30 @@
 from openai import OpenAI, BadRequestError
 from typing import List
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.feature_extraction.text import TfidfVectorizer
 import re
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from utils.request_policy import RequestPolicy, request_policy
+from utils.cache import SQLiteCache, hash_key
+from utils.constants import TITLE_MODEL, TITLE_CACHE_PATH, TITLE_MAX_CONCURRENCY
+
+# Title of the clusters whose title could not be generated within the request policy
+FALLBACK_TITLE = "Untitled"
+
+# Backends titling the clusters: a GPT-4o call per cluster, the description nearest to the
+# cluster centroid, or the top TF-IDF keywords of the cluster descriptions (no LLM involved)
+TITLE_MODES = ["llm", "centroid", "keywords"]
 
 class TitleGenerator:
-    def __init__(self, api_key: str = None):
-        self.client = OpenAI()
+    def __init__(self, api_key: str = None, policy: RequestPolicy = request_policy, cache_path: str = TITLE_CACHE_PATH, max_workers: int = TITLE_MAX_CONCURRENCY):
+        self._client = None
+        self.policy = policy
+        self.max_workers = max_workers
+        self.cache_path = cache_path
+        self._cache = None
         prompt = """You are given a set of descriptions for multiple code snippets of the a same cluster. 
         Generate a title for the cluster based on the descriptions, in 6 words maximum. Mention only explicitly the name of the technologies used.
         Desired format:
@@ -19,57 +36,146 @@ class TitleGenerator:
             },
         ]
         
+    @property
+    def client(self) -> OpenAI:
+        # Created on first use, so that the offline title modes work without an OpenAI API key
+        if self._client is None:
+            # Retries are handled by the request policy
+            self._client = OpenAI(max_retries=0)
+        return self._client
+    
+    @property
+    def cache(self) -> SQLiteCache:
+        # Opened on first use, so that the offline title modes and processes that never title do not open the database
+        if self._cache is None:
+            self._cache = SQLiteCache(self.cache_path)
+        return self._cache
+        
     def generate_titles_from_descs(self, clusters, descriptions):
-        unique_clusters = set(clusters)
-        cluster_titles = {}
+        return self.generate_titles_for_classes({None: (clusters, descriptions)})[None]
+    
+    def generate_titles_for_classes(self, class_clusters: dict) -> dict:
+        """
+        Generates the titles of the clusters of several classes at once.
+        All titles are requested concurrently with at most `max_workers` requests in flight.
+        Titles are cached by the sorted descriptions of their cluster, so unchanged clusters are not titled again.
+        Args:
+            class_clusters (dict): The (cluster labels, descriptions) of the cells of each class.
+        Returns:
+            dict: The titles of each class, by cluster label.
+        """
+        
+        # Group the descriptions of each cluster in one pass
+        groups = {}
+        for class_name, (clusters, descriptions) in class_clusters.items():
+            class_groups = defaultdict(list)
+            for cluster, description in zip(clusters, descriptions):
+                class_groups[str(cluster)].append(description)
+            groups[class_name] = class_groups
+        
+        # Look up the cached titles, the remaining clusters are titled once per distinct description set
+        keys = {
+            (class_name, cluster): self._title_key(descriptions)
+            for class_name, class_groups in groups.items()
+            for cluster, descriptions in class_groups.items()
+        }
+        titles = {key: title.decode("utf-8") for key, title in self.cache.get_many(keys.values()).items()}
+        missing = {}
+        for (class_name, cluster), key in keys.items():
+            if key not in titles: missing[key] = groups[class_name][cluster]
+        
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                generated = list(tqdm(
+                    executor.map(self._title_descriptions, missing.values()),
+                    total=len(missing), desc="Generating cluster titles"
+                ))
+            titles.update(zip(missing, generated))
+            self.cache.put_many(
+                (key, title.encode("utf-8")) for key, title in zip(missing, generated) if title != FALLBACK_TITLE
+            )
         
-        for cluster in tqdm(unique_clusters):
-            cluster_descriptions = [descriptions[i] for i in range(len(descriptions)) if clusters[i] == cluster]
-            cluster_descriptions_str = "\n".join(cluster_descriptions)
-            
-            messages = self.messages.copy()
-            messages.append({
-                "role": "user",
-                "content": cluster_descriptions_str
-            })
-            title = self._gen_title(messages)
-            cluster_titles[str(cluster)] = title
-        return cluster_titles
+        return {
+            class_name: {cluster: titles[keys[(class_name, cluster)]] for cluster in class_groups}
+            for class_name, class_groups in groups.items()
+        }
 
     
-    def generate_titles_from_embeddings(self, embeddings, clusters, descriptions):
-        unique_clusters = set(clusters)
-        cluster_titles = {}
-        
-        for cluster in unique_clusters:
-            # Get the embeddings and descriptions for the current cluster
-            cluster_embeddings = [embeddings[i] for i in range(len(embeddings)) if clusters[i] == cluster]
-            cluster_descriptions = [descriptions[i] for i in range(len(descriptions)) if clusters[i] == cluster]
-            
-            # Compute the centroid of the cluster
-            centroid = self._compute_centroid(cluster_embeddings)
-            
-            # Find the nearest description
-            representative_description = self._find_nearest_description(centroid, cluster_embeddings, cluster_descriptions)
-            
-            # Optionally, you can refine this with a language model to generate a shorter title.
-            cluster_titles[str(cluster)] = representative_description
+    def generate_titles_from_embeddings(self, embeddings, clusters, descriptions, keywords: bool = False, n_keywords: int = 4):
+        """
+        Titles clusters without any LLM call.
+        The title of a cluster is the description nearest (by cosine similarity) to the cluster centroid,
+        or, with `keywords`, its top TF-IDF keywords among the descriptions of all clusters.
+        Args:
+            embeddings (np.ndarray): The embeddings of the cells, of shape (n_cells, dim).
+            clusters (list[int]): The cluster label of each cell.
+            descriptions (list[str]): The description of each cell.
+            keywords (bool, optional): Whether to title the clusters with keywords. Defaults to False.
+            n_keywords (int, optional): The number of keywords per title. Defaults to 4.
+        Returns:
+            dict: The title of each cluster, by cluster label.
+        """
+        if not len(descriptions):
+            return {}
+        unique_clusters, inverse = np.unique(np.asarray(clusters), return_inverse=True)
         
-        return cluster_titles
+        if keywords:
+            titles = self._top_keywords(inverse, len(unique_clusters), descriptions, n_keywords)
+        else:
+            nearest = self._nearest_to_centroids(np.asarray(embeddings, dtype=np.float32), inverse, len(unique_clusters))
+            titles = [descriptions[i] for i in nearest]
+        return {str(cluster): title for cluster, title in zip(unique_clusters, titles)}
     
     #######################################
     ########### Private methods ###########
     #######################################
     
-    def _compute_centroid(self, embeddings):
-        return np.mean(embeddings, axis=0)
+    def _title_key(self, descriptions: List[str]) -> str:
+        return hash_key(TITLE_MODEL, self.messages[0]["content"], json.dumps(sorted(descriptions)))
+    
+    def _title_descriptions(self, descriptions: List[str]) -> str:
+        messages = self.messages.copy()
+        messages.append({
+            "role": "user",
+            "content": "\n".join(descriptions)
+        })
+        return self._gen_title(messages)
     
-    def _find_nearest_description(self, centroid, embeddings, descriptions):
-        similarities = cosine_similarity([centroid], embeddings)[0]
-        # Find the index of the most similar embedding
-        nearest_idx = int(np.argmax(similarities))
-        # Return the description corresponding to that embedding
-        return descriptions[nearest_idx]
+    def _compute_centroids(self, embeddings: np.ndarray, inverse: np.ndarray, n_clusters: int) -> np.ndarray:
+        """Computes the centroids of all clusters at once, `inverse` being the cluster index of each embedding."""
+        sums = np.zeros((n_clusters, embeddings.shape[1]), dtype=np.float64)
+        np.add.at(sums, inverse, embeddings)
+        counts = np.bincount(inverse, minlength=n_clusters)
+        return sums / counts[:, None]
+    
+    def _nearest_to_centroids(self, embeddings: np.ndarray, inverse: np.ndarray, n_clusters: int) -> np.ndarray:
+        """Returns the index of the embedding most similar to its cluster centroid, for every cluster."""
+        centroids = self._compute_centroids(embeddings, inverse, n_clusters)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        norms = np.maximum(np.linalg.norm(embeddings, axis=1), 1e-12)
+        # Cosine similarity of every embedding with the centroid of its own cluster
+        similarities = np.einsum("ij,ij->i", embeddings, centroids[inverse]) / norms
+        # Sort by cluster, then by decreasing similarity, and keep the first embedding of each cluster
+        order = np.lexsort((-similarities, inverse))
+        return order[np.searchsorted(inverse[order], np.arange(n_clusters))]
+    
+    def _top_keywords(self, inverse: np.ndarray, n_clusters: int, descriptions: List[str], n_keywords: int) -> List[str]:
+        """Returns the top TF-IDF keywords of every cluster, each cluster being one document."""
+        documents = [[] for _ in range(n_clusters)]
+        for cluster, description in zip(inverse, descriptions):
+            documents[cluster].append(description)
+        try:
+            vectorizer = TfidfVectorizer(stop_words="english", token_pattern=r"(?u)\b[A-Za-z][A-Za-z0-9_\-]+\b")
+            tfidf = vectorizer.fit_transform([" ".join(document) for document in documents]).toarray()
+        except ValueError:
+            # Only stop words in the descriptions
+            return [FALLBACK_TITLE] * n_clusters
+        vocabulary = vectorizer.get_feature_names_out()
+        top = np.argsort(-tfidf, axis=1)[:, :n_keywords]
+        return [
+            ", ".join(vocabulary[i] for i in row if tfidf[cluster, i] > 0) or FALLBACK_TITLE
+            for cluster, row in enumerate(top)
+        ]
     
     
     def _gen_title(self, messages: List[dict], verbose: bool = False):
@@ -80,23 +186,20 @@ class TitleGenerator:
             messages (List[dict]): A list of messages exchanged between the user and the assistant.
 
         Returns:
-            str: The predicted label.
+            str: The generated title, or FALLBACK_TITLE if none could be generated within the request policy.
         """
-        title = None
-        while not title:   
-            # TODO: add timeout mechanism 
+        def request(timeout: float) -> str:
             chat_completion = self.client.chat.completions.create(
                 messages=messages,
-                model="gpt-4o"
+                model=TITLE_MODEL,
+                timeout=timeout
             )
-            response = chat_completion.choices[0].message.content
-            
-            title_generated = False
-            match = re.search(r"Title: (.+)", response)
-            
-            if match: 
-                title = match.group(1)
-                title_generated = True
-
-            if verbose and not title_generated: print(f"[ERROR] Response title invalid:\n{response}\n\nRetrying...", end="\r")
-        return title
\ No newline at end of file
+            return chat_completion.choices[0].message.content
+        
+        def parse(response: str) -> str:
+            match = re.search(r"Title: (.+)", response or "")
+            if match: return match.group(1)
+            if verbose: print(f"[ERROR] Response title invalid:\n{response}\n\nRetrying...", end="\r")
+            return None
+        
+        return self.policy.call("title", request, parse, fallback=FALLBACK_TITLE)
\ No newline at end of file
@@ -1,30 +1,40 @@
-from flask import Flask, request, jsonify, render_template
-import numpy as np
+from flask import Flask, Response, request, jsonify, render_template
 from Classifiers.GPTClassifier import GPTClassifier
-from Clusterers.clusterer import ClassCluster, hungarian_clustering_accuracy
-from utils.helper_functions import ipynb_to_json, notebook_extract_code, notebook_add_class_labels, kaggle_pull_competiton
-from utils.constants import FIRST_LAYER_LABELS, SECOND_LAYER_LABELS, BLANK_IPYNB_JSON, classifier_prompt
-from db.client import FirebaseClient
+from Clusterers.clusterer import ClassCluster
+from utils.helper_functions import ipynb_to_json, kaggle_stream_competition
+from utils.constants import FIRST_LAYER_LABELS, JOB_MAX_WORKERS, JOB_RETENTION, MIN_CODE_CELLS, UPLOAD_CHUNK_SIZE, NOTEBOOK_PAGE_SIZE, NOTEBOOK_MAX_PAGE_SIZE, NOTEBOOK_CACHE_BYTES, NOTEBOOK_CACHE_TTL, STORAGE_BACKEND, classifier_prompt
+from db.storage import make_storage
+from cli.pipeline import Pipeline
+from utils.api_key import get_api_key
+from utils.cache import hash_key
+from utils.jobs import Job, JobManager
+from utils.notebook_reader import read_notebook
+from utils.notebook_query import query_notebook, summarize_notebook
+from utils.response_cache import CachedResponse, ResponseCache
+from werkzeug.datastructures import FileStorage
+import argparse
+import functools
+import hashlib
 import json
-import tempfile
+import orjson
+import threading
+import time
 import os
-from tqdm import tqdm
+from typing import Optional
 
 app = Flask(__name__, template_folder="./template")
-client = FirebaseClient()
-with open('../../secrets/api_key.txt', 'r') as f: api_key = f'{f.read()}'
-os.environ["OPENAI_API_KEY"] = api_key
+client = make_storage(STORAGE_BACKEND)
+# Serialized GET /notebook responses, dropped when the notebook is published again
+notebook_cache = ResponseCache(max_bytes=NOTEBOOK_CACHE_BYTES, ttl=NOTEBOOK_CACHE_TTL)
+client.subscribe(notebook_cache.invalidate)
 
 LABELS = FIRST_LAYER_LABELS
 # LABELS = SECOND_LAYER_LABELS
 
-print(f"Initializing classifier...")
-classifier = GPTClassifier(
-    api_key=api_key, 
-    prompt=classifier_prompt(LABELS), 
-    labels=LABELS
-)
+# Models and clients are initialized on first use, so that the server starts in seconds, see /warmup
 clusterer = ClassCluster()
+# Pipeline runs are executed in the background, see /jobs
+jobs = JobManager(max_workers=JOB_MAX_WORKERS, retention=JOB_RETENTION)
 
 @app.route("/")
 def index():
@@ -33,10 +43,11 @@ def index():
 @app.route("/classify", methods=["POST"])
 def classify():
     """
-    Classifies a list of uploaded notebook files.
+    Submits a job classifying a list of uploaded notebook files.
+    Uploading the same files while their job is queued or running returns that job.
 
     Returns:
-        A JSON response containing the message and the classified notebooks as one condensed notebook.
+        A JSON response containing the job, see `get_job`, with the 202 status code.
     """
     try:
         files = request.files.getlist("files")
@@ -44,164 +55,153 @@ def classify():
         if not files:
             return "No files uploaded!", 400
         
-        # Initialize the final notebook which will condense all classified notebooks
-        final_json = {
-            'notebooks': [],
-            'metadata': {}
-        }
+        invalid = [file.filename for file in files if not file.filename.endswith(".ipynb")]
+        if invalid:
+            return f"Invalid file format: {invalid[0]}", 400
         
-        # Iterate over each uploaded notebook
+        # Iterate over each uploaded notebook. Werkzeug spools large uploads to disk, and only the code-relevant
+        # fields of the cells are parsed from the spooled files, so memory does not grow with the outputs
         print(f"Reading file contents...")
+        notebook_jsons = []
+        file_names = []
+        digests = []
         for notebook_id, file in enumerate(files):
-            notebook = {}
-            if not file.filename.endswith(".ipynb"):
-                return f"Invalid file format: {file.filename}", 400
-            
             # Extract relevant data from the current notebook
-            notebook_name = file.filename.split('.')[0]
-            notebook_json = ipynb_to_json(file.read())
+            # The whole stem is the name of an uploaded notebook, it is not split into "<user>_<notebook_name>"
+            notebook_name = os.path.splitext(os.path.basename(file.filename))[0]
+            digest = _upload_digest(file)
+            notebook_json = read_notebook(file.stream, min_code_cells=MIN_CODE_CELLS)
+            file.close()
             
-            if len([cell for cell in notebook_json['cells'] if cell['cell_type'] == 'code']) >= 15:
-                # Classify the code cells of the current notebook
-                print(f"Classifying notebook {notebook_name} ({notebook_id+1}/{len(files)})...", end="\r")
-                classified_cells = classifier.classify_ipynb(notebook_json, embed=False, verbose=True)
-                
-                notebook["cells"] = sorted(classified_cells, key=lambda x: (x['class'], x['cell_id']))
-                notebook["notebook_id"] = notebook_id
-                notebook["notebook_name"] = notebook_name
-                
-                final_json['notebooks'].append(notebook)
+            if notebook_json is not None:
+                notebook_jsons.append(notebook_json)
+                file_names.append(notebook_name)
+                digests.append(hash_key(notebook_name, digest))
             else:
                 print(f"Skipping notebook {notebook_name} ({notebook_id+1}/{len(files)}) due to insufficient code cells.")
 
-        # Write final_json to a JSON file (Checkpoint)
-        print("Writing classified final notebook to JSON file.") 
-        with open('../output/final_file.viz', 'w') as f: json.dump(final_json, f)
-        
-                
-        final_json = clusterer.cluster(final_json, LABELS)        
-                    
-        # Write final_json to a JSON file (Checkpoint)
-        print("overwriting clustered final notebook to JSON file.") 
-        with open('../output/final_file.viz', 'w') as f: json.dump(final_json, f)
-             
-        preds = []
-        truths = []
-        for notebook in tqdm(final_json["notebooks"], desc="Evaluating clustering accuracy"):
-            for cell in notebook["cells"]:
-                if "testing" in cell:
-                    class_id = str(LABELS.index(cell["class"]))
-                    cluster = str(int(cell["cluster"])+1)
-                    cluster = int(f"{class_id}{cluster}")
-                    preds.append(cluster)
-                    truths.append(cell["testing"]["subclass_id"])
-                    # del cell["testing"]
-        if len(preds) == len(truths) and len(preds):
-            clustering_accuracy = hungarian_clustering_accuracy(np.array(truths), np.array(preds))
-            print(f"Clustering accuracy: {clustering_accuracy*100:.2f}%")
-            final_json["metadata"]["clustering_accuracy"] = clustering_accuracy
-            
-            # Write final_json to a JSON file
-            print("Overwriting evaluated final notebook JSON file.") 
-            with open('../output/final_file.viz', 'w') as f: json.dump(final_json, f)
-       
-        
-        # Add the final notebook to the database
-        print("Uploading final notebook to Firestore DB.") 
-        client.add_notebook("final_file", final_json)
-            
-        return jsonify(final_json)
+        if not notebook_jsons:
+            return f"No notebook has at least {MIN_CODE_CELLS} code cells!", 400
+
+        key = hash_key("classify", *sorted(digests))
+        job = jobs.submit(key, _run_pipeline, f"upload_{key[:16]}", '../output/final_file.viz', "final_file", notebook_jsons, file_names)
+        return _job_response(job)
     except Exception as e:
         return jsonify({"message": f"An error occurred:\n{e.with_traceback()}"})
     
 @app.route("/<competition_name>", methods=["POST"])
 def classify_competition(competition_name: str):
     """
-    Classifies notebooks from a given competition.
+    Submits a job classifying notebooks from a given competition.
     Args:
         competition_name (str): The name of the competition.
     Returns:
-        dict: A JSON object containing the classified notebooks and metadata.
-    Raises:
-        Exception: If an error occurs during the classification process.
+        A JSON response containing the job, see `get_job`, with the 202 status code.
     """
-    
-    # Initialize the final notebook which will condense all classified notebooks
-    final_json = {
-        'notebooks': [],
-        'metadata': {}
-    }
-    
-    try:
-        notebooks = []
-        # Pull notebooks from the given competition
-        with tempfile.TemporaryDirectory() as temp_dir:
-            notebooks = kaggle_pull_competiton(competition_name, temp_dir, n_notebooks=20, verbose=True)
-        
-        for notebook_id, notebook_json in enumerate(notebooks):
-            if len([cell for cell in notebook_json['cells'] if cell['cell_type'] == 'code']) >= 15:
+    job = jobs.submit(f"competition:{competition_name}", _run_competition, competition_name)
+    return _job_response(job)
 
-                print(f"Classifying notebook ({notebook_id+1}/{len(notebooks)})...", end="\r")
-                classified_cells = classifier.classify_ipynb(notebook_json, embed=False, verbose=True)
-                
-                notebook = {}
-                notebook["cells"] = sorted(classified_cells, key=lambda x: (x['class'], x['cell_id']))
-                notebook["notebook_id"] = notebook_id
-                notebook["notebook_name"] = notebook_id
-                
-                final_json['notebooks'].append(notebook)
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    """
+    Lists the known jobs, most recent first.
+
+    Returns:
+        A JSON response containing the state of every job.
+    """
+    return jsonify([job.to_dict() for job in jobs.list()])
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    """
+    Retrieves the state of a job.
+
+    Returns:
+        A JSON response containing the status, the progress of every stage and, once the job is done,
+        the classified notebooks as one condensed notebook under "result".
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"message": f"Unknown job: {job_id}"}), 404
+    state = job.to_dict()
+    if job.status == "done":
+        state["result"] = job.result
+    return jsonify(state)
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id: str):
+    """
+    Streams the status changes and the per-stage progress of a job as Server-Sent Events.
+    The stream ends once the job is finished. A client reconnecting with the Last-Event-ID header
+    resumes after the last event it received.
+
+    Returns:
+        A text/event-stream response.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"message": f"Unknown job: {job_id}"}), 404
+    start = _last_event_id() + 1
+    
+    def stream():
+        for index, event_type, data in job.events(start):
+            if event_type == "ping":
+                yield ": ping\n\n"
             else:
-                print(f"Skipping notebook ({notebook_id+1}/{len(notebooks)}) due to insufficient code cells.")
-              
-        # Write final_json to a JSON file (Checkpoint)
-        print("Writing classified final notebook to JSON file.") 
-        with open(f'tmp/{competition_name}.json', 'w') as f: json.dump(final_json, f)  
-                
-        # Reorder cells by their class        
-        final_json = clusterer.cluster(final_json)
-                    
-        # Write final_json to a JSON file (Checkpoint)
-        print("Overwriting clustered final notebook to JSON file.") 
-        with open(f'tmp/{competition_name}.json', 'w') as f: json.dump(final_json, f)
-        
-        # Evaluate clustering accuracy            
-        preds = []
-        truths = []
-        for notebook in tqdm(final_json["notebooks"], desc="Evaluating clustering accuracy"):
-            for cell in notebook["cells"]:
-                print(cell)
-                class_id = str(LABELS.index(cell["class"]))
-                cluster = str(int(cell["cluster"])+1)
-                cluster = int(f"{class_id}{cluster}")
-                preds.append(cluster)
-                truths.append(cell["metadata"]["subclass_id"])
+                yield f"id: {index}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
                 
-        clustering_accuracy = clusterer.evaluate_clustering(np.array(truths), np.array(preds))
-        print(f"Clustering accuracy: {clustering_accuracy*100:.2f}%")
-        final_json["metadata"]["clustering_accuracy"] = clustering_accuracy
-        
-        print("Overwriting evaluated final notebook to JSON file.") 
-        with open(f'tmp/{competition_name}.json', 'w') as f: json.dump(final_json, f)
-            
-        # Add the final notebook to the database
-        client.add_notebook(f"{competition_name}", final_json)
-            
-        return jsonify(final_json)
-    except Exception as e:
-        return jsonify({"message": f"An error occurred:\n{e.with_traceback()}"})
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
         
         
+@app.route("/warmup", methods=["POST"])
+def warmup():
+    """
+    Loads the embedding model and connects to the database ahead of the first pipeline run.
+
+    Returns:
+        A JSON response containing the time taken by each component, in seconds.
+    """
+    return jsonify(_warmup())
+
+
 @app.route("/notebook/<notebook_name>", methods=["GET"])
 def get_notebook(notebook_name: str):
     """
     Retrieves a notebook from the database.
 
+    Without query parameters the whole document is returned. Otherwise:
+        - "summary=true" returns only the number of cells and the title of every cluster,
+        - "fields" (comma separated, e.g. "class,cluster,desc") projects the cells on these fields,
+        - "class", "cluster" and "notebook_id" (comma separated or repeated) filter the cells,
+        - "limit" and "cursor" page through the cells, the next page is requested with the returned "next_cursor".
+
+    Responses are served gzip-compressed from an in-process cache until the notebook is published again.
+    A client sending back the returned ETag in the If-None-Match header gets a 304 while the response is unchanged.
+
     Returns:
-        A JSON response containing the retrieved notebook.
+        A JSON response containing the retrieved notebook, one page of it, or its summary.
     """
     try:
-        notebook = client.get_notebook(notebook_name)
-        return jsonify(notebook)
+        variant = "&".join(sorted(f"{key}={value}" for key, values in request.args.lists() for value in values))
+        try:
+            limit = _limit_arg()
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        cached = notebook_cache.get(notebook_name, variant)
+        if cached is None:
+            generation = notebook_cache.generation(notebook_name)
+            try:
+                payload = _notebook_payload(notebook_name, limit)
+            except ValueError as e:
+                return jsonify({"message": str(e)}), 400
+            if payload is None:
+                return jsonify({"message": f"Unknown notebook: {notebook_name}"}), 404
+            body = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+            cached = notebook_cache.put(notebook_name, variant, body, generation=generation)
+        return _cached_response(cached)
     except Exception as e:
         return jsonify({"message": f"An error occurred:\n{e.with_traceback()}"})
     
@@ -210,11 +210,19 @@ def get_notebook(notebook_name: str):
 def evaluate():
     """OUT OF DATE
     # TODO Update this method
+    
+    The optional "context" query parameter selects the context strategy of the classifier (see CONTEXT_STRATEGIES),
+    to compare the accuracy of the bounded strategies with the full conversation.
 
     Returns:
         _type_: _description_
     """
     try:
+        evaluator = _default_classifier()
+        context = request.args.get("context")
+        if context:
+            evaluator = GPTClassifier(api_key=get_api_key(), prompt=classifier_prompt(LABELS), labels=LABELS, context=context)
+        
         total_accuracy = 0
         total_misclassification_dict = {label: {"count": 0, "misclassified": 0} for label in LABELS}
         files = request.files.getlist("files")
@@ -228,12 +236,13 @@ def evaluate():
                 return f"Invalid file format: {file.filename}", 400
             
             # Extract relevant data from the current notebook
-            notebook_name = file.filename.split('.')[0]
+            # The whole stem is the name of an uploaded notebook, it is not split into "<user>_<notebook_name>"
+            notebook_name = os.path.splitext(os.path.basename(file.filename))[0]
             notebook_json = ipynb_to_json(file.read())
             
             # Classify the code cells of the current notebook
             print(f"Classifying notebook {notebook_name} ({notebook_id+1}/{len(files)})...")
-            accuracy, misclassification_dict = classifier.evaluate(notebook_json, verbose=True)
+            accuracy, misclassification_dict, _, _ = evaluator.evaluate(notebook_json, verbose=True)
             
             total_accuracy += accuracy
             total_misclassification_dict = {
@@ -252,9 +261,162 @@ def evaluate():
             print(f"- {key}: {value['misclassified']}/{value['count']} misclassified")
             if value['count'] != 0:
                 print(f"    Accuracy: {100 - (value['misclassified']/value['count']*100):.2f}%")
-        return jsonify({"accuracy": total_accuracy})
+        return jsonify({"accuracy": total_accuracy, "context": evaluator.context})
     except Exception as e:
         return jsonify({"message": f"An error occurred:\n{e.with_traceback()}"})
 
+#####################################
+######### Private Functions #########
+#####################################
+
+def _run_pipeline(job: Job, name: str, output_filepath: str, document_name: str, notebook_jsons: list[dict], file_names: list[str]) -> dict:
+    """
+    Classifies, clusters, evaluates and uploads the given notebooks, reporting the progress to the job.
+    """
+    pipeline = Pipeline(name, output_filepath, clusterer, client=client, document_name=document_name, on_progress=job.progress, split_user=False)
+    return pipeline.run(notebook_jsons, file_names)
+
+
+def _run_competition(job: Job, competition_name: str) -> dict:
+    """
+    Pulls the notebooks of a competition and runs the pipeline on them, classifying each notebook as soon as it is pulled.
+    """
+    def notebooks():
+        job.progress("pull", {"status": "running", "notebooks": 0})
+        pulled = 0
+        for notebook_id, kernel_ref, notebook_path in kaggle_stream_competition(competition_name, n_notebooks=20, verbose=True):
+            pulled += 1
+            job.progress("pull", {"status": "running", "notebooks": pulled})
+            notebook_json = read_notebook(notebook_path, min_code_cells=MIN_CODE_CELLS)
+            if notebook_json is not None:
+                yield f"{competition_name}_{notebook_id}", notebook_json
+            else:
+                print(f"Skipping notebook {kernel_ref} due to insufficient code cells.")
+        job.progress("pull", {"status": "done", "notebooks": pulled})
+    
+    pipeline = Pipeline(competition_name, f'tmp/{competition_name}.json', clusterer, client=client, document_name=competition_name, on_progress=job.progress)
+    return pipeline.run_stream(notebooks())
+
+
+def _upload_digest(file: FileStorage) -> str:
+    """
+    Hashes an uploaded file in chunks and rewinds it.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.stream.seek(0)
+    return digest.hexdigest()
+
+
+@functools.cache
+def _default_classifier() -> GPTClassifier:
+    return GPTClassifier(
+        api_key=get_api_key(), 
+        prompt=classifier_prompt(LABELS), 
+        labels=LABELS
+    )
+
+
+def _warmup() -> dict:
+    """
+    Initializes the lazily loaded components.
+    """
+    timings = {}
+    for name, initialize in [("database", client.connect), ("embedding_model", clusterer.warmup), ("classifier", _default_classifier)]:
+        start = time.perf_counter()
+        initialize()
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def _notebook_payload(notebook_name: str, limit: int) -> Optional[dict]:
+    """
+    Applies the query parameters of GET /notebook/<notebook_name> to a stored notebook, with the page size from `_limit_arg`.
+    A page is read through `get_notebook_view`, so only the entries up to the end of the page are loaded.
+    Returns None if the notebook does not exist.
+    """
+    if not request.args:
+        return client.get_notebook(notebook_name)
+    if request.args.get("summary", "").lower() in ("1", "true"):
+        notebook = client.get_notebook(notebook_name)
+        return summarize_notebook(notebook) if notebook is not None else None
+    notebook = client.get_notebook_view(notebook_name)
+    if notebook is None:
+        return None
+    return query_notebook(
+        notebook,
+        fields=_list_arg("fields"),
+        classes=_list_arg("class"),
+        clusters=_list_arg("cluster", int),
+        notebook_ids=_list_arg("notebook_id", int),
+        cursor=request.args.get("cursor"),
+        limit=limit
+    )
+
+
+def _limit_arg() -> int:
+    """
+    Parses the "limit" query parameter of GET /notebook/<notebook_name>, capped at NOTEBOOK_MAX_PAGE_SIZE.
+
+    Raises:
+        ValueError: If the limit is not a positive integer.
+    """
+    value = request.args.get("limit", str(NOTEBOOK_PAGE_SIZE))
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f"The limit must be a positive integer, got '{value}'")
+    if limit < 1:
+        raise ValueError(f"The limit must be a positive integer, got {limit}")
+    return min(limit, NOTEBOOK_MAX_PAGE_SIZE)
+
+
+def _cached_response(cached: CachedResponse) -> Response:
+    """
+    Answers a request with a cached body: 304 if the client has it already, gzip-compressed if the client accepts it.
+    """
+    if request.if_none_match.contains(cached.etag):
+        response = Response(status=304)
+    elif "gzip" in request.accept_encodings:
+        response = Response(cached.gzip_body, mimetype="application/json", headers={"Content-Encoding": "gzip"})
+    else:
+        response = Response(cached.body, mimetype="application/json")
+    response.set_etag(cached.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def _list_arg(name: str, type: type = str) -> list:
+    """
+    Parses a list query parameter, given comma separated and/or repeated. Returns None if it is absent.
+    """
+    values = [value for arg in request.args.getlist(name) for value in arg.split(",") if value]
+    return [type(value) for value in values] if values else None
+
+
+def _last_event_id() -> int:
+    """
+    Parses the Last-Event-ID header of a reconnecting SSE client, -1 (replay every event) if it is missing or invalid.
+    """
+    try:
+        return max(-1, int(request.headers.get("Last-Event-ID", -1)))
+    except ValueError:
+        return -1
+
+
+def _job_response(job: Job):
+    state = job.to_dict()
+    state["status_url"] = f"/jobs/{job.id}"
+    state["events_url"] = f"/jobs/{job.id}/events"
+    return jsonify(state), 202
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves the notebook classification API.")
+    parser.add_argument("--warmup", action="store_true", help="Load the models in the background while the server starts")
+    args = parser.parse_args()
+    if args.warmup:
+        threading.Thread(target=_warmup, daemon=True).start()
     app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
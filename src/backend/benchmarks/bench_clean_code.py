@@ -0,0 +1,68 @@
+"""
+Measures `clean_code` on typical and pathological notebook cells.
+
+Every cell is cleaned with the memoization bypassed, so the timings are those of a first encounter.
+The pathological cells (huge string literals, unterminated quotes, many definitions without a closing
+docstring) are the inputs on which a backtracking regular expression could dominate a run. The run fails
+if cleaning any cell takes longer than the given budget.
+
+Usage (from src/backend): python benchmarks/bench_clean_code.py [--budget SECONDS] [--repeat N] [--size CHARS]
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.helper_functions import _clean_code
+
+
+def make_cells(size: int) -> dict[str, str]:
+    """
+    Builds the benchmarked cells, the pathological ones about `size` characters long.
+    """
+    typical = (
+        "import pandas as pd  # data\n"
+        "def load(path: str) -> pd.DataFrame:\n"
+        "    \"\"\"Loads the training set.\"\"\"\n"
+        "    df = pd.read_csv(path)\n"
+        "    df['tag'] = df['tag'].str.replace('#', '')  # strip hashes\n"
+        "    return df\n"
+    )
+    return {
+        "typical": typical,
+        "typical x100": typical * 100,
+        "huge string literal": "data = '" + "a#b\\'" * (size // 5) + "'\n",
+        "huge docstring": "def f():\n    \"\"\"" + "doc \" \"\" " * (size // 10) + "\"\"\"\n    pass\n",
+        "unterminated triple quote": "def f():\n    \"\"\"" + "\"\" x" * (size // 4),
+        "unterminated quote": "x = 'a" + " # b" * (size // 4),
+        "many unclosed docstrings": "def f(x):\n    \"\"\"doc\n" * (size // 25),
+        "many comments": "x = 1  # comment\n" * (size // 17),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=2.0, help="The maximum time to clean one cell, in seconds")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of timed runs per cell, the best is reported")
+    parser.add_argument("--size", type=int, default=1_000_000, help="The length of the pathological cells, in characters")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'cell':<28} {'chars':>10} {'time (ms)':>10}")
+    for name, code in make_cells(args.size).items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            _clean_code.__wrapped__(code)
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<28} {len(code):>10} {min(timings) * 1000:>10.2f}")
+        if min(timings) > args.budget:
+            failures.append(f"cleaning '{name}' takes {min(timings):.2f}s, the budget is {args.budget:.2f}s")
+
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
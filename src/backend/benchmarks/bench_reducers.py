@@ -0,0 +1,73 @@
+"""
+Compares the dimensionality reduction backends of ClassCluster on the bundled .viz datasets.
+
+For every dataset and backend, the cells of each class are reduced and clustered with HDBSCAN,
+and the wall time and the Hungarian clustering accuracy against the `testing` subclass ids are reported.
+Embeddings are read through the embedding cache, so only the first run pays for the CodeBERT forward passes.
+
+Usage (from src/backend): python benchmarks/bench_reducers.py [reducer ...] [--datasets path.viz ...]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import numpy as np
+from Clusterers.clusterer import ClassCluster
+from Clusterers.evaluation import class_cluster_ids, hungarian_clustering_accuracy
+from Clusterers.reducers import REDUCERS, make_reducer
+from utils.constants import FIRST_LAYER_LABELS
+
+DATASETS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../react_notebooks/*.viz")))
+
+
+def benchmark(clusterer: ClassCluster, data: dict, reducer: str) -> tuple[float, float]:
+    """
+    Clusters every class of a dataset with the given reducer.
+    Returns:
+        tuple[float, float]: The wall time in seconds and the clustering accuracy (NaN without testing labels).
+    """
+    cells = [cell for notebook in data["notebooks"] for cell in notebook["cells"] if cell["class"] in FIRST_LAYER_LABELS]
+    embeddings = clusterer.embed_cells([cell["desc"] for cell in cells])
+    classes = np.array([FIRST_LAYER_LABELS.index(cell["class"]) for cell in cells])
+    clusterer.reducer = make_reducer(reducer)
+
+    labels = np.full(len(cells), -1)
+    start = time.perf_counter()
+    for class_id in range(len(FIRST_LAYER_LABELS)):
+        idx = np.where(classes == class_id)[0]
+        if len(idx) >= 10:
+            labels[idx] = clusterer.cluster_embeddings(embeddings[idx])
+    elapsed = time.perf_counter() - start
+
+    testing = [i for i, cell in enumerate(cells) if "testing" in cell]
+    if not testing:
+        return elapsed, float("nan")
+    truths = np.array([cells[i]["testing"]["subclass_id"] for i in testing])
+    preds = class_cluster_ids(classes[testing], labels[testing])
+    return elapsed, hungarian_clustering_accuracy(truths, preds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("reducers", nargs="*", default=REDUCERS, help=f"Backends to compare, among {REDUCERS}")
+    parser.add_argument("--datasets", nargs="+", default=DATASETS, help="The .viz files to cluster")
+    args = parser.parse_args()
+
+    clusterer = ClassCluster(title_mode="centroid")
+    print(f"{'dataset':<32} {'reducer':<10} {'time (s)':>10} {'accuracy':>10}")
+    for path in args.datasets:
+        with open(path, "r") as f: data = json.load(f)
+        for reducer in args.reducers:
+            try:
+                elapsed, accuracy = benchmark(clusterer, data, reducer)
+            except ImportError as e:
+                print(f"{os.path.basename(path):<32} {reducer:<10} skipped: {e}")
+                continue
+            print(f"{os.path.basename(path):<32} {reducer:<10} {elapsed:>10.2f} {accuracy*100:>9.2f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures the import time of the server and the CLI with `python -X importtime`.
+
+Each entry point is imported in a fresh interpreter. The total import time and the slowest
+top-level imports are reported, and the run fails if an entry point imports one of the heavy
+packages that must only be loaded on first use (see ClassCluster.warmup and FirebaseClient.connect),
+or if it takes longer than the given budget.
+
+Usage (from src/backend): python benchmarks/bench_startup.py [module ...] [--budget SECONDS] [--top N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ENTRY_POINTS = ["app", "jupytergrader"]
+# Packages that must not be imported at startup
+DEFERRED_PACKAGES = ["torch", "transformers", "chromadb", "kaggle", "firebase_admin", "google.cloud.firestore", "graphviz", "IPython"]
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """
+    Imports a module in a fresh interpreter.
+    Returns:
+        list[tuple[str, int, int]]: The name, self time and cumulative time (in microseconds) of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS, help="The entry points to import")
+    parser.add_argument("--budget", type=float, default=5.0, help="The maximum import time of an entry point, in seconds")
+    parser.add_argument("--top", type=int, default=10, help="The number of slowest top-level imports to report")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        times = import_times(module)
+        total = next(cumulative for name, _, cumulative in reversed(times) if name.strip() == module) / 1e6
+        print(f"{module}: {total:.2f}s")
+
+        # Top-level imports are the least indented ones
+        top_level = [(name.strip(), cumulative) for name, _, cumulative in times if name.startswith(" ") and not name.startswith("  ")]
+        for name, cumulative in sorted(top_level, key=lambda x: -x[1])[:args.top]:
+            print(f"    {cumulative / 1e6:>7.3f}s  {name}")
+
+        imported = {name.strip() for name, _, _ in times}
+        deferred = [package for package in DEFERRED_PACKAGES if package in imported]
+        if deferred:
+            failures.append(f"{module} imports {', '.join(deferred)} at startup")
+        if total > args.budget:
+            failures.append(f"{module} takes {total:.2f}s to import, the budget is {args.budget:.2f}s")
+
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
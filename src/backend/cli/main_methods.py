@@ -1,17 +1,14 @@
 import sys
-import os
 from utils.helper_functions import load_notebook
 from db.client import FirebaseClient
-from Classifiers.GPTClassifier import GPTClassifier
+from Classifiers.AsyncGPTClassifier import AsyncGPTClassifier
 from utils.constants import FIRST_LAYER_LABELS, classifier_prompt
-from Clusterers.clusterer import ClassCluster, hungarian_clustering_accuracy
+from Clusterers.clusterer import ClassCluster
+from Clusterers.evaluation import hungarian_clustering_accuracy, labelled_clusters
 import json
-from tqdm import tqdm
-import numpy as np
-import concurrent.futures
+import asyncio
+from typing import Callable, Iterable
 
-with open('../../secrets/api_key.txt', 'r') as f: api_key = f'{f.read()}'
-os.environ["OPENAI_API_KEY"] = api_key
 LABELS = FIRST_LAYER_LABELS
 
 def classify_notebooks(notebook_jsons: list[dict], file_names: list[str]) -> dict: 
@@ -45,26 +42,56 @@ def classify_notebooks(notebook_jsons: list[dict], file_names: list[str]) -> dic
         'notebooks': [],
         'metadata': {}
     }
-    # results = []
-    # for notebook_json in notebook_jsons:
-    #     results.append(_classify(notebook_json))
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = list(executor.map(_classify, notebook_jsons))
-        for notebook_id, classified_cells in enumerate(results):
-            notebook = {}
-            notebook["cells"] = sorted(classified_cells, key=lambda x: (x['class'], x['cell_id']))
-            notebook["notebook_id"] = notebook_id
-            notebook["notebook_name"] = file_names[notebook_id].split('_')[-1]
-            notebook["user"] = file_names[notebook_id].split('_')[0]
-            final_json['notebooks'].append(notebook)
+    results = classify_cells(notebook_jsons)
+    for notebook_id, classified_cells in enumerate(results):
+        final_json['notebooks'].append(build_notebook(notebook_id, file_names[notebook_id], classified_cells))
             
     return final_json
 
 
+def classify_cells(notebook_jsons: Iterable[dict], on_notebook: Callable[[int, list[dict]], None] = None) -> list[list[dict]]:
+    """
+    Classifies the code cells of the given notebook JSONs concurrently.
+    
+    Parameters:
+    notebook_jsons (Iterable[dict]): The notebook JSONs to be classified, or a generator classified as it produces them.
+    on_notebook (Callable[[int, list[dict]], None], optional): Called with the index and the classified cells of each
+        notebook as soon as it is done. Defaults to None.
+    
+    Returns:
+    list[list[dict]]: The classified cells of each notebook.
+    """
+    return asyncio.run(_classify(notebook_jsons, on_notebook))
+
+
+def build_notebook(notebook_id: int, file_name: str, classified_cells: list[dict], split_user: bool = True) -> dict:
+    """
+    Builds the entry of a classified notebook in the final JSON.
+    
+    Parameters:
+    notebook_id (int): The index of the notebook in the final JSON.
+    file_name (str): The file name of the notebook, "<user>_<notebook_name>" for Kaggle notebooks.
+    classified_cells (list[dict]): The classified cells of the notebook.
+    split_user (bool, optional): Whether the file name is a Kaggle-style "<user>_<notebook_name>", False to keep
+        the whole name, e.g. for uploaded files. Defaults to True.
+    
+    Returns:
+    dict: The notebook entry.
+    """
+    return {
+        "cells": sorted(classified_cells, key=lambda x: (x['class'], x['cell_id'])),
+        "notebook_id": notebook_id,
+        "notebook_name": file_name.split('_')[-1] if split_user else file_name,
+        "user": file_name.split('_')[0] if split_user else ""
+    }
+
+
 def evaluate_clustering_accuracy(final_json: dict) -> float:
     """
     Evaluates the clustering accuracy of the given final JSON.
     
+    Labelled cells without one of the LABELS (e.g. failed predictions) are skipped, see `labelled_clusters`.
+    
     Parameters:
     final_json (dict): The final JSON to evaluate.
     
@@ -72,19 +99,12 @@ def evaluate_clustering_accuracy(final_json: dict) -> float:
     float: The clustering accuracy.
     """
     
-    preds = []
-    truths = []
-    for notebook in tqdm(final_json["notebooks"], desc="Evaluating clustering accuracy"):
-        for cell in notebook["cells"]:
-            if "testing" in cell:
-                class_id = str(LABELS.index(cell["class"]))
-                cluster = str(int(cell["cluster"])+1)
-                cluster = int(f"{class_id}{cluster}")
-                preds.append(cluster)
-                truths.append(cell["testing"]["subclass_id"])
+    truths, preds, skipped = labelled_clusters(final_json, LABELS)
+    if skipped:
+        print(f"[EVALUATION] Skipped {skipped} labelled cells without a valid class")
                 
     if len(preds) == len(truths) and len(preds):
-        return hungarian_clustering_accuracy(np.array(truths), np.array(preds))        
+        return hungarian_clustering_accuracy(truths, preds)        
     else: 
         return 0
             
@@ -93,19 +113,23 @@ def evaluate_clustering_accuracy(final_json: dict) -> float:
 ######### Private Functions ##########
 #####################################
             
-def _classify(notebook_json: dict) -> list[dict]:
+async def _classify(notebook_jsons: Iterable[dict], on_notebook: Callable[[int, list[dict]], None] = None) -> list[list[dict]]:
     """
-    Classify the given notebook JSON using the GPTClassifier.
+    Classify the given notebook JSONs concurrently using one shared AsyncGPTClassifier.
     
     Parameters:
-        notebook_json (dict): The JSON representation of the notebook to be classified.
+        notebook_jsons (Iterable[dict]): The JSON representations of the notebooks to be classified.
+        on_notebook (Callable[[int, list[dict]], None], optional): Called as soon as a notebook is done. Defaults to None.
     
     Returns:
-        list[dict]: The list of classified cells.
+        list[list[dict]]: The list of classified cells of each notebook.
     """
-    classifier = GPTClassifier(
-        api_key=api_key, 
+    classifier = AsyncGPTClassifier(
+        api_key=get_api_key(), 
         prompt=classifier_prompt(LABELS), 
         labels=LABELS
-    )   
-    return classifier.classify_ipynb(notebook_json, embed=False, verbose=False)
\ No newline at end of file
+    )
+    try:
+        return await classifier.aclassify_notebooks(notebook_jsons, verbose=False, on_notebook=on_notebook)
+    finally:
+        await classifier.aclose()
\ No newline at end of file
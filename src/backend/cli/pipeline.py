@@ -0,0 +1,242 @@
+import os
+import re
+import threading
+from typing import Callable, Iterable
+from db.storage import NotebookStorage
+from Clusterers.clusterer import ClassCluster
+from utils.cache import hash_key
+from utils.constants import CLASSIFIER_MODEL, CLASSIFIER_FALLBACK_LABEL, PIPELINE_JOURNAL_DIR, classifier_prompt
+from utils.helper_functions import save_viz
+from utils.journal import Journal
+from cli.main_methods import LABELS, build_notebook, classify_cells, evaluate_clustering_accuracy
+
+# Stages of a run, in order. Embedding and titling run inside ClassCluster.cluster and are
+# checkpointed by the embedding and title caches rather than by the journal.
+STAGES = ["load", "classify", "cluster", "evaluate", "publish"]
+
+# Clustering a corpus already fills the process pool of the classes and the embedding model, so concurrent
+# runs sharing a ClassCluster take turns clustering instead of oversubscribing the CPU
+_cluster_lock = threading.Lock()
+
+
+class Pipeline():
+    """
+    The classify -> cluster -> evaluate -> publish pipeline, resumable after a crash.
+
+    Each completed unit of work is checkpointed in an append-only journal: every notebook as soon as
+    its cells are classified, then the clustered and evaluated corpus. A run over the same notebooks
+    picks up after the last completed unit. The .viz file is written once, atomically, at the end of
+    the run, after which the journal is deleted.
+
+    Attributes:
+        name (str): The name of the run, used for the journal.
+        output_filepath (str): The path of the .viz file.
+        document_name (str): The name of the database document the result is published to.
+        journal (Journal): The checkpoints of the run.
+        on_progress (Callable[[str, dict], None]): Called with the name and the progress of a stage, e.g. to report it to a client.
+        split_user (bool): Whether the file names are Kaggle-style "<user>_<notebook_name>", see `build_notebook`.
+    """
+
+    def __init__(
+        self, name: str, output_filepath: str, clusterer: ClassCluster, client: NotebookStorage = None,
+        document_name: str = None, labels: list[str] = LABELS, journal_dir: str = PIPELINE_JOURNAL_DIR,
+        on_progress: Callable[[str, dict], None] = None, split_user: bool = True
+    ) -> None:
+        """
+        Initializes a Pipeline object and opens the journal of a previous run with the same name, if any.
+
+        Args:
+            name (str): The name of the run, used for the journal.
+            output_filepath (str): The path of the .viz file.
+            clusterer (ClassCluster): The clusterer of the classified cells.
+            client (NotebookStorage, optional): The database the result is published to, None to skip publishing. Defaults to None.
+            document_name (str, optional): The name of the database document. Defaults to the name of the run.
+            labels (list[str], optional): The classification labels. Defaults to LABELS.
+            journal_dir (str, optional): The directory of the journals. Defaults to PIPELINE_JOURNAL_DIR.
+            on_progress (Callable[[str, dict], None], optional): Called with the name and the progress of a stage. Defaults to None.
+            split_user (bool, optional): Whether the file names are Kaggle-style "<user>_<notebook_name>", False to
+                keep the whole names, e.g. of uploaded files. Defaults to True.
+        """
+        self.name = name
+        self.output_filepath = output_filepath
+        self.clusterer = clusterer
+        self.client = client
+        self.document_name = document_name or name
+        self.labels = labels
+        self.journal = Journal(os.path.join(journal_dir, f"{name}.jsonl"))
+        self.on_progress = on_progress
+        self.split_user = split_user
+
+    def run(self, notebook_jsons: list[dict], file_names: list[str]) -> dict:
+        """
+        Runs the pipeline on the given notebooks, skipping the units completed by a previous run.
+
+        Args:
+            notebook_jsons (list[dict]): The loaded notebook JSONs.
+            file_names (list[str]): The corresponding file names, "<user>_<notebook_name>".
+
+        Returns:
+            dict: The final JSON, as written to the .viz file.
+        """
+        # The journal is closed when the run ends, even if it fails
+        with self.journal:
+            keys = [self._notebook_key(notebook_json, file_name) for notebook_json, file_name in zip(notebook_jsons, file_names)]
+            # Identifies the corpus, so that checkpoints of a run over other notebooks are never reused
+            run_key = hash_key(*keys)
+            self._progress("load", {"status": "done", "notebooks": len(keys)})
+
+            final_json = self.journal.get("cluster", run_key)
+            if final_json is None:
+                classified = self.journal.completed("classify")
+                pending = [(key, notebook_json) for key, notebook_json in zip(keys, notebook_jsons) if key not in classified]
+                if len(pending) < len(keys):
+                    print(f"Resuming {self.name}: {len(keys) - len(pending)}/{len(keys)} notebooks already classified.")
+                self._classify(pending, classified, done=len(keys) - len(pending), total=len(keys))
+                final_json = self._cluster(run_key, keys, file_names, classified)
+            else:
+                print(f"Resuming {self.name} from the clustered checkpoint.")
+                self._progress("cluster", {"status": "done"})
+            return self._publish(run_key, final_json)
+
+    def run_stream(self, notebooks: Iterable[tuple[str, dict]]) -> dict:
+        """
+        Runs the pipeline on notebooks produced while it runs, e.g. downloaded: each notebook is classified
+        as soon as it is produced. The notebooks are ordered by file name in the final JSON, so that the
+        result and the checkpoints do not depend on the order in which they arrive.
+
+        Args:
+            notebooks (Iterable[tuple[str, dict]]): The file names, "<user>_<notebook_name>", and the loaded notebook JSONs.
+
+        Returns:
+            dict: The final JSON, as written to the .viz file.
+        """
+        with self.journal:
+            classified = self.journal.completed("classify")
+            loaded = {}
+        
+            def pending():
+                for file_name, notebook_json in notebooks:
+                    key = self._notebook_key(notebook_json, file_name)
+                    loaded[file_name] = key
+                    self._progress("load", {"status": "running", "notebooks": len(loaded)})
+                    if key not in classified:
+                        yield key, notebook_json
+                    
+            self._classify(pending(), classified)
+            file_names = sorted(loaded, key=_natural_key)
+            keys = [loaded[file_name] for file_name in file_names]
+            run_key = hash_key(*keys)
+            self._progress("load", {"status": "done", "notebooks": len(keys)})
+
+            final_json = self.journal.get("cluster", run_key)
+            if final_json is None:
+                final_json = self._cluster(run_key, keys, file_names, classified)
+            else:
+                print(f"Resuming {self.name} from the clustered checkpoint.")
+                self._progress("cluster", {"status": "done"})
+            return self._publish(run_key, final_json)
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _cluster(self, run_key: str, keys: list[str], file_names: list[str], classified: dict[str, list[dict]]) -> dict:
+        """
+        Builds the final JSON from the classified notebooks and clusters it, checkpointing the result.
+        """
+        final_json = {
+            'notebooks': [build_notebook(i, file_name, classified[key], split_user=self.split_user) for i, (key, file_name) in enumerate(zip(keys, file_names))],
+            'metadata': {}
+        }
+        self._progress("cluster", {"status": "running"})
+        with _cluster_lock:
+            final_json = self.clusterer.cluster(final_json, self.labels)
+        self.journal.append("cluster", run_key, final_json)
+        self._progress("cluster", {"status": "done"})
+        return final_json
+
+    def _publish(self, run_key: str, final_json: dict) -> dict:
+        """
+        Evaluates the clustered corpus, writes the .viz file, publishes it and deletes the journal.
+        """
+        clustering_accuracy = self.journal.get("evaluate", run_key)
+        if clustering_accuracy is None:
+            clustering_accuracy = evaluate_clustering_accuracy(final_json)
+            self.journal.append("evaluate", run_key, clustering_accuracy)
+        if clustering_accuracy:
+            print(f"Clustering accuracy: {clustering_accuracy*100:.2f}%")
+            final_json['metadata']['clustering_accuracy'] = clustering_accuracy
+        self._progress("evaluate", {"status": "done", "clustering_accuracy": clustering_accuracy})
+
+        print("Writing final notebook to .viz file.")
+        save_viz(final_json, self.output_filepath)
+        if self.client is not None:
+            print("Uploading final notebook to the database.")
+            self.client.add_notebook(self.document_name, final_json)
+        self._progress("publish", {"status": "done", "document": self.document_name})
+
+        # Both writes are idempotent, so a crash before this point only repeats them
+        self.journal.clear()
+        return final_json
+
+    def _classify(self, pending: Iterable[tuple[str, dict]], classified: dict[str, list[dict]], done: int = 0, total: int = None) -> None:
+        """
+        Classifies the pending notebooks into `classified`, checkpointing each one as soon as it is done.
+
+        Args:
+            pending (Iterable[tuple[str, dict]]): The keys and JSONs of the notebooks to classify, possibly a generator.
+            classified (dict[str, list[dict]]): The classified cells of every notebook, by key, completed in place.
+            done (int, optional): The number of notebooks already classified. Defaults to 0.
+            total (int, optional): The number of notebooks, None while they are streamed. Defaults to None.
+        """
+        keys = []
+        self._progress("classify", {"status": "running", "done": done, "total": total})
+
+        def notebooks():
+            for key, notebook_json in pending:
+                keys.append(key)
+                yield notebook_json
+
+        # Notebooks finish in worker threads, see `AsyncGPTClassifier.aclassify_notebooks`
+        done_lock = threading.Lock()
+
+        def on_notebook(index: int, classified_cells: list[dict]) -> None:
+            nonlocal done
+            # Notebooks with cells that fell back after failed requests are retried by the next run
+            if all(cell['class'] != CLASSIFIER_FALLBACK_LABEL for cell in classified_cells):
+                self.journal.append("classify", keys[index], classified_cells)
+            with done_lock:
+                done += 1
+                self._progress("classify", {"status": "running", "done": done, "total": total})
+
+        # Lists are classified in one go, generators as they produce the notebooks
+        if isinstance(pending, list):
+            results = classify_cells(list(notebooks()), on_notebook=on_notebook) if pending else []
+        else:
+            results = classify_cells(notebooks(), on_notebook=on_notebook)
+        for key, classified_cells in zip(keys, results):
+            classified[key] = classified_cells
+        self._progress("classify", {"status": "done", "done": done, "total": total if total is not None else done})
+
+    def _progress(self, stage: str, data: dict) -> None:
+        if self.on_progress is not None:
+            self.on_progress(stage, data)
+
+    def _notebook_key(self, notebook_json: dict, file_name: str) -> str:
+        """
+        Identifies a notebook by its name, its code and the classifier settings.
+
+        Returns:
+            str: The key of the notebook in the journal.
+        """
+        sources = ["".join(cell['source']) for cell in notebook_json['cells'] if cell['cell_type'] == 'code']
+        return hash_key(file_name, classifier_prompt(self.labels), CLASSIFIER_MODEL, *sources)
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _natural_key(file_name: str) -> list:
+    # Orders "competition_2" before "competition_10"
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", file_name)]
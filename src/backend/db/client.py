@@ -1,11 +1,20 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-from typing import List
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+from db.storage import NotebookStorage
+from utils.constants import FIRESTORE_BATCH_SIZE, FIRESTORE_BATCH_BYTES, FIRESTORE_MAX_CONCURRENCY
 
-class FirebaseClient():
+class FirebaseClient(NotebookStorage):
     """A class representing a Firebase client.
 
     This class provides methods to interact with the Firebase database.
+    The Firebase app is initialized on first use, see `connect`.
+
+    A notebook is sharded to stay below the 1 MiB limit of a Firestore document: the document
+    `notebooks/<name>` only holds the metadata and the number of entries, and every entry of the
+    "notebooks" list is a document `notebooks/<name>/entries/<index>`, written with batched writes.
+    Documents written before sharding, with the whole final JSON in one document, are still readable.
 
     Attributes:
         _db (google.cloud.firestore.Client): The Firestore client instance.
@@ -13,33 +22,79 @@ class FirebaseClient():
     """
 
     def __init__(self) -> None:
-        cred = credentials.Certificate("../../secrets/serviceAccountKey.json")
-        firebase_admin.initialize_app(cred)
-        self._db = firestore.client()
+        super().__init__()
+        self._client = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> None:
+        """Initializes the Firebase app (and imports firebase_admin) ahead of the first request."""
+        with self._lock:
+            if self._client is None:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+                cred = credentials.Certificate("../../secrets/serviceAccountKey.json")
+                firebase_admin.initialize_app(cred)
+                self._client = firestore.client()
+
+    @property
+    def _db(self):
+        if self._client is None:
+            self.connect()
+        return self._client
 
     def add_notebook(self, notebook_name: str, notebook: dict) -> None:
         """Add a labeled notebook to the database.
-        
+
+        The entries are written first, in concurrent batches, then the root document, so that the
+        root never counts entries that are not written yet. Entries left over from a larger previous
+        version are deleted last.
+
         Args:
             notebook_name (str): The name of the notebook.
-            labeled_notebook (List[str, str]): A list of tuples containing the cell code and cell label.
-        
+            notebook (dict): The final JSON.
+
         Returns:
             None
         """
-        self._db.collection("notebooks").document(notebook_name).set(notebook)
-        
-    def get_notebook(self, notebook_name: str) -> dict:
+        entries = notebook.get("notebooks", [])
+        previous = self.get_metadata(notebook_name)
+        with ThreadPoolExecutor(max_workers=FIRESTORE_MAX_CONCURRENCY) as executor:
+            list(executor.map(self._commit, self._batches(notebook_name, enumerate(entries))))
+
+        self._document(notebook_name).set({"metadata": notebook.get("metadata", {}), "n_notebooks": len(entries), "sharded": True})
+
+        if previous is not None and previous["n_notebooks"] > len(entries):
+            batch = self._db.batch()
+            for i, index in enumerate(range(len(entries), previous["n_notebooks"])):
+                if i and i % FIRESTORE_BATCH_SIZE == 0:
+                    batch.commit()
+                    batch = self._db.batch()
+                batch.delete(self._entry(notebook_name, index))
+            batch.commit()
+        self._notify(notebook_name)
+
+    def get_notebook(self, notebook_name: str) -> Optional[dict]:
         """Retrieve a notebook from the database.
 
         Args:
             notebook_name (str): The name of the notebook to retrieve.
 
         Returns:
-            dict: A dictionary representing the retrieved notebook.
+            dict: A dictionary representing the retrieved notebook, None if it does not exist. Entries deleted
+                while they are read, by a concurrent `add_notebook` of a smaller notebook, are left out.
         """
-        return self._db.collection("notebooks").document(notebook_name).get().to_dict()
-    
+        document = self._document(notebook_name).get().to_dict()
+        if document is None or not document.get("sharded"):
+            return document
+        entries = {
+            snapshot.id: snapshot.to_dict()
+            for snapshot in self._document(notebook_name).collection("entries").stream()
+        }
+        return {
+            "notebooks": [entries[_entry_id(i)] for i in range(document["n_notebooks"]) if _entry_id(i) in entries],
+            "metadata": document["metadata"]
+        }
+
     def notebook_exists(self, notebook_name: str) -> bool:
         """Check if a notebook exists in the database.
 
@@ -49,4 +104,85 @@ class FirebaseClient():
         Returns:
             bool: True if the notebook exists, False otherwise.
         """
-        return self._db.collection("notebooks").document(notebook_name).get().exists
+        return self._document(notebook_name).get().exists
+
+    def get_metadata(self, notebook_name: str) -> Optional[dict]:
+        document = self._document(notebook_name).get().to_dict()
+        if document is None:
+            return None
+        if not document.get("sharded"):
+            return {"metadata": document.get("metadata", {}), "n_notebooks": len(document.get("notebooks", []))}
+        return {"metadata": document["metadata"], "n_notebooks": document["n_notebooks"]}
+
+    def get_notebook_entries(self, notebook_name: str, indices: Iterable[int]) -> List[dict]:
+        indices = [int(i) for i in indices]
+        document = self._document(notebook_name).get().to_dict()
+        if document is None:
+            return []
+        if not document.get("sharded"):
+            entries = document.get("notebooks", [])
+            return [entries[i] for i in indices if 0 <= i < len(entries)]
+
+        indices = [i for i in indices if 0 <= i < document["n_notebooks"]]
+        snapshots = {snapshot.id: snapshot for snapshot in self._db.get_all([self._entry(notebook_name, i) for i in indices])}
+        return [snapshots[_entry_id(i)].to_dict() for i in indices if snapshots[_entry_id(i)].exists]
+
+    def set_notebook_entry(self, notebook_name: str, index: int, entry: dict) -> None:
+        metadata = self.get_metadata(notebook_name)
+        if metadata is None:
+            raise KeyError(f"Unknown notebook: {notebook_name}")
+        if index > metadata["n_notebooks"]:
+            raise IndexError(f"Entry {index} is past the end of {notebook_name} ({metadata['n_notebooks']} entries)")
+        if not self._document(notebook_name).get().to_dict().get("sharded"):
+            # Shard a document written before sharding, once
+            self.add_notebook(notebook_name, self.get_notebook(notebook_name))
+
+        self._entry(notebook_name, index).set(entry)
+        if index == metadata["n_notebooks"]:
+            self._document(notebook_name).update({"n_notebooks": index + 1})
+        self._notify(notebook_name)
+
+    def set_metadata(self, notebook_name: str, metadata: dict) -> None:
+        if not self.notebook_exists(notebook_name):
+            raise KeyError(f"Unknown notebook: {notebook_name}")
+        self._document(notebook_name).update({"metadata": metadata})
+        self._notify(notebook_name)
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _document(self, notebook_name: str):
+        return self._db.collection("notebooks").document(notebook_name)
+
+    def _entry(self, notebook_name: str, index: int):
+        return self._document(notebook_name).collection("entries").document(_entry_id(index))
+
+    def _batches(self, notebook_name: str, entries: Iterable[tuple[int, dict]]):
+        """
+        Groups the entry writes in batches within the Firestore limits on operations and payload size.
+        """
+        batch, n_operations, n_bytes = self._db.batch(), 0, 0
+        for index, entry in entries:
+            size = len(json.dumps(entry))
+            if n_operations and (n_operations == FIRESTORE_BATCH_SIZE or n_bytes + size > FIRESTORE_BATCH_BYTES):
+                yield batch
+                batch, n_operations, n_bytes = self._db.batch(), 0, 0
+            batch.set(self._entry(notebook_name, index), entry)
+            n_operations += 1
+            n_bytes += size
+        if n_operations:
+            yield batch
+
+    @staticmethod
+    def _commit(batch) -> None:
+        batch.commit()
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _entry_id(index: int) -> str:
+    # Zero-padded so that the entries are listed in order
+    return f"{index:06d}"
@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional
+from db.storage import NotebookStorage
+from utils.constants import STORAGE_SQLITE_PATH
+
+
+class SQLiteStorage(NotebookStorage):
+    """A local storage of the final JSONs in a single SQLite file, for offline runs and tests.
+
+    Every entry of the "notebooks" list of a final JSON is stored in its own row, so that single
+    entries are read and written without loading the whole document.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+    """
+
+    def __init__(self, path: str = STORAGE_SQLITE_PATH) -> None:
+        """Opens (or creates) the storage at the given path.
+
+        Args:
+            path (str, optional): The path of the SQLite database file, ":memory:" for a non-persistent storage. Defaults to STORAGE_SQLITE_PATH.
+        """
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "name TEXT PRIMARY KEY, metadata TEXT NOT NULL, n_notebooks INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "name TEXT NOT NULL, idx INTEGER NOT NULL, entry TEXT NOT NULL, PRIMARY KEY (name, idx))"
+        )
+        self._conn.commit()
+
+    def add_notebook(self, notebook_name: str, notebook: dict) -> None:
+        entries = notebook.get("notebooks", [])
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE name = ?", (notebook_name,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (name, metadata, n_notebooks) VALUES (?, ?, ?)",
+                (notebook_name, json.dumps(notebook.get("metadata", {})), len(entries))
+            )
+            self._conn.executemany(
+                "INSERT INTO entries (name, idx, entry) VALUES (?, ?, ?)",
+                [(notebook_name, i, json.dumps(entry)) for i, entry in enumerate(entries)]
+            )
+        self._notify(notebook_name)
+
+    def get_notebook(self, notebook_name: str) -> Optional[dict]:
+        with self._lock:
+            document = self._conn.execute("SELECT metadata FROM documents WHERE name = ?", (notebook_name,)).fetchone()
+            if document is None:
+                return None
+            rows = self._conn.execute("SELECT entry FROM entries WHERE name = ? ORDER BY idx", (notebook_name,)).fetchall()
+        return {"notebooks": [json.loads(entry) for entry, in rows], "metadata": json.loads(document[0])}
+
+    def get_metadata(self, notebook_name: str) -> Optional[dict]:
+        with self._lock:
+            document = self._conn.execute("SELECT metadata, n_notebooks FROM documents WHERE name = ?", (notebook_name,)).fetchone()
+        if document is None:
+            return None
+        return {"metadata": json.loads(document[0]), "n_notebooks": document[1]}
+
+    def get_notebook_entries(self, notebook_name: str, indices: Iterable[int]) -> List[dict]:
+        indices = [int(i) for i in indices]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT idx, entry FROM entries WHERE name = ? AND idx IN ({','.join('?' * len(indices))})",
+                (notebook_name, *indices)
+            ).fetchall() if indices else []
+        entries = {idx: entry for idx, entry in rows}
+        return [json.loads(entries[i]) for i in indices if i in entries]
+
+    def set_notebook_entry(self, notebook_name: str, index: int, entry: dict) -> None:
+        with self._lock, self._conn:
+            document = self._conn.execute("SELECT n_notebooks FROM documents WHERE name = ?", (notebook_name,)).fetchone()
+            if document is None:
+                raise KeyError(f"Unknown notebook: {notebook_name}")
+            if index > document[0]:
+                raise IndexError(f"Entry {index} is past the end of {notebook_name} ({document[0]} entries)")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (name, idx, entry) VALUES (?, ?, ?)",
+                (notebook_name, index, json.dumps(entry))
+            )
+            if index == document[0]:
+                self._conn.execute("UPDATE documents SET n_notebooks = ? WHERE name = ?", (index + 1, notebook_name))
+        self._notify(notebook_name)
+
+    def set_metadata(self, notebook_name: str, metadata: dict) -> None:
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE documents SET metadata = ? WHERE name = ?", (json.dumps(metadata), notebook_name)
+            ).rowcount
+        if not updated:
+            raise KeyError(f"Unknown notebook: {notebook_name}")
+        self._notify(notebook_name)
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
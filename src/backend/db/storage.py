@@ -0,0 +1,201 @@
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import Callable, Iterable, List, Optional
+from utils.constants import STORAGE_ENTRY_CHUNK_SIZE
+
+# Storage backends of the final JSONs, see `make_storage`
+STORAGE_BACKENDS = ["firestore", "sqlite"]
+
+
+class NotebookStorage(ABC):
+    """Base class of the databases storing the final JSONs (called notebooks, like their document names).
+
+    A stored notebook is split into its metadata and its entries, the items of its "notebooks" list,
+    so that single entries can be read and written without loading the whole document, see `get_notebook_view`.
+    Every write is announced to the functions registered with `subscribe`, e.g. to invalidate caches.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers = []
+
+    def subscribe(self, callback: Callable[[str], None]) -> None:
+        """Registers a function called with the name of a notebook after every write to it.
+
+        Args:
+            callback (Callable[[str], None]): The function.
+        """
+        self._subscribers.append(callback)
+
+    def connect(self) -> None:
+        """Opens the connection ahead of the first request, backends connect on first use otherwise."""
+
+    @abstractmethod
+    def add_notebook(self, notebook_name: str, notebook: dict) -> None:
+        """Stores a final JSON, replacing the previous one with the same name.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+            notebook (dict): The final JSON.
+        """
+
+    @abstractmethod
+    def get_notebook(self, notebook_name: str) -> Optional[dict]:
+        """Retrieves a whole final JSON.
+
+        Args:
+            notebook_name (str): The name of the notebook to retrieve.
+
+        Returns:
+            Optional[dict]: The final JSON, or None if the notebook does not exist.
+        """
+
+    def get_notebook_view(self, notebook_name: str, chunk_size: int = STORAGE_ENTRY_CHUNK_SIZE) -> Optional[dict]:
+        """Retrieves a final JSON whose entries are read from the database on first access, a chunk at a time.
+
+        Reading one page of a large notebook this way only loads the entries of the page.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+            chunk_size (int, optional): The number of entries read at once. Defaults to STORAGE_ENTRY_CHUNK_SIZE.
+
+        Returns:
+            Optional[dict]: The final JSON, with a NotebookEntries as its "notebooks", or None if the notebook does not exist.
+        """
+        metadata = self.get_metadata(notebook_name)
+        if metadata is None:
+            return None
+        return {
+            "notebooks": NotebookEntries(self, notebook_name, metadata["n_notebooks"], chunk_size),
+            "metadata": metadata["metadata"]
+        }
+
+    def notebook_exists(self, notebook_name: str) -> bool:
+        """Check if a notebook exists in the database.
+
+        Args:
+            notebook_name (str): The name of the notebook to check.
+
+        Returns:
+            bool: True if the notebook exists, False otherwise.
+        """
+        return self.get_metadata(notebook_name) is not None
+
+    @abstractmethod
+    def get_metadata(self, notebook_name: str) -> Optional[dict]:
+        """Retrieves the metadata of a notebook, without its entries.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+
+        Returns:
+            Optional[dict]: {"metadata": dict, "n_notebooks": int}, or None if the notebook does not exist.
+        """
+
+    @abstractmethod
+    def get_notebook_entries(self, notebook_name: str, indices: Iterable[int]) -> List[dict]:
+        """Retrieves some entries of the "notebooks" list of a notebook.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+            indices (Iterable[int]): The positions of the entries in the list.
+
+        Returns:
+            List[dict]: The entries in the order of `indices`, skipping the positions out of range.
+        """
+
+    @abstractmethod
+    def set_notebook_entry(self, notebook_name: str, index: int, entry: dict) -> None:
+        """Writes one entry of the "notebooks" list of an existing notebook.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+            index (int): The position of the entry, the length of the list to append it.
+            entry (dict): The entry.
+
+        Raises:
+            KeyError: If the notebook does not exist.
+            IndexError: If the position is past the end of the list.
+        """
+
+    @abstractmethod
+    def set_metadata(self, notebook_name: str, metadata: dict) -> None:
+        """Replaces the metadata of an existing notebook.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+            metadata (dict): The new metadata.
+
+        Raises:
+            KeyError: If the notebook does not exist.
+        """
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _notify(self, notebook_name: str) -> None:
+        for callback in self._subscribers:
+            callback(notebook_name)
+
+
+class NotebookEntries(Sequence):
+    """The "notebooks" list of a stored notebook, read with `get_notebook_entries` a chunk at a time on first access.
+
+    An entry missing when its chunk is read, because the notebook is being rewritten, reads as a notebook without cells.
+
+    Attributes:
+        notebook_name (str): The name of the notebook.
+        chunk_size (int): The number of entries read at once.
+    """
+
+    def __init__(self, storage: NotebookStorage, notebook_name: str, length: int, chunk_size: int) -> None:
+        self.notebook_name = notebook_name
+        self.chunk_size = chunk_size
+        self._storage = storage
+        self._length = length
+        self._chunks = {}
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(f"Entry {index} is out of range of {self.notebook_name} ({self._length} entries)")
+        chunk, offset = divmod(index, self.chunk_size)
+        if chunk not in self._chunks:
+            self._chunks[chunk] = self._read(chunk)
+        return self._chunks[chunk][offset]
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _read(self, chunk: int) -> List[dict]:
+        indices = range(chunk * self.chunk_size, min((chunk + 1) * self.chunk_size, self._length))
+        entries = self._storage.get_notebook_entries(self.notebook_name, indices)
+        if len(entries) != len(indices):
+            # Some entries are missing, read them one by one to know which
+            entries = [next(iter(self._storage.get_notebook_entries(self.notebook_name, [i])), {"cells": []}) for i in indices]
+        return entries
+
+
+def make_storage(backend: str, **kwargs) -> NotebookStorage:
+    """
+    Creates a storage backend.
+    Args:
+        backend (str): One of STORAGE_BACKENDS.
+        **kwargs: The parameters of the backend.
+    Returns:
+        NotebookStorage: The storage.
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend == "firestore":
+        from db.client import FirebaseClient
+        return FirebaseClient(**kwargs)
+    if backend == "sqlite":
+        from db.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(**kwargs)
+    raise ValueError(f"Unknown storage backend '{backend}', expected one of {STORAGE_BACKENDS}")
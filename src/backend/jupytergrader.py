@@ -1,58 +1,99 @@
 import sys
 import os
-from utils.helper_functions import load_notebooks, save_viz
-from db.client import FirebaseClient
-from utils.constants import FIRST_LAYER_LABELS, classifier_prompt
-from Clusterers.clusterer import ClassCluster, hungarian_clustering_accuracy
-import json
-from tqdm import tqdm
-import numpy as np
-import concurrent.futures
+import argparse
+from utils.helper_functions import iter_notebooks, load_notebooks, save_viz
+from db.storage import STORAGE_BACKENDS, make_storage
+from utils.constants import FIRST_LAYER_LABELS, STORAGE_BACKEND
+from Clusterers.clusterer import ClassCluster
 from cli.main_methods import classify_notebooks, evaluate_clustering_accuracy
+from cli.pipeline import Pipeline
+from utils.request_policy import request_policy
+from utils.viz_store import load_viz
 
 
-client = FirebaseClient()
 LABELS = FIRST_LAYER_LABELS
 clusterer = ClassCluster()
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python jupytergrader.py <notebook_directory>")
-        return
-    input_directory = sys.argv[1]
-    final_filename = input_directory.split("/")[-1]
+    parser = argparse.ArgumentParser(description="Classify and cluster the code cells of a directory of notebooks.")
+    parser.add_argument("notebook_directory", help="The directory containing the .ipynb files")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only classify the notebooks missing from the existing .viz file and assign their cells to its clusters"
+    )
+    parser.add_argument(
+        "--storage", default=STORAGE_BACKEND, choices=STORAGE_BACKENDS,
+        help="Where the final notebook is uploaded, 'sqlite' stores it locally for offline runs"
+    )
+    args = parser.parse_args()
+    client = make_storage(args.storage)
+    input_directory = args.notebook_directory
+    final_filename = input_directory.rstrip("/").split("/")[-1]
     output_filepath = f'../../react_notebooks/{final_filename}.viz'
 
     if not os.path.isdir(input_directory):
         print("Input directory does not exist.")
         return
 
-    notebook_jsons, file_names = load_notebooks(input_directory)
-    final_json = classify_notebooks(notebook_jsons, file_names)
-            
-    # Write final_json to a JSON file (Checkpoint)
-    print("Writing classified final notebook to .viz file.") 
-    save_viz(final_json, output_filepath)
-    
-    final_json = clusterer.cluster(final_json, LABELS)
-    
-    # Write final_json to a JSON file (Checkpoint)
-    print("Overwriting clustered final notebook to .viz file.") 
-    save_viz(final_json, output_filepath)
-            
-    clustering_accuracy = evaluate_clustering_accuracy(final_json)
-    if clustering_accuracy:
-        print(f"Clustering accuracy: {clustering_accuracy*100:.2f}%")
-        final_json['metadata']['clustering_accuracy'] = clustering_accuracy 
-
-        # Write final_json to a JSON file (Checkpoint)
-        print("Overwriting clustered final notebook to .viz file.")
+    if args.incremental and os.path.isfile(output_filepath):
+        notebook_jsons, file_names = load_notebooks(input_directory)
+        final_json = add_notebooks(notebook_jsons, file_names, output_filepath)
+        if final_json is None: return
+        
+        clustering_accuracy = evaluate_clustering_accuracy(final_json)
+        if clustering_accuracy:
+            print(f"Clustering accuracy: {clustering_accuracy*100:.2f}%")
+            final_json['metadata']['clustering_accuracy'] = clustering_accuracy 
+        
+        print("Writing final notebook to .viz file.") 
         save_viz(final_json, output_filepath)
         
-    # Add the final notebook to the database
-    print("Uploading final notebook to Firestore DB.") 
-    client.add_notebook("final_file", final_json)
+        # Add the final notebook to the database
+        print("Uploading final notebook to the database.") 
+        client.add_notebook("final_file", final_json)
+    else:
+        # Checkpointed run, a crashed run resumes from its last completed notebook. Notebooks are
+        # classified as soon as they are loaded
+        pipeline = Pipeline(final_filename, output_filepath, clusterer, client=client, document_name="final_file")
+        pipeline.run_stream((file_name, notebook_json) for notebook_json, file_name in iter_notebooks(input_directory))
+    
+    for stage, counters in request_policy.stats().items():
+        print(f"LLM requests ({stage}): {counters}")
+
+
+def add_notebooks(notebook_jsons: list[dict], file_names: list[str], viz_filepath: str) -> dict:
+    """
+    Classifies only the notebooks missing from an existing .viz file and adds them to its clusters.
+    
+    Parameters:
+    notebook_jsons (list[dict]): The notebook JSONs of the directory.
+    file_names (list[str]): The corresponding file names.
+    viz_filepath (str): The path of the existing .viz file.
+    
+    Returns:
+    dict: The updated final JSON, or None if there is no new notebook.
+    """
+    final_json = load_viz(viz_filepath)
+    
+    # Notebooks are identified by their user and name, as set by classify_notebooks
+    known = {(notebook.get("user"), notebook["notebook_name"]) for notebook in final_json["notebooks"]}
+    new = [
+        (notebook_json, file_name) for notebook_json, file_name in zip(notebook_jsons, file_names)
+        if (file_name.split('_')[0], file_name.split('_')[-1]) not in known
+    ]
+    if not new:
+        print("No new notebooks to add.")
+        return None
+    
+    print(f"Adding {len(new)} new notebooks to {viz_filepath}.")
+    new_json = classify_notebooks([notebook_json for notebook_json, _ in new], [file_name for _, file_name in new])
+    for offset, notebook in enumerate(new_json["notebooks"]):
+        notebook["notebook_id"] = len(final_json["notebooks"]) + offset
+    
+    final_json, reclustered = clusterer.add_notebooks(final_json, new_json["notebooks"], LABELS)
+    if not reclustered: print("Added the new notebooks without reclustering.")
+    return final_json
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules are imported as top-level packages (`utils`, `cli`, ...), as when run from src/backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,76 @@
+from utils.cache import SQLiteCache, hash_key
+
+
+def test_hash_key():
+    assert hash_key("a", "b") == hash_key("a", "b")
+    # Parts are separated, so their boundaries matter
+    assert hash_key("ab", "c") != hash_key("a", "bc")
+    assert hash_key(1) == hash_key("1")
+
+
+def test_get_and_put():
+    cache = SQLiteCache(":memory:")
+    cache.put("a", b"1")
+    cache.put_many([("b", b"2"), ("c", b"3")])
+    cache.put("a", b"4")
+
+    assert cache.get("a") == b"4"
+    assert cache.get("missing") is None
+    assert cache.get_many(["b", "c", "missing", "b"]) == {"b": b"2", "c": b"3"}
+    assert cache.stats() == {"hits": 3, "misses": 2, "entries": 3}
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SQLiteCache(":memory:", max_entries=3)
+    cache.put_many([("a", b"1"), ("b", b"2")])
+    cache.put("c", b"3")
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == b"1"
+    cache.put("d", b"4")
+
+    assert len(cache) == 3
+    assert cache.get("b") is None
+    assert cache.get_many(["a", "c", "d"]) == {"a": b"1", "c": b"3", "d": b"4"}
+
+    # Entries written together are evicted together when the batch alone exceeds the limit
+    cache.put_many([(f"k{i}", b"") for i in range(5)])
+    assert len(cache) == 3
+
+
+def test_recency_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SQLiteCache(path, max_entries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    cache.get("a")
+    cache.close()
+
+    cache = SQLiteCache(path, max_entries=2)
+    cache.put("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get_many(["a", "c"]) == {"a": b"1", "c": b"3"}
+    cache.close()
+
+
+def test_fingerprint_change_drops_entries(tmp_path):
+    path = str(tmp_path / "nested" / "cache.sqlite")
+    cache = SQLiteCache(path, fingerprint="v1")
+    cache.put("a", b"1")
+    cache.close()
+
+    cache = SQLiteCache(path, fingerprint="v1")
+    assert cache.get("a") == b"1"
+    cache.close()
+
+    cache = SQLiteCache(path, fingerprint="v2")
+    assert cache.get("a") is None
+    cache.put("b", b"2")
+    cache.close()
+
+    # Without a fingerprint the entries are kept whatever they were written with
+    cache = SQLiteCache(path)
+    assert cache.get("b") == b"2"
+    cache.close()
@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("ijson")
+pytest.importorskip("tqdm")
+
+from utils.helper_functions import clean_code, clean_notebook_code
+
+
+def _compiles(code: str) -> bool:
+    compile(code, "<cell>", "exec")
+    return True
+
+
+def test_hash_inside_strings_is_kept():
+    code = "url = 'http://x/#anchor'  # comment\ncolor = \"#fff\"\nquery = f'{a}#{b}'  # other\n"
+    assert clean_code(code) == "url = 'http://x/#anchor'  \ncolor = \"#fff\"\nquery = f'{a}#{b}'"
+
+
+def test_docstrings_are_removed():
+    code = 'def f(x):\n    """Doc with a # hash."""\n    return x  # done\n'
+    assert clean_code(code) == "def f(x):\n    \n    return x"
+
+
+def test_docstring_only_body_becomes_pass():
+    assert clean_code('def f():\n    """doc"""\n') == "def f():\n    pass"
+    cleaned = clean_code('class A:\n    def f(self):\n        """doc"""  # c\n\n    x = 1\n')
+    assert "pass" in cleaned and _compiles(cleaned)
+
+
+def test_docstring_followed_by_semicolon():
+    assert clean_code('def f(): "doc"; return 2') == "def f(): pass; return 2"
+    assert clean_code('def f():\n    "doc"; return 2\n') == "def f():\n    pass; return 2"
+    assert clean_code('def f(): "doc"') == "def f(): pass"
+
+
+def test_strings_that_are_not_docstrings_are_kept():
+    assert clean_code('def f():\n    "a" + b\n') == 'def f():\n    "a" + b'
+    assert clean_code('x = """not a docstring"""') == 'x = """not a docstring"""'
+
+
+def test_untokenizable_code_goes_through_the_fallback():
+    code = 'def f(x):\n    """doc"""\n    return "#x"  # comment\ny = "unterminated\n'
+    assert clean_code(code) == 'def f(x):\n    \n    return "#x"  \ny = "unterminated'
+
+
+def test_pathological_fallback_input_is_fast():
+    # Quadratic for a signature pattern that spans lines
+    code = '"\n' + "def f(\n" * 20_000
+    assert clean_code(code) == code.strip()
+
+
+def test_clean_notebook_code():
+    notebook = {"cells": [
+        {"cell_type": "markdown", "source": ["# Title"]},
+        {"cell_type": "code", "source": ["import os  # os\n", "x = '#'"]},
+        {"cell_type": "code", "source": 'def f():\n    """doc"""\n'},
+    ]}
+    assert clean_notebook_code(notebook) == ["import os  \nx = '#'", "def f():\n    pass"]
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("scipy")
+pytest.importorskip("sklearn")
+
+from Clusterers.evaluation import class_cluster_ids, hungarian_clustering_accuracy, labelled_clusters
+from utils.constants import CLASSIFIER_FALLBACK_DESCRIPTION, CLASSIFIER_FALLBACK_LABEL, FIRST_LAYER_LABELS
+
+
+def _cell(class_name: str, cluster: int, subclass_id: int) -> dict:
+    return {"class": class_name, "desc": "", "cluster": cluster, "testing": {"subclass_id": subclass_id}}
+
+
+def test_failed_predictions_are_skipped():
+    labels = FIRST_LAYER_LABELS
+    failed = {"class": CLASSIFIER_FALLBACK_LABEL, "desc": CLASSIFIER_FALLBACK_DESCRIPTION, "cluster": -1, "testing": {"subclass_id": 4}}
+    final_json = {"notebooks": [{"cells": [_cell(labels[0], 0, 1), failed, _cell(labels[0], 1, 2), _cell(labels[1], 0, 3)]}]}
+
+    truths, preds, skipped = labelled_clusters(final_json, labels)
+
+    assert CLASSIFIER_FALLBACK_LABEL not in labels
+    assert skipped == 1
+    assert truths.tolist() == [1, 2, 3]
+    assert preds.tolist() == [1, 2, 4]
+    assert hungarian_clustering_accuracy(truths, preds) == 1.0
+
+
+def test_unlabelled_and_unclustered_cells():
+    labels = FIRST_LAYER_LABELS
+    unlabelled = {"class": labels[0], "desc": "", "cluster": 0}
+    unclustered = {"class": CLASSIFIER_FALLBACK_LABEL, "desc": "", "testing": {"subclass_id": 1}}
+
+    truths, preds, skipped = labelled_clusters({"notebooks": [{"cells": [unlabelled, unclustered]}]}, labels)
+
+    assert skipped == 1
+    assert len(truths) == len(preds) == 0
+    assert hungarian_clustering_accuracy(truths, preds) == 0.0
+
+
+def test_cluster_ids_do_not_collide_across_classes():
+    labels = FIRST_LAYER_LABELS
+    # Class 0 has 12 clusters, so "<class><cluster + 1>" ids would merge its clusters 9 and 10 into class 1's
+    cells = [_cell(labels[0], cluster, cluster + 1) for cluster in range(12)]
+    cells += [_cell(labels[1], -1, 100), _cell(labels[1], 0, 101)]
+
+    truths, preds, _ = labelled_clusters({"notebooks": [{"cells": cells}]}, labels)
+
+    assert len(set(preds.tolist())) == len(cells)
+    assert hungarian_clustering_accuracy(truths, preds) == 1.0
+
+
+def test_class_cluster_ids():
+    assert class_cluster_ids([0, 0, 1, 1], [9, -1, -1, 0]).tolist() == [10, 0, 11, 12]
+    assert class_cluster_ids([], []).tolist() == []
@@ -0,0 +1,69 @@
+import threading
+
+from utils.journal import Journal
+
+
+def test_records_are_read_back(tmp_path):
+    path = str(tmp_path / "runs" / "run.jsonl")
+    with Journal(path) as journal:
+        journal.append("classify", "nb1", {"cells": [1, 2]})
+        journal.append("classify", "nb2")
+        journal.append("embed", "nb1", [0.5])
+        # Later records replace earlier ones
+        journal.append("classify", "nb1", {"cells": [3]})
+        assert journal.get("classify", "nb1") == {"cells": [3]}
+
+    journal = Journal(path)
+    assert journal.completed("classify") == {"nb1": {"cells": [3]}, "nb2": None}
+    assert journal.get("embed", "nb1") == [0.5]
+    assert journal.get("embed", "nb2") is None
+    assert journal.completed("cluster") == {}
+
+
+def test_partial_line_is_ignored_and_terminated(tmp_path):
+    path = tmp_path / "run.jsonl"
+    with Journal(str(path)) as journal:
+        journal.append("classify", "nb1", 1)
+    # A crash while writing the second record
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"stage": "classify", "key": "nb2", "da')
+
+    journal = Journal(str(path))
+    assert journal.completed("classify") == {"nb1": 1}
+
+    # The next record starts on a new line instead of extending the partial one
+    journal.append("classify", "nb3", 3)
+    journal.close()
+    assert Journal(str(path)).completed("classify") == {"nb1": 1, "nb3": 3}
+    assert path.read_text(encoding="utf-8").endswith('"da\n{"stage": "classify", "key": "nb3", "data": 3}\n')
+
+
+def test_clear_deletes_the_journal(tmp_path):
+    path = tmp_path / "run.jsonl"
+    journal = Journal(str(path))
+    journal.append("classify", "nb1", 1)
+    journal.clear()
+
+    assert not path.exists()
+    assert journal.completed("classify") == {}
+    journal.append("classify", "nb2", 2)
+    journal.close()
+    assert Journal(str(path)).completed("classify") == {"nb2": 2}
+
+
+def test_concurrent_appends(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    journal = Journal(path)
+
+    def append(thread_id):
+        for i in range(50):
+            journal.append("classify", f"{thread_id}-{i}", i)
+
+    threads = [threading.Thread(target=append, args=(thread_id,)) for thread_id in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    assert len(Journal(path).completed("classify")) == 200
@@ -0,0 +1,25 @@
+import pytest
+
+from utils.notebook_query import query_notebook
+
+
+def _final_json(n_cells: int) -> dict:
+    cells = [{"cell_id": i, "class": "A", "cluster": 0, "desc": "", "code": ""} for i in range(n_cells)]
+    return {"notebooks": [{"notebook_id": 0, "notebook_name": "n", "user": "u", "cells": cells}], "metadata": {}}
+
+
+@pytest.mark.parametrize("limit", [0, -1, 1.5, True])
+def test_invalid_limit_is_rejected(limit):
+    with pytest.raises(ValueError):
+        query_notebook(_final_json(3), limit=limit)
+
+
+def test_pages_cover_every_cell_once():
+    final_json, cursor, cell_ids = _final_json(5), None, []
+    while True:
+        page = query_notebook(final_json, cursor=cursor, limit=2)
+        cell_ids += [cell["cell_id"] for notebook in page["notebooks"] for cell in notebook["cells"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert cell_ids == list(range(5))
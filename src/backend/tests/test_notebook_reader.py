@@ -0,0 +1,48 @@
+import json
+import pytest
+
+ijson = pytest.importorskip("ijson")
+pytest.importorskip("tqdm")
+
+import utils.notebook_reader as notebook_reader
+from utils.helper_functions import iter_notebooks
+
+# Stands for a large output (e.g. a base64 image), it must never be part of a built value
+PAYLOAD = "iVBORw0KGgo" * 1000
+
+
+def _notebook(n_code_cells: int) -> dict:
+    cell = {
+        "cell_type": "code",
+        "metadata": {"tags": ["train"]},
+        "outputs": [{"output_type": "display_data", "data": {"image/png": PAYLOAD}, "metadata": {}}],
+        "source": ["import pandas as pd\n", "df = pd.read_csv('train.csv')"],
+        "attachments": {"plot.png": {"image/png": PAYLOAD}},
+    }
+    return {"cells": [cell] * n_code_cells + [{"cell_type": "markdown", "metadata": {}, "source": "# Title"}], "metadata": {}, "nbformat": 4}
+
+
+class _RecordingBuilder(ijson.ObjectBuilder):
+    values = []
+
+    def event(self, event, value):
+        _RecordingBuilder.values.append(value)
+        super().event(event, value)
+
+
+def test_iter_notebooks_never_materializes_outputs(tmp_path, monkeypatch):
+    for name, n_code_cells in [("user_kept.ipynb", 3), ("user_short.ipynb", 1)]:
+        (tmp_path / name).write_text(json.dumps(_notebook(n_code_cells)))
+    monkeypatch.setattr(notebook_reader.ijson, "ObjectBuilder", _RecordingBuilder)
+    _RecordingBuilder.values = []
+
+    notebooks = list(iter_notebooks(str(tmp_path), min_code_cells=2, n_jobs=1))
+
+    assert [file for _, file in notebooks] == ["user_kept.ipynb"]
+    cells = notebooks[0][0]["cells"]
+    assert len(cells) == 4
+    assert all(set(cell) <= set(notebook_reader.CELL_FIELDS) for cell in cells)
+    assert cells[0]["source"] == ["import pandas as pd\n", "df = pd.read_csv('train.csv')"]
+    assert cells[0]["metadata"] == {"tags": ["train"]}
+    # Only the kept fields are built, the outputs and attachments are skipped as parser events
+    assert _RecordingBuilder.values and PAYLOAD not in _RecordingBuilder.values
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+
+import pytest
+
+from utils import rate_limit
+from utils.rate_limit import ConcurrencyLimiter, RateLimiter, TokenBucket, estimate_tokens, shared_limiters
+
+
+class _Clock():
+    """A fake monotonic clock, advanced by the fake sleep."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    monkeypatch.setattr(rate_limit.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def test_token_bucket_bursts_then_waits_for_the_refill(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=3)
+
+    async def main():
+        for _ in range(5):
+            await bucket.acquire()
+
+    asyncio.run(main())
+    # The first 3 units are the burst, then one unit is refilled every second
+    assert clock.sleeps == pytest.approx([1.0, 1.0])
+
+
+def test_token_bucket_reservations_are_served_in_order(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+
+    async def main():
+        # Reserved at the same time: the second caller waits behind the debt of the first one
+        await asyncio.gather(bucket.acquire(10), bucket.acquire(5))
+
+    asyncio.run(main())
+    assert clock.sleeps == pytest.approx([5.0])
+
+
+def test_token_bucket_clamps_large_requests_and_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+
+    async def main():
+        await bucket.acquire(100)
+        clock.now += 3600
+        await bucket.acquire(10)
+        await bucket.acquire(1)
+
+    asyncio.run(main())
+    assert clock.sleeps == pytest.approx([1.0])
+
+
+def test_token_bucket_adjust(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+    # Giving back more than was taken does not exceed the capacity
+    bucket.adjust(-5)
+    bucket.adjust(12)
+
+    asyncio.run(bucket.acquire(1))
+    assert clock.sleeps == pytest.approx([3.0])
+
+
+def test_rate_limiter_settles_the_real_usage(clock):
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+
+    async def main():
+        await limiter.acquire(500)
+        limiter.settle(500, 100)
+        await limiter.acquire(500)
+
+    asyncio.run(main())
+    assert clock.sleeps == []
+
+
+def test_concurrency_limiter_limits_holders_in_fifo_order():
+    limiter = ConcurrencyLimiter(2)
+    active, max_active, order = 0, 0, []
+
+    async def work(i):
+        nonlocal active, max_active
+        async with limiter:
+            order.append(i)
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    async def main():
+        await asyncio.gather(*(work(i) for i in range(6)))
+
+    asyncio.run(main())
+    assert max_active == 2
+    assert order == list(range(6))
+    assert limiter._active == 0
+
+
+def test_concurrency_limiter_cancelled_waiter_does_not_leak_a_slot():
+    limiter = ConcurrencyLimiter(1)
+
+    async def hold(event):
+        async with limiter:
+            await event.wait()
+
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(asyncio.Event()))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await holder
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        # The slot is free again
+        await asyncio.wait_for(hold(release), timeout=1)
+
+    asyncio.run(main())
+    assert limiter._active == 0
+
+
+def test_concurrency_limiter_is_shared_between_event_loops():
+    limiter = ConcurrencyLimiter(2)
+    lock = threading.Lock()
+    active, max_active = 0, 0
+
+    async def work():
+        nonlocal active, max_active
+        async with limiter:
+            with lock:
+                active += 1
+                max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            with lock:
+                active -= 1
+
+    def run_loop():
+        async def main():
+            await asyncio.gather(*(work() for _ in range(5)))
+        asyncio.run(main())
+
+    threads = [threading.Thread(target=run_loop) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert max_active == 2
+    assert limiter._active == 0
+
+
+def test_shared_limiters_are_per_key_and_model():
+    first = shared_limiters("test-key", "test-model", 10, 100, 2)
+    assert shared_limiters("test-key", "test-model", 20, 200, 4) is first
+    assert shared_limiters("test-key", "other-model", 10, 100, 2) is not first
+    assert first[1].limit == 2
+
+
+def test_estimate_tokens():
+    messages = [{"role": "system", "content": "x" * 40}, {"role": "user", "content": ""}]
+    assert estimate_tokens(messages, completion_tokens=0) == 18
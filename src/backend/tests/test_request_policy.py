@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+openai = pytest.importorskip("openai")
+
+from utils.request_policy import RequestPolicy
+
+
+def _error(error_type: type) -> Exception:
+    # The API errors expect an HTTP request or response, which the policy never reads
+    return error_type.__new__(error_type)
+
+
+def _requests(*outcomes):
+    """
+    Returns a request function replaying the given outcomes (response contents or errors to raise), and the timeouts it was called with.
+    """
+    outcomes = list(outcomes)
+    timeouts = []
+
+    def request(timeout):
+        timeouts.append(timeout)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return request, timeouts
+
+
+def _parse(response: str):
+    return response.upper() if response.startswith("ok") else None
+
+
+def _policy(**kwargs) -> RequestPolicy:
+    return RequestPolicy(timeout=5.0, backoff_base=0.0, backoff_max=0.0, **kwargs)
+
+
+def test_first_attempt_succeeds():
+    policy = _policy()
+    request, timeouts = _requests("ok")
+
+    assert policy.call("classify", request, _parse, fallback="fallback") == "OK"
+    assert timeouts == [5.0]
+    assert policy.stats("classify") == {"calls": 1, "retries": 0, "timeouts": 0, "errors": 0, "parse_failures": 0, "fallbacks": 0}
+
+
+def test_transient_errors_and_parse_failures_are_retried():
+    policy = _policy(max_attempts=5)
+    request, timeouts = _requests(_error(openai.APITimeoutError), _error(openai.RateLimitError), "invalid", _error(openai.InternalServerError), "ok 2")
+
+    assert policy.call("classify", request, _parse, fallback="fallback") == "OK 2"
+    assert len(timeouts) == 5
+    assert policy.stats("classify") == {"calls": 1, "retries": 4, "timeouts": 1, "errors": 2, "parse_failures": 1, "fallbacks": 0}
+
+
+def test_fallback_once_attempts_are_used_up():
+    policy = _policy(max_attempts=3)
+    request, timeouts = _requests(_error(openai.APIConnectionError), "invalid", "invalid", "ok")
+
+    assert policy.call("title", request, _parse, fallback="fallback") == "fallback"
+    assert len(timeouts) == 3
+    assert policy.stats("title")["fallbacks"] == 1
+    assert policy.stats("title")["parse_failures"] == 2
+
+
+def test_rejected_requests_are_not_retried():
+    policy = _policy()
+    request, timeouts = _requests(_error(openai.BadRequestError), "ok")
+
+    assert policy.call("classify", request, _parse, fallback="fallback") == "fallback"
+    assert len(timeouts) == 1
+    assert policy.stats("classify")["errors"] == 1
+
+
+def test_other_errors_are_raised():
+    policy = _policy()
+    request, _ = _requests(ValueError("not an API error"))
+
+    with pytest.raises(ValueError):
+        policy.call("classify", request, _parse)
+
+
+def test_async_call_retries_and_falls_back():
+    policy = _policy(max_attempts=3)
+    request, timeouts = _requests(_error(openai.APITimeoutError), "ok async")
+
+    async def arequest(timeout):
+        return request(timeout)
+
+    assert asyncio.run(policy.acall("classify", arequest, _parse, fallback="fallback")) == "OK ASYNC"
+    assert len(timeouts) == 2
+
+    request, timeouts = _requests("invalid", "invalid", "invalid")
+    assert asyncio.run(policy.acall("classify", arequest, _parse, fallback="fallback")) == "fallback"
+    assert len(timeouts) == 3
+    assert policy.stats() == {"classify": {"calls": 2, "retries": 3, "timeouts": 1, "errors": 0, "parse_failures": 3, "fallbacks": 1}}
+
+
+def test_backoff_is_bounded():
+    policy = RequestPolicy(backoff_base=1.0, backoff_max=3.0)
+    for attempt, bound in [(1, 1.0), (2, 2.0), (3, 3.0), (10, 3.0)]:
+        assert all(0 <= policy.backoff(attempt) <= bound for _ in range(100))
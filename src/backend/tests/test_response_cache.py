@@ -0,0 +1,103 @@
+import gzip
+
+from utils import response_cache
+from utils.response_cache import CachedResponse, ResponseCache
+
+
+class _Clock():
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_etag_identifies_the_body():
+    body = b'{"notebooks": []}' * 100
+    response = CachedResponse(body)
+
+    assert response.etag == CachedResponse(body).etag
+    assert response.etag != CachedResponse(body + b" ").etag
+    assert response.body == body
+    assert gzip.decompress(response.gzip_body) == body
+    assert len(response.gzip_body) < len(body)
+
+
+def test_get_and_put_by_variant():
+    cache = ResponseCache(max_bytes=1 << 20, ttl=60)
+    stored = cache.put("nb", "summary", b"summary")
+    cache.put("nb", "", b"whole")
+
+    assert cache.get("nb", "summary") is stored
+    assert cache.get("nb").body == b"whole"
+    assert cache.get("nb", "limit=10") is None
+    assert cache.get("other") is None
+    # Replacing an entry changes its ETag
+    assert cache.put("nb", "summary", b"new summary").etag != stored.etag
+    assert cache.get("nb", "summary").body == b"new summary"
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 2
+
+
+def test_invalidate_drops_every_variant_of_a_notebook():
+    cache = ResponseCache(max_bytes=1 << 20, ttl=60)
+    for variant in ["", "summary", "limit=10"]:
+        cache.put("nb", variant, variant.encode())
+    cache.put("other", "", b"other")
+
+    cache.invalidate("nb")
+
+    assert all(cache.get("nb", variant) is None for variant in ["", "summary", "limit=10"])
+    assert cache.get("other").body == b"other"
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == len(cache.get("other").gzip_body)
+
+
+def test_response_read_before_an_invalidation_is_not_stored():
+    cache = ResponseCache(max_bytes=1 << 20, ttl=60)
+    generation = cache.generation("nb")
+    # The notebook is published again while the response is being built
+    cache.invalidate("nb")
+    response = cache.put("nb", "", b"stale", generation=generation)
+
+    assert response.body == b"stale"
+    assert cache.get("nb") is None
+
+    generation = cache.generation("nb")
+    assert generation == 1
+    cache.put("nb", "", b"fresh", generation=generation)
+    assert cache.get("nb").body == b"fresh"
+    # Invalidating another notebook does not matter
+    cache.invalidate("other")
+    cache.put("nb", "summary", b"summary", generation=generation)
+    assert cache.get("nb", "summary").body == b"summary"
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    cache = ResponseCache(max_bytes=1 << 20, ttl=60)
+    cache.put("nb", "", b"body")
+
+    clock.now = 60
+    assert cache.get("nb") is not None
+    clock.now = 61
+    assert cache.get("nb") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    bodies = {name: CachedResponse(name.encode() * 10) for name in ["a", "b", "c"]}
+    cache = ResponseCache(max_bytes=sum(len(response.gzip_body) for response in bodies.values()), ttl=60)
+    for name, response in bodies.items():
+        cache.put(name, "", response.body)
+    cache.get("a")
+    cache.put("d", "", b"d" * 10)
+
+    assert cache.get("b") is None
+    assert all(cache.get(name) is not None for name in ["a", "c", "d"])
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+    # A body larger than the whole cache is returned but not stored
+    assert cache.put("big", "", bytes(range(256)) * 100).body == bytes(range(256)) * 100
+    assert cache.get("big") is None
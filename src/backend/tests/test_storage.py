@@ -0,0 +1,56 @@
+import pytest
+
+from db.sqlite_storage import SQLiteStorage
+from db.storage import NotebookStorage
+from utils.notebook_query import query_notebook
+
+
+def _final_json(n_notebooks: int) -> dict:
+    return {
+        "notebooks": [
+            {"notebook_id": i, "notebook_name": f"n{i}", "user": "u", "cells": [{"cell_id": 0, "class": "A", "cluster": 0}]}
+            for i in range(n_notebooks)
+        ],
+        "metadata": {"clusters": {}}
+    }
+
+
+class _CountingStorage(SQLiteStorage):
+    def __init__(self) -> None:
+        super().__init__(":memory:")
+        self.read_indices = []
+
+    def get_notebook_entries(self, notebook_name, indices):
+        indices = list(indices)
+        self.read_indices += indices
+        return super().get_notebook_entries(notebook_name, indices)
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        NotebookStorage()
+
+
+def test_view_pages_like_the_whole_notebook_and_reads_only_the_page():
+    storage = _CountingStorage()
+    final_json = _final_json(100)
+    storage.add_notebook("corpus", final_json)
+
+    view = storage.get_notebook_view("corpus", chunk_size=4)
+    page = query_notebook(view, limit=3)
+
+    assert page == query_notebook(final_json, limit=3)
+    assert storage.read_indices == [0, 1, 2, 3]
+    assert storage.get_notebook_view("missing") is None
+
+
+def test_view_reads_missing_entries_as_empty_notebooks():
+    storage = _CountingStorage()
+    storage.add_notebook("corpus", _final_json(3))
+    storage._conn.execute("DELETE FROM entries WHERE idx = 1")
+
+    entries = storage.get_notebook_view("corpus")["notebooks"]
+
+    assert len(entries) == 3
+    assert [notebook.get("notebook_id") for notebook in entries] == [0, None, 2]
+    assert entries[1] == {"cells": []}
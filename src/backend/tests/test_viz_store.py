@@ -0,0 +1,118 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from utils.viz_store import VizStore, is_viz_store, load_viz
+
+
+def _final_json() -> dict:
+    classes = ["Visualization", "Data Transform", "Model Training"]
+    notebooks = []
+    for notebook_id in range(4):
+        cells = []
+        for cell_id in range(5):
+            cells.append({
+                "cell_id": cell_id,
+                "class": classes[(notebook_id + cell_id) % len(classes)],
+                "cluster": (notebook_id * cell_id) % 3 - 1,
+                "code": f"x_{notebook_id}_{cell_id} = 'é' * {cell_id}",
+                "desc": f"Cell {cell_id} of notebook {notebook_id}",
+                # Not exactly representable as float32
+                "embedding": [0.1 * notebook_id, 1 / 3, -cell_id / 7],
+                "coords": [notebook_id, -cell_id],
+                "testing": {"subclass_id": cell_id, "source": ["a", None]}
+            })
+        notebooks.append({"notebook_id": notebook_id, "notebook_name": f"n{notebook_id}", "user": "u", "cells": cells})
+    return {"notebooks": notebooks, "metadata": {"clusters": {"Visualization": {"0": "Plots"}}}}
+
+
+def _save(final_json: dict, tmp_path, **kwargs) -> str:
+    path = str(tmp_path / "corpus.viz")
+    VizStore.save(final_json, path, **kwargs)
+    return path
+
+
+def test_float64_round_trip_is_exact(tmp_path):
+    final_json = _final_json()
+    path = _save(final_json, tmp_path, embedding_dtype="float64")
+
+    assert is_viz_store(path)
+    assert load_viz(path) == final_json
+
+
+def test_float32_rounds_only_float_vectors(tmp_path):
+    final_json = _final_json()
+    with VizStore(_save(final_json, tmp_path)) as store:
+        assert store.column("embedding").dtype == np.float32
+        loaded = store.to_json()
+
+    cells = [cell for notebook in final_json["notebooks"] for cell in notebook["cells"]]
+    loaded_cells = [cell for notebook in loaded["notebooks"] for cell in notebook["cells"]]
+    for cell, loaded_cell in zip(cells, loaded_cells):
+        assert loaded_cell["embedding"] == pytest.approx(cell["embedding"], rel=1e-6)
+        assert {**loaded_cell, "embedding": cell["embedding"]} == cell
+
+
+def test_integer_vectors_are_stored_as_integers(tmp_path):
+    final_json = _final_json()
+    final_json["notebooks"][0]["cells"][0]["coords"] = [2**40, -2**40]
+    with VizStore(_save(final_json, tmp_path, embedding_dtype="float16")) as store:
+        assert store.column("coords").dtype == np.int64
+        coords = store.notebook(0)["cells"][0]["coords"]
+
+    assert coords == [2**40, -2**40]
+    assert all(isinstance(x, int) for x in coords)
+
+
+def test_mixed_and_ragged_fields_are_kept_in_extra(tmp_path):
+    final_json = _final_json()
+    cells = final_json["notebooks"][1]["cells"]
+    # Mixing integers and floats, vectors of another length and a missing field
+    cells[0]["coords"] = [1, 0.5]
+    cells[1]["embedding"] = [0.5]
+    del cells[2]["cluster"]
+    path = _save(final_json, tmp_path)
+
+    with VizStore(path) as store:
+        for field in ["coords", "embedding", "cluster"]:
+            with pytest.raises(KeyError):
+                store.column(field)
+    assert load_viz(path) == final_json
+
+
+def test_extra_fields(tmp_path):
+    final_json = _final_json()
+    final_json["notebooks"][2]["cells"][3]["note"] = "only here"
+    with VizStore(_save(final_json, tmp_path, embedding_dtype="float64")) as store:
+        cells = store.notebook(2)["cells"]
+
+    assert cells[3]["note"] == "only here"
+    assert cells[3]["testing"] == {"subclass_id": 3, "source": ["a", None]}
+    assert all("note" not in cell for i, cell in enumerate(cells) if i != 3)
+
+
+def test_random_access(tmp_path):
+    final_json = _final_json()
+    cells = [cell for notebook in final_json["notebooks"] for cell in notebook["cells"]]
+    with VizStore(_save(final_json, tmp_path, embedding_dtype="float64")) as store:
+        assert len(store) == len(cells)
+        assert store.notebook(3) == final_json["notebooks"][3]
+        assert store.column("notebook").tolist() == [i for i, notebook in enumerate(final_json["notebooks"]) for _ in notebook["cells"]]
+
+        class_indices = store.class_indices("Data Transform")
+        assert class_indices.tolist() == [i for i, cell in enumerate(cells) if cell["class"] == "Data Transform"]
+        assert store.cells(class_indices) == [cell for cell in cells if cell["class"] == "Data Transform"]
+
+        cluster_indices = store.cluster_indices("Visualization", -1)
+        expected = [i for i, cell in enumerate(cells) if cell["class"] == "Visualization" and cell["cluster"] == -1]
+        assert len(expected) > 0
+        assert cluster_indices.tolist() == expected
+        assert store.cells(cluster_indices) == [cells[i] for i in expected]
+
+        assert store.class_indices("Unknown").tolist() == []
+        assert store.cells([]) == []
+
+
+def test_unknown_embedding_dtype(tmp_path):
+    with pytest.raises(ValueError):
+        _save(_final_json(), tmp_path, embedding_dtype="int8")
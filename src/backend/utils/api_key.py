@@ -0,0 +1,23 @@
+import functools
+import os
+from utils.constants import API_KEY_PATH
+
+
+@functools.cache
+def get_api_key(path: str = API_KEY_PATH) -> str:
+    """
+    Reads the OpenAI API key on first use, so that modules can be imported (and the server started) without it.
+    The key is also exported as OPENAI_API_KEY, for the clients that read it from the environment.
+
+    Args:
+        path (str, optional): The file holding the key. Defaults to API_KEY_PATH.
+
+    Returns:
+        str: The API key.
+
+    Raises:
+        FileNotFoundError: If the key file does not exist.
+    """
+    with open(path, 'r') as f: api_key = f.read()
+    os.environ["OPENAI_API_KEY"] = api_key
+    return api_key
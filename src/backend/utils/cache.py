@@ -0,0 +1,176 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def hash_key(*parts) -> str:
+    """Builds a content-addressed cache key from the given parts.
+
+    Args:
+        *parts: The values identifying a cache entry. They are converted to strings.
+
+    Returns:
+        str: The hex SHA-256 digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class SQLiteCache():
+    """A persistent key-value store backed by a single SQLite file.
+
+    Entries are evicted in least-recently-used order once more than `max_entries` are stored.
+    If a `fingerprint` is given and differs from the one the file was written with, all entries are
+    dropped on open, so that values produced under different settings are never served.
+    The cache is safe to share between threads of the same process.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+        max_entries (int): The maximum number of entries kept on disk.
+        hits (int): The number of successful lookups since creation.
+        misses (int): The number of failed lookups since creation.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000, fingerprint: Optional[str] = None) -> None:
+        """Opens (or creates) the cache at the given path.
+
+        Args:
+            path (str): The path of the SQLite database file. Use ":memory:" for a non-persistent cache.
+            max_entries (int, optional): The maximum number of entries kept on disk. Defaults to 100000.
+            fingerprint (Optional[str], optional): A digest of the settings the values depend on. Defaults to None.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, last_access INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        if fingerprint is not None:
+            self._check_fingerprint(fingerprint)
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(last_access), 0) FROM entries").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Looks up a single entry.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            Optional[bytes]: The stored value, or None if the key is not cached.
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Looks up several entries at once and marks the found ones as recently used.
+
+        Args:
+            keys (Iterable[str]): The keys to look up.
+
+        Returns:
+            Dict[str, bytes]: The found entries. Missing keys are absent from the result.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT key, value FROM entries WHERE key IN ({placeholders})", chunk)
+                found.update(rows.fetchall())
+
+            if found:
+                self._clock += 1
+                self._conn.executemany(
+                    "UPDATE entries SET last_access = ? WHERE key = ?",
+                    [(self._clock, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: str, value: bytes) -> None:
+        """Stores a single entry, replacing any previous value.
+
+        Args:
+            key (str): The key of the entry.
+            value (bytes): The value to store.
+        """
+        self.put_many([(key, value)])
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]) -> None:
+        """Stores several entries in one transaction and evicts the least recently used ones if needed.
+
+        Args:
+            items (Iterable[Tuple[str, bytes]]): The (key, value) pairs to store.
+        """
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            self._clock += 1
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, last_access) VALUES (?, ?, ?)",
+                [(key, sqlite3.Binary(value), self._clock) for key, value in items]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Removes all entries from the cache."""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and the current size of the cache.
+
+        Returns:
+            dict: A dictionary with the keys "hits", "misses" and "entries".
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    #######################################
+    ########### Private methods ###########
+    #######################################
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('fingerprint', ?)", (fingerprint,))
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        overflow = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
@@ -10,6 +10,13 @@ Class: <class_label>
 Description: <desctiption_sentence>
 """ 
 
+def batch_classifier_prompt(labels: list[str]) -> str:
+    return f"""From now on, you will be given several consecutive code cells of the notebook at once, as a JSON list of objects with a "cell_id" and the "code".
+Classify and describe each of them as explained before, the class must be exactly one of {', '.join(labels[:-1])} or {labels[-1]}.
+Answer only with a JSON object of the following form, with exactly one entry per given code cell:
+{{"cells": [{{"cell_id": <cell_id>, "class": "<class_label>", "description": "<description_sentence>"}}]}}
+"""
+
 FIRST_LAYER_LABELS = [
     "Data Transform",
     "Data Extraction",
@@ -162,3 +169,108 @@ BLANK_IPYNB_JSON = {
     "nbformat": 4,
     "nbformat_minor": 4    
 }
+
+EMBEDDING_MODEL = "microsoft/codebert-base"
+EMBEDDING_CACHE_PATH = "../../cache/embeddings.sqlite"
+EMBEDDING_CACHE_SIZE = 500_000
+
+CLASSIFIER_MODEL = "gpt-4o"
+CLASSIFICATION_CACHE_PATH = "../../cache/classifications.sqlite"
+CLASSIFICATION_CACHE_SIZE = 1_000_000
+CLASSIFIER_MAX_CONCURRENCY = 16
+CLASSIFIER_REQUESTS_PER_MINUTE = 500
+CLASSIFIER_TOKENS_PER_MINUTE = 30_000
+
+# Which previous cells are sent along with each cell to classify, see GPTClassifier
+CONTEXT_STRATEGIES = ["full", "last_k", "summary", "labels"]
+CLASSIFIER_CONTEXT = "full"
+CLASSIFIER_CONTEXT_SIZE = 8
+CLASSIFIER_SUMMARY_EVERY = 10
+
+# Number of consecutive cells classified by one request, and requests per window before falling back to single cells
+CLASSIFIER_BATCH_SIZE = 1
+CLASSIFIER_BATCH_ATTEMPTS = 2
+
+# Request policy of all LLM calls, see utils/request_policy.py
+LLM_TIMEOUT = 60.0
+LLM_MAX_ATTEMPTS = 5
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 30.0
+CLASSIFIER_FALLBACK_LABEL = "Invalid"
+CLASSIFIER_FALLBACK_DESCRIPTION = "An error occurred while classifying this code snippet."
+
+TITLE_MODEL = "gpt-4o"
+TITLE_CACHE_PATH = "../../cache/titles.sqlite"
+TITLE_MAX_CONCURRENCY = 8
+TITLE_MODE = "llm"
+
+# Dimensionality reduction run before HDBSCAN, one of Clusterers.reducers.REDUCERS
+REDUCER = "tsne"
+# Number of processes clustering the classes in parallel, None for one per CPU core
+CLUSTER_N_JOBS = None
+# Whether ClassCluster scores the clusters of every class (silhouette, Calinski-Harabasz, Davies-Bouldin),
+# turned off in production runs where nobody reads the scores
+CLUSTER_EVALUATION = True
+
+# Incremental clustering, see ClassCluster.add_notebooks
+INCREMENTAL_MAX_GROWTH = 0.5
+INCREMENTAL_MAX_OUTLIER_RATE = 0.3
+INCREMENTAL_RADIUS_PERCENTILE = 95
+
+# Checkpoints of interrupted pipeline runs, see cli/pipeline.py
+PIPELINE_JOURNAL_DIR = "../../cache/pipeline"
+
+# Background pipeline jobs of the server, see utils/jobs.py
+JOB_MAX_WORKERS = 2
+JOB_RETENTION = 3600.0
+
+# Notebooks with fewer code cells are not classified
+MIN_CODE_CELLS = 15
+# Read size when hashing uploaded files
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Pagination of GET /notebook/<notebook_name>
+NOTEBOOK_PAGE_SIZE = 500
+NOTEBOOK_MAX_PAGE_SIZE = 5000
+
+# Storage of the final JSONs, one of db.storage.STORAGE_BACKENDS
+STORAGE_BACKEND = "firestore"
+STORAGE_SQLITE_PATH = "../../cache/notebooks.sqlite"
+# Limits of a Firestore batched write (500 operations, 10 MiB payload) and number of batches committed concurrently
+FIRESTORE_BATCH_SIZE = 500
+FIRESTORE_BATCH_BYTES = 9_000_000
+FIRESTORE_MAX_CONCURRENCY = 4
+# Number of entries read at once when paging through a stored notebook, see db/storage.NotebookStorage.get_notebook_view
+STORAGE_ENTRY_CHUNK_SIZE = 32
+
+# Cache of the GET /notebook/<notebook_name> responses, see utils/response_cache.py. Notebooks published
+# by another process (e.g. the CLI) are served from the cache for at most NOTEBOOK_CACHE_TTL seconds
+NOTEBOOK_CACHE_BYTES = 64 << 20
+NOTEBOOK_CACHE_TTL = 300.0
+
+# Competition notebooks pulled from Kaggle, see utils/helper_functions.kaggle_stream_competition. Pulled notebooks
+# are cached by kernel reference and version. KAGGLE_LOCAL_DIR serves a local directory instead of kaggle.com
+KAGGLE_CACHE_DIR = "../../cache/kaggle"
+KAGGLE_MAX_WORKERS = 4
+KAGGLE_LOCAL_DIR = None
+
+# Parallel notebook loading, see utils/helper_functions.iter_notebooks. None for one process per CPU core
+LOADER_N_JOBS = None
+# Number of files sent to a loader process at once
+LOADER_CHUNK_SIZE = 8
+# Start method of the process pools (loader, clustering). They are created from the threads of the server,
+# after torch and OpenMP started their own threads, and forking such a process can deadlock the children
+POOL_START_METHOD = "forkserver"
+
+# Number of cleaned cells memoized by utils/helper_functions.clean_code
+CLEAN_CODE_CACHE_SIZE = 100_000
+# Longest code that does not tokenize whose docstrings are removed by the regular expression fallback of clean_code
+CLEAN_CODE_FALLBACK_MAX_CHARS = 100_000
+
+# Clustering scores, see Clusterers/evaluation.py. The silhouette score of larger classes is computed
+# on a random sample of this many cells, drawn with a fixed seed so that runs are comparable
+EVALUATION_SAMPLE_SIZE = 2000
+EVALUATION_SEED = 0
+
+# The OpenAI API key, read on first use, see utils/api_key.get_api_key
+API_KEY_PATH = "../../secrets/api_key.txt"
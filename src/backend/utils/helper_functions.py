@@ -1,24 +1,47 @@
 import json
 import re
-from typing import List, Dict
+import io
+import tokenize
+from typing import Iterator, List, Dict
 import os
-import kaggle
+import tempfile
 import random
-from db.client import FirebaseClient
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from db.storage import NotebookStorage
+from utils.cache import hash_key
+from utils.constants import KAGGLE_CACHE_DIR, KAGGLE_MAX_WORKERS, LOADER_N_JOBS, LOADER_CHUNK_SIZE, POOL_START_METHOD, MIN_CODE_CELLS, CLEAN_CODE_CACHE_SIZE, CLEAN_CODE_FALLBACK_MAX_CHARS
+from utils.notebook_reader import read_notebook
 import ast
-import graphviz
 import itertools
-from functools import partial, reduce
-from IPython.display import SVG
+import multiprocessing
+from functools import lru_cache, partial, reduce
 from tqdm import tqdm
 
 
 def save_viz(json_file: dict, path: str):
-    with open(path, 'w') as f: json.dump(json_file, f)
+    """
+    Writes a .viz file atomically, so that readers never see a partially written file.
+    
+    Parameters:
+        json_file (dict): The final JSON to write.
+        path (str): The path of the .viz file.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(json_file, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
 
 def load_notebooks(notebooks_dir: str, verbose: bool = False) -> tuple[List[dict], List[str]]:
     """
     Load notebook files from the specified directory and return a list of notebook JSONs.
+    Only the cells are loaded, see `iter_notebooks`.
     
     Parameters:
         notebooks_dir (str): The directory path where the notebook files are located.
@@ -28,24 +51,57 @@ def load_notebooks(notebooks_dir: str, verbose: bool = False) -> tuple[List[dict
         tuple[List[dict], List[str]]: A tuple containig a list of notebook JSONs and the corresponding file names.
         
     """
-    
-    files = os.listdir(notebooks_dir)
-    file_names = []
     notebook_jsons = []
-    for file in tqdm(files, desc="Reading file contents"):
-        file_path = os.path.join(notebooks_dir, file)
-        
-        if os.path.isfile(file_path) and file.endswith(".ipynb"):# and len(file.split("_")) == 2:
-            notebook_json = load_notebook(file_path)
-            if len([cell for cell in notebook_json['cells'] if cell['cell_type'] == 'code']) >= 15:
-                notebook_jsons.append(notebook_json)
-                file_names.append(file)
-            else:
-                if verbose: print(f"Skipping notebook {file} due to insufficient code cells.")
-        else:
-            if verbose: print("Invalid file format. Skipping file: " + file)
+    file_names = []
+    for notebook_json, file in iter_notebooks(notebooks_dir, verbose=verbose):
+        notebook_jsons.append(notebook_json)
+        file_names.append(file)
     return notebook_jsons, file_names
 
+def iter_notebooks(
+    notebooks_dir: str, min_code_cells: int = MIN_CODE_CELLS, n_jobs: int = LOADER_N_JOBS, verbose: bool = False
+) -> Iterator[tuple[dict, str]]:
+    """
+    Load the notebook files of a directory in parallel, yielding each notebook as soon as it is parsed.
+    
+    The files are parsed by a pool of processes with `read_notebook`, which drops the outputs and attachments
+    while parsing, so only the `cell_type`, `source` and `metadata` of the cells are sent back. Notebooks with
+    fewer than `min_code_cells` code cells are skipped.
+    
+    Parameters:
+        notebooks_dir (str): The directory path where the notebook files are located.
+        min_code_cells (int, optional): The minimum number of code cells of a notebook. Defaults to MIN_CODE_CELLS.
+        n_jobs (int, optional): The number of processes, 1 to parse in this process. Defaults to LOADER_N_JOBS.
+        verbose (bool, optional): If True, print additional information. Defaults to False.
+    
+    Yields:
+        tuple[dict, str]: The notebook JSON, {"cells": [...]}, and its file name, in the order of the directory listing.
+    """
+    files = []
+    for file in os.listdir(notebooks_dir):
+        if os.path.isfile(os.path.join(notebooks_dir, file)) and file.endswith(".ipynb"):
+            files.append(file)
+        elif verbose:
+            print("Invalid file format. Skipping file: " + file)
+    
+    paths = [os.path.join(notebooks_dir, file) for file in files]
+    read = partial(read_notebook, min_code_cells=min_code_cells)
+    if n_jobs == 1 or len(paths) <= LOADER_CHUNK_SIZE:
+        notebooks = map(read, paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context(POOL_START_METHOD))
+        notebooks = executor.map(read, paths, chunksize=LOADER_CHUNK_SIZE)
+    try:
+        for file, notebook_json in tqdm(zip(files, notebooks), total=len(files), desc="Reading file contents"):
+            if notebook_json is not None:
+                yield notebook_json, file
+            elif verbose:
+                print(f"Skipping notebook {file} due to insufficient code cells.")
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
 def load_notebook(notebook_path: str):
     """
     Load a notebook from the specified path.
@@ -94,8 +150,13 @@ def notebook_add_class_labels(notebook_json: dict, class_labels: List[tuple[str,
     return notebook_json
 
 
-def clean_code(code):
-    """Cleans the given code by removing docstrings and comments.
+def clean_code(code: str) -> str:
+    """Cleans the given code by removing function docstrings and comments.
+
+    The code is tokenized, so `#` and quotes inside string literals are left untouched. Code that does not
+    tokenize (e.g. an unterminated string) is cleaned with regular expressions, which only remove the docstrings
+    of code up to CLEAN_CODE_FALLBACK_MAX_CHARS characters long, since an unterminated one is scanned to the end.
+    Results are memoized, so the cells repeated across notebooks are only cleaned once.
 
     Args:
         code (str): The code to be cleaned.
@@ -103,69 +164,81 @@ def clean_code(code):
     Returns:
         str: The cleaned code.
     """
-    def remove_docstring(code: str) -> str:
-        # Regular expression to match function definitions with docstrings
-        pattern = re.compile(
-            r'(def\s+\w+\s*\([^)]*\)\s*:\s*)'  # Match the function definition
-            r'(\s*"""(?:[^"]|"(?!")|""(?!"))*"""|'  # Match triple double-quoted strings
-            r'\s*\'\'\'(?:[^\']|\'(?!\')|\'\'(?!\'))*\'\'\')'  # Match triple single-quoted strings
-        , re.DOTALL)
+    return _clean_code(code)
 
-        def replace_func(match):
-            # Return the function definition part without the docstring
-            return match.group(1)
 
-        # Replace the function definitions with docstrings with just the function definitions
-        cleaned_code = re.sub(pattern, replace_func, code)
-        
-        return cleaned_code
+def clean_notebook_code(notebook_json: dict) -> List[str]:
+    """Cleans the code cells of a notebook, see `clean_code`.
 
-    def remove_comments(code: str) -> str:
-        comment_pattern = r'#.*'  # Matches any text starting with '#'
-        cleaned_code = re.sub(comment_pattern, '', code)
-        return cleaned_code
-    
-    code = remove_docstring(code)
-    code = remove_comments(code)
-    return code.strip()
+    Args:
+        notebook_json (dict): The notebook JSON.
+
+    Returns:
+        List[str]: The cleaned code of every code cell, in order.
+    """
+    return [_clean_code("".join(cell["source"])) for cell in notebook_json["cells"] if cell["cell_type"] == "code"]
 
 
-def kaggle_pull_competiton(competition_name: str, path: str, n_notebooks: int = 20, verbose: bool = False) -> List[dict]:
+def kaggle_pull_competiton(competition_name: str, path: str = KAGGLE_CACHE_DIR, n_notebooks: int = 20, verbose: bool = False, api=None) -> List[dict]:
     """Download notebooks from a Kaggle competition.
 
     Args:
         competition_name (str): The name of the Kaggle competition.
-        path (str): The path to the folder where the notebooks will be downloaded. It is recommended to use a temporary folder.
+        path (str, optional): The folder where the notebooks are downloaded and cached. Defaults to KAGGLE_CACHE_DIR.
         n_notebooks (int, optional): The number of notebooks to download. Defaults to 20.
         verbose (bool, optional): Whether to display verbose output. Defaults to False.
+        api (optional): The Kaggle API, see utils.kaggle_api. Defaults to None (`kaggle_api()`).
 
     Returns:
-        List[dict]: A list of dictionaries representing the downloaded notebooks.
+        List[dict]: A list of dictionaries representing the downloaded notebooks, in the order of the kernel list.
     """
-    if verbose: print("Validating Kaggle api key")
-    os.environ['KAGGLE_CONFIG_DIR'] = os.path.expanduser('~/.kaggle')
-    
+    notebooks = {}
+    for index, kernel_ref, notebook_path in kaggle_stream_competition(competition_name, n_notebooks, path, verbose=verbose, api=api):
+        notebooks[index] = load_notebook(notebook_path)
+    return [notebooks[index] for index in sorted(notebooks)]
+
+
+def kaggle_stream_competition(
+    competition_name: str, n_notebooks: int = 20, cache_dir: str = KAGGLE_CACHE_DIR,
+    max_workers: int = KAGGLE_MAX_WORKERS, verbose: bool = False, api=None
+) -> Iterator[tuple[int, str, str]]:
+    """Pulls the notebooks of a Kaggle competition concurrently, yielding each one as soon as it is on disk.
+
+    Pulled notebooks are kept in `cache_dir`, keyed by kernel reference and version, so a kernel is only
+    downloaded again once a new version of it is published.
+
+    Args:
+        competition_name (str): The name of the Kaggle competition.
+        n_notebooks (int, optional): The number of notebooks to pull. Defaults to 20.
+        cache_dir (str, optional): The folder of the pulled notebooks. Defaults to KAGGLE_CACHE_DIR.
+        max_workers (int, optional): The maximum number of concurrent pulls. Defaults to KAGGLE_MAX_WORKERS.
+        verbose (bool, optional): Whether to display verbose output. Defaults to False.
+        api (optional): The Kaggle API, see utils.kaggle_api. Defaults to None (`kaggle_api()`).
+
+    Yields:
+        tuple[int, str, str]: The position of the kernel in the kernel list, its reference and the path of the notebook,
+            in the order the pulls complete.
+    """
+    if api is None:
+        from utils.kaggle_api import kaggle_api
+        if verbose: print("Validating Kaggle api key")
+        api = kaggle_api()
+
     if verbose: print("Get the list of kernels (notebooks)")
-    kernels = kaggle.api.kernels_list(
-        competition=competition_name,
-        page_size=n_notebooks
-    )
-    
-    # Extract the kernel references to be able to pull them from kaggle
-    if verbose: print(f"Extracting kernel references from {len(kernels)} kernels")
-    kernel_refs = [vars(kernel)["ref"] for kernel in kernels]
-    
-    notebooks = []
-    for i, kernel_ref in enumerate(kernel_refs):
-        # Pull each notebook using its reference
-        if verbose: print(f"Pulling notebook {kernel_ref} ({i+1}/{len(kernel_refs)})", end="\r")
-        kaggle.api.kernels_pull(kernel_ref, path=path, metadata=False)
-        notebook_path = f"{path}/{kernel_ref.split('/')[-1]}.ipynb"
-        
-        with open(notebook_path, 'r') as file:
-            notebook = json.load(file)
-            notebooks.append(notebook)
-    return notebooks
+    kernels = api.kernels_list(competition=competition_name, page_size=n_notebooks)
+    if verbose: print(f"Pulling {len(kernels)} kernels")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(_pull_kernel, api, kernel, cache_dir): index for index, kernel in enumerate(kernels)}
+        for done, future in enumerate(as_completed(futures)):
+            kernel_ref, notebook_path = future.result()
+            if verbose: print(f"Pulled notebook {kernel_ref} ({done+1}/{len(kernels)})", end="\r")
+            yield futures[future], kernel_ref, notebook_path
+    finally:
+        # Pulls not started yet are dropped if the consumer stops early or a pull fails
+        executor.shutdown(wait=True, cancel_futures=True)
     
 
 def ipynb_to_json(file_content: bytes) -> json:
@@ -180,13 +253,125 @@ def ipynb_to_json(file_content: bytes) -> json:
     json_string = file_content.decode("utf-8")
     return json.loads(json_string)
 
-def generate_output_name(client: FirebaseClient) -> str:
+def generate_output_name(client: NotebookStorage) -> str:
     output_name = f'output_{random.randint(100000, 999999)}'
     while client.notebook_exists(output_name): 
         output_name = f'output_{random.randint(100000, 999999)}'
     return output_name
     
 
+#####################################
+######### Private Functions #########
+#####################################
+
+# Fallbacks of `clean_code` for code that does not tokenize. The signature of a definition and the single-line
+# strings cannot span lines, so the attempts starting on different lines do not rescan each other's lines. An
+# unterminated docstring is still scanned to the end of the code, so the docstrings are only removed from code
+# of at most CLEAN_CODE_FALLBACK_MAX_CHARS characters
+_DOCSTRING_RE = re.compile(
+    r'((?:async[ \t]+)?def[ \t]+\w+[ \t]*\([^)\n]*\)[^:\n]*:[ \t]*(?:\n[ \t]*)?)'  # The function definition
+    r'(?:"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\')'  # Its docstring
+)
+_COMMENT_RE = re.compile(
+    r'("(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')'  # Single-line strings, kept
+    r'|#[^\n]*'  # Comments
+)
+
+@lru_cache(maxsize=CLEAN_CODE_CACHE_SIZE)
+def _clean_code(code: str) -> str:
+    try:
+        spans = _docstring_and_comment_spans(code)
+    except (tokenize.TokenError, SyntaxError):
+        if len(code) <= CLEAN_CODE_FALLBACK_MAX_CHARS:
+            code = _DOCSTRING_RE.sub(r"\1", code)
+        return _COMMENT_RE.sub(lambda match: match.group(1) or "", code).strip()
+
+    # Offsets of the line starts, to convert the (row, col) token positions
+    line_starts = [0]
+    for line in io.StringIO(code):
+        line_starts.append(line_starts[-1] + len(line))
+    pieces = []
+    position = 0
+    for (start_row, start_col), (end_row, end_col), replacement in spans:
+        start = line_starts[start_row - 1] + start_col
+        pieces.append(code[position:start])
+        pieces.append(replacement)
+        position = line_starts[end_row - 1] + end_col
+    pieces.append(code[position:])
+    return "".join(pieces).strip()
+
+def _docstring_and_comment_spans(code: str) -> List[tuple[tuple[int, int], tuple[int, int], str]]:
+    """
+    Returns the positions of the comments and of the function docstrings, i.e. the strings that are the
+    first statement of a function body, with the text replacing them. A docstring on the line of its
+    "def" (e.g. `def f(): "doc"; return 2`) or that is the whole body of its function is replaced with
+    "pass", so that the function keeps a body.
+    """
+    spans = []
+    # The state of the last "def": 0 none, 1 in its signature, 2 after its colon, 3 at the end of its line, 4 at the start of its body
+    state = 0
+    depth = 0
+    # A string that is a docstring if it is a whole statement, i.e. followed by the end of the statement
+    candidate = None
+    # A docstring on its own line, replaced with "pass" if it is the whole body, i.e. followed by the end of the block
+    body_docstring = None
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type == tokenize.COMMENT:
+            spans.append((token.start, token.end, ""))
+            continue
+        if token.type in (tokenize.NL, tokenize.ENCODING):
+            continue
+        if body_docstring is not None:
+            start, end, _ = body_docstring
+            spans.append((start, end, "pass" if token.type in (tokenize.DEDENT, tokenize.ENDMARKER) else ""))
+            body_docstring = None
+        if candidate is not None:
+            if token.type == tokenize.NEWLINE and not candidate[2]:
+                body_docstring = candidate
+            elif token.type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                spans.append(candidate)
+            elif token.string == ";":
+                # Statements follow on the same line, e.g. `"doc"; return 2`
+                spans.append((candidate[0], candidate[1], "pass"))
+            candidate = None
+        if token.type == tokenize.NAME and token.string == "def":
+            state, depth = 1, 0
+        elif state == 1 and token.type == tokenize.OP:
+            depth += token.string in "([{"
+            depth -= token.string in ")]}"
+            if token.string == ":" and depth == 0:
+                state = 2
+        elif state == 2 and token.type == tokenize.NEWLINE:
+            state = 3
+        elif state == 3 and token.type == tokenize.INDENT:
+            state = 4
+        elif state in (2, 4) and token.type == tokenize.STRING:
+            candidate = (token.start, token.end, "pass" if state == 2 else "")
+            state = 0
+        elif state != 1:
+            state = 0
+    return sorted(spans)
+
+
+def _pull_kernel(api, kernel, cache_dir: str) -> tuple[str, str]:
+    """
+    Pulls a kernel into the cache, unless its current version is cached already.
+
+    Returns:
+        tuple[str, str]: The kernel reference and the path of the cached notebook.
+    """
+    kernel_ref = vars(kernel)["ref"]
+    # Kernel listings carry the time of the last run, rather than a version number
+    version = getattr(kernel, "currentVersionNumber", None) or getattr(kernel, "lastRunTime", None)
+    notebook_path = os.path.join(cache_dir, f"{hash_key(kernel_ref, version)}.ipynb")
+    if not os.path.exists(notebook_path):
+        # Pulled into a directory of its own, since two kernels of different users can share a slug
+        with tempfile.TemporaryDirectory(dir=cache_dir) as pull_dir:
+            api.kernels_pull(kernel_ref, path=pull_dir, metadata=False)
+            os.replace(os.path.join(pull_dir, f"{kernel_ref.split('/')[-1]}.ipynb"), notebook_path)
+    return kernel_ref, notebook_path
+
+
 if __name__ == "__main__":
     import sys
     sys.path.append('../')
@@ -0,0 +1,188 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Job states, in order
+JOB_STATES = ["queued", "running", "done", "failed"]
+
+
+class Job():
+    """A pipeline run executed in the background by a JobManager.
+
+    The job keeps an ordered log of its events (state changes and progress reports), so that any
+    number of clients can follow it from the start, see `events`.
+
+    Attributes:
+        id (str): The identifier of the job.
+        key (str): The deduplication key of the job.
+        status (str): One of JOB_STATES.
+        result (Any): The return value of the job, once done.
+        error (str): The error message, if the job failed.
+    """
+
+    def __init__(self, key: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._events = []
+        self._condition = threading.Condition(threading.RLock())
+        self._emit("status", {"status": self.status})
+
+    def progress(self, stage: str, data: Optional[dict] = None) -> None:
+        """Reports the progress of a stage, e.g. {"done": 3, "total": 20}.
+
+        Args:
+            stage (str): The name of the pipeline stage.
+            data (Optional[dict], optional): The progress of the stage. Defaults to None.
+        """
+        self._emit("progress", {"stage": stage, **(data or {})})
+
+    def events(self, start: int = 0, timeout: float = 15.0) -> Iterator[tuple[int, str, dict]]:
+        """Yields the events of the job from the given index until it is finished.
+
+        When no event arrives for `timeout` seconds, a "ping" event is yielded so that the
+        connection of a streaming client is kept alive.
+
+        Args:
+            start (int, optional): The index of the first event. Defaults to 0.
+            timeout (float, optional): The keep-alive interval in seconds. Defaults to 15.0.
+
+        Yields:
+            tuple[int, str, dict]: The index, the type and the data of each event.
+        """
+        index = start
+        while True:
+            with self._condition:
+                if index >= len(self._events) and not self.finished:
+                    self._condition.wait(timeout)
+                events = self._events[index:]
+                finished = self.finished
+            if not events and not finished:
+                yield index, "ping", {}
+            for event_type, data in events:
+                yield index, event_type, data
+                index += 1
+            if finished and index >= len(self._events):
+                return
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        """Returns the JSON serializable state of the job, without its result."""
+        with self._condition:
+            progress = {data["stage"]: data for event_type, data in self._events if event_type == "progress"}
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _set_status(self, status: str) -> None:
+        # Updated together with the event log, so that `events` never stops before the last event
+        with self._condition:
+            self.status = status
+            if self.finished:
+                self.finished_at = time.time()
+            self._emit("status", {"status": status, **({"error": self.error} if self.error else {})})
+
+    def _emit(self, event_type: str, data: dict) -> None:
+        with self._condition:
+            self._events.append((event_type, data))
+            self._condition.notify_all()
+
+
+class JobManager():
+    """Runs jobs on a bounded pool of worker threads.
+
+    Submitting a job with the key of a job that is queued or running returns that job instead of
+    starting a new one, so duplicate submissions of the same input share one run. Finished jobs are
+    kept for `retention` seconds so that their status and result can still be fetched.
+
+    Attributes:
+        max_workers (int): The number of jobs run concurrently.
+        retention (float): How long finished jobs are kept, in seconds.
+    """
+
+    def __init__(self, max_workers: int = 1, retention: float = 3600.0) -> None:
+        self.max_workers = max_workers
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._active: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """Submits a job, or returns the queued or running job with the same key.
+
+        Args:
+            key (str): The deduplication key, e.g. a digest of the input files.
+            fn (Callable[..., Any]): The work to run. It receives the job as its first argument, to report progress.
+            *args: The arguments of `fn`.
+            **kwargs: The keyword arguments of `fn`.
+
+        Returns:
+            Job: The job running the work.
+        """
+        with self._lock:
+            self._expire()
+            if key in self._active:
+                return self._active[key]
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._active[key] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns the job with the given id, None if it is unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        """Returns the known jobs, most recent first."""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stops the workers once the running jobs are done."""
+        self._executor.shutdown(wait=wait)
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _run(self, job: Job, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        job._set_status("running")
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job._set_status("done")
+        except Exception as e:
+            traceback.print_exc()
+            job.error = f"{type(e).__name__}: {e}"
+            job._set_status("failed")
+        finally:
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+    def _expire(self) -> None:
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished_at > self.retention]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+
+class Journal():
+    """An append-only log of the units of work completed by a pipeline run.
+
+    Every record is one JSON line `{"stage": ..., "key": ..., "data": ...}` that is flushed and synced to
+    disk before `append` returns, so a crash loses at most the unit that was in progress. A line cut off by
+    a crash is ignored when the journal is read back. Later records of the same stage and key replace
+    earlier ones. The file is opened on the first `append` and stays open until `close` or `clear`; the
+    journal can be used as a context manager that closes it. Records can be appended from several threads.
+
+    Attributes:
+        path (str): The path of the JSON lines file.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Reads back the journal at the given path, if any.
+
+        Args:
+            path (str): The path of the JSON lines file.
+        """
+        self.path = path
+        self._records = self._read()
+        self._file = None
+        self._lock = threading.RLock()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def append(self, stage: str, key: str, data: Any = None) -> None:
+        """Records a completed unit of work.
+
+        Args:
+            stage (str): The name of the pipeline stage.
+            key (str): The identifier of the unit within the stage.
+            data (Any, optional): The JSON serializable result of the unit. Defaults to None.
+        """
+        line = json.dumps({"stage": stage, "key": key, "data": data}) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._records.setdefault(stage, {})[key] = data
+
+    def completed(self, stage: str) -> Dict[str, Any]:
+        """Returns the units completed in a stage.
+
+        Args:
+            stage (str): The name of the pipeline stage.
+
+        Returns:
+            Dict[str, Any]: The result of every completed unit, by key.
+        """
+        return dict(self._records.get(stage, {}))
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        """Returns the result of a completed unit.
+
+        Args:
+            stage (str): The name of the pipeline stage.
+            key (str): The identifier of the unit within the stage.
+
+        Returns:
+            Optional[Any]: The recorded result, or None if the unit is not completed.
+        """
+        return self._records.get(stage, {}).get(key)
+
+    def clear(self) -> None:
+        """Deletes the journal, once the run it records is finished. A later `append` starts a new file."""
+        with self._lock:
+            self.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._records = {}
+
+    def close(self) -> None:
+        """Closes the journal file, if it is open."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _open(self):
+        """
+        Opens the journal for appending, creating its directory if needed.
+        """
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        file = open(self.path, "a", encoding="utf-8")
+        if file.tell() and not self._ends_with_newline():
+            # Terminate the partial line, so that it does not swallow the next record
+            file.write("\n")
+        return file
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Reads back the records of a previous run.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: The result of every completed unit, by stage and key.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partial line written by an interrupted run
+                    continue
+                records.setdefault(record["stage"], {})[record["key"]] = record["data"]
+        return records
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
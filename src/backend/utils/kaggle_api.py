@@ -0,0 +1,81 @@
+import os
+import shutil
+from types import SimpleNamespace
+from typing import List, Optional
+from utils.constants import KAGGLE_LOCAL_DIR
+
+
+def kaggle_api(local_dir: Optional[str] = KAGGLE_LOCAL_DIR):
+    """
+    Returns the Kaggle API used to pull competition notebooks.
+
+    Args:
+        local_dir (Optional[str], optional): A directory served by a LocalKaggleApi instead of kaggle.com,
+            None for the authenticated `kaggle.api`. Defaults to KAGGLE_LOCAL_DIR.
+
+    Returns:
+        The API, exposing `kernels_list` and `kernels_pull`.
+    """
+    if local_dir is not None:
+        return LocalKaggleApi(local_dir)
+    os.environ['KAGGLE_CONFIG_DIR'] = os.path.expanduser('~/.kaggle')
+    # Authenticates on import, so it is only imported once the config directory is set
+    import kaggle
+    return kaggle.api
+
+
+class LocalKaggleApi():
+    """A stand-in of the Kaggle API serving notebooks from a local directory, for offline runs and tests.
+
+    The notebooks of a competition are the files `<root>/<competition>/<user>/<slug>.ipynb`, with the
+    kernel reference "<user>/<slug>". The last modification time of a file stands for its version.
+
+    Attributes:
+        root (str): The directory of the competitions.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def kernels_list(self, competition: str, page_size: int = 20, **kwargs) -> List[SimpleNamespace]:
+        """Lists the notebooks of a competition, like `kaggle.api.kernels_list`.
+
+        Args:
+            competition (str): The name of the competition.
+            page_size (int, optional): The maximum number of notebooks. Defaults to 20.
+
+        Returns:
+            List[SimpleNamespace]: The kernels, with their "ref" and "lastRunTime".
+        """
+        directory = os.path.join(self.root, competition)
+        kernels = []
+        for user in sorted(os.listdir(directory)):
+            if not os.path.isdir(os.path.join(directory, user)):
+                continue
+            for file in sorted(os.listdir(os.path.join(directory, user))):
+                if file.endswith(".ipynb"):
+                    path = os.path.join(directory, user, file)
+                    kernels.append(SimpleNamespace(ref=f"{user}/{file[:-len('.ipynb')]}", lastRunTime=os.path.getmtime(path), competition=competition))
+        return kernels[:page_size]
+
+    def kernels_pull(self, kernel: str, path: str, metadata: bool = False) -> str:
+        """Copies a notebook to `<path>/<slug>.ipynb`, like `kaggle.api.kernels_pull`.
+
+        Args:
+            kernel (str): The kernel reference, "<user>/<slug>".
+            path (str): The destination directory.
+            metadata (bool, optional): Ignored, no metadata file is written. Defaults to False.
+
+        Returns:
+            str: The destination directory.
+
+        Raises:
+            FileNotFoundError: If no competition has this kernel.
+        """
+        user, slug = kernel.split("/")
+        for competition in sorted(os.listdir(self.root)):
+            source = os.path.join(self.root, competition, user, f"{slug}.ipynb")
+            if os.path.isfile(source):
+                shutil.copyfile(source, os.path.join(path, f"{slug}.ipynb"))
+                return path
+        raise FileNotFoundError(f"Unknown kernel: {kernel}")
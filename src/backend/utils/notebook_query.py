@@ -0,0 +1,132 @@
+import base64
+from collections import Counter
+from typing import List, Optional
+
+# Cell fields a query can project on, "cell_id" is always returned
+CELL_FIELDS = ["cell_id", "code", "class", "desc", "cluster", "testing"]
+# Notebook fields returned with the cells of every page
+NOTEBOOK_FIELDS = ["notebook_id", "notebook_name", "user"]
+
+
+def query_notebook(
+    final_json: dict,
+    fields: Optional[List[str]] = None,
+    classes: Optional[List[str]] = None,
+    clusters: Optional[List[int]] = None,
+    notebook_ids: Optional[List[int]] = None,
+    cursor: Optional[str] = None,
+    limit: int = 500
+) -> dict:
+    """
+    Returns one page of the cells of a stored notebook corpus, filtered and projected.
+
+    Cells are paged in notebook then cell order. A page has the shape of the final JSON, with only the
+    notebooks that have a matching cell on the page, and the metadata on the first page only.
+
+    Args:
+        final_json (dict): The final JSON of the corpus.
+        fields (Optional[List[str]], optional): The cell fields to return, among CELL_FIELDS. Defaults to all fields.
+        classes (Optional[List[str]], optional): Only return the cells of these classes. Defaults to None.
+        clusters (Optional[List[int]], optional): Only return the cells of these clusters. Defaults to None.
+        notebook_ids (Optional[List[int]], optional): Only return the cells of these notebooks. Defaults to None.
+        cursor (Optional[str], optional): The `next_cursor` of the previous page, None for the first page. Defaults to None.
+        limit (int, optional): The maximum number of cells of the page. Defaults to 500.
+
+    Returns:
+        dict: The page, {"notebooks": [...], "next_cursor": str or None} plus "metadata" on the first page.
+
+    Raises:
+        ValueError: If a field, the cursor or the limit is invalid.
+    """
+    # A page without cells would return the cursor it was given, and a client following it would loop forever
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+        raise ValueError(f"The limit must be a positive integer, got {limit!r}")
+    if fields is not None:
+        unknown = [field for field in fields if field not in CELL_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}, expected some of {CELL_FIELDS}")
+        fields = ["cell_id"] + [field for field in fields if field != "cell_id"]
+    start_notebook, start_cell = _decode_cursor(cursor) if cursor else (0, 0)
+    classes = set(classes) if classes else None
+    clusters = set(clusters) if clusters else None
+    notebook_ids = set(notebook_ids) if notebook_ids else None
+
+    page = {"notebooks": [], "next_cursor": None}
+    if cursor is None:
+        page["metadata"] = final_json.get("metadata", {})
+
+    n_cells = 0
+    notebooks = final_json["notebooks"]
+    for notebook_idx in range(start_notebook, len(notebooks)):
+        notebook = notebooks[notebook_idx]
+        if notebook_ids is not None and notebook.get("notebook_id") not in notebook_ids:
+            continue
+        cells = []
+        first_cell = start_cell if notebook_idx == start_notebook else 0
+        for cell_idx in range(first_cell, len(notebook["cells"])):
+            cell = notebook["cells"][cell_idx]
+            if classes is not None and cell.get("class") not in classes:
+                continue
+            if clusters is not None and cell.get("cluster") not in clusters:
+                continue
+            if n_cells == limit:
+                page["next_cursor"] = _encode_cursor(notebook_idx, cell_idx)
+                break
+            cells.append(cell if fields is None else {field: cell[field] for field in fields if field in cell})
+            n_cells += 1
+        if cells:
+            page["notebooks"].append({**{key: notebook[key] for key in NOTEBOOK_FIELDS if key in notebook}, "cells": cells})
+        if page["next_cursor"] is not None:
+            break
+    return page
+
+
+def summarize_notebook(final_json: dict) -> dict:
+    """
+    Returns the overview of a stored notebook corpus: the number of cells of every cluster and the cluster titles.
+
+    Args:
+        final_json (dict): The final JSON of the corpus.
+
+    Returns:
+        dict: {"n_notebooks": int, "n_cells": int, "classes": {class: {"count": int, "clusters": {cluster: {"count": int, "title": str}}}}, "metadata": {...}}
+            where the metadata excludes the cluster titles, which are merged into "classes".
+    """
+    counts = Counter(
+        (cell.get("class"), cell.get("cluster"))
+        for notebook in final_json["notebooks"] for cell in notebook["cells"]
+    )
+    cluster_metadata = final_json.get("metadata", {}).get("clusters", {})
+
+    classes = {}
+    # Unclustered cells (no "cluster" field) are counted under "None"
+    for (class_name, cluster), count in sorted(counts.items(), key=lambda x: (str(x[0][0]), str(x[0][1]))):
+        summary = classes.setdefault(class_name, {"count": 0, "clusters": {}})
+        summary["count"] += count
+        titles = cluster_metadata.get(class_name, {}).get("titles", {})
+        summary["clusters"][str(cluster)] = {"count": count, "title": titles.get(str(cluster))}
+    for class_name, summary in classes.items():
+        if "accuracy" in cluster_metadata.get(class_name, {}):
+            summary["accuracy"] = cluster_metadata[class_name]["accuracy"]
+
+    return {
+        "n_notebooks": len(final_json["notebooks"]),
+        "n_cells": sum(counts.values()),
+        "classes": classes,
+        "metadata": {key: value for key, value in final_json.get("metadata", {}).items() if key != "clusters"}
+    }
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _encode_cursor(notebook_idx: int, cell_idx: int) -> str:
+    return base64.urlsafe_b64encode(f"{notebook_idx}:{cell_idx}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        notebook_idx, cell_idx = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(notebook_idx), int(cell_idx)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
@@ -0,0 +1,76 @@
+from typing import BinaryIO, List, Optional, Union
+import ijson
+
+# The only cell fields used by the classifier, everything else (outputs, attachments, ...) is skipped
+CELL_FIELDS = ("cell_type", "source", "metadata")
+
+_START_EVENTS = ("start_map", "start_array")
+_END_EVENTS = ("end_map", "end_array")
+
+
+def read_notebook(source: Union[str, BinaryIO], min_code_cells: int = 0) -> Optional[dict]:
+    """
+    Reads the cells of a notebook, keeping only their `cell_type`, `source` and `metadata`.
+
+    The file is parsed incrementally with ijson: the events of the other fields (outputs, e.g. base64
+    images, attachments, ...) are ignored as they stream by, so these fields are never built and the
+    memory used is that of the kept fields. The code cells are counted while the cells are parsed.
+
+    Args:
+        source (Union[str, BinaryIO]): The path of the .ipynb file, or the file opened in binary mode.
+        min_code_cells (int, optional): The minimum number of code cells, notebooks with fewer are rejected. Defaults to 0.
+
+    Returns:
+        Optional[dict]: The notebook as {"cells": [...]}, or None if it has fewer than `min_code_cells` code cells.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            cells, n_code_cells = _read_cells(f)
+    else:
+        cells, n_code_cells = _read_cells(source)
+
+    if n_code_cells < min_code_cells:
+        return None
+    return {"cells": cells}
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _read_cells(f: BinaryIO) -> tuple[List[dict], int]:
+    """
+    Builds the kept fields of every cell from the parser events, ignoring the events of the other fields.
+
+    Returns:
+        tuple[List[dict], int]: The cells and their number of code cells.
+    """
+    cells = []
+    n_code_cells = 0
+    cell = None
+    field = None
+    builder = None
+    depth = 0
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if field is not None:
+            # Inside a kept field that is an object or an array
+            builder.event(event, value)
+            depth += (event in _START_EVENTS) - (event in _END_EVENTS)
+            if depth == 0:
+                cell[field] = builder.value
+                field = None
+        elif prefix == "cells.item":
+            if event == "start_map":
+                cell = {}
+            elif event == "end_map":
+                cells.append(cell)
+                n_code_cells += cell.get("cell_type") == "code"
+                cell = None
+        elif cell is not None and prefix.startswith("cells.item.") and prefix[len("cells.item."):] in CELL_FIELDS:
+            name = prefix[len("cells.item."):]
+            if event in _START_EVENTS:
+                field, builder, depth = name, ijson.ObjectBuilder(), 1
+                builder.event(event, value)
+            else:
+                cell[name] = value
+    return cells, n_code_cells
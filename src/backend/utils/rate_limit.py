@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from utils.cache import hash_key
+
+
+class TokenBucket():
+    """An asynchronous token bucket refilled continuously at a fixed rate per minute.
+
+    The bucket is safe to share between threads and event loops: a caller reserves its units under a
+    thread lock, possibly driving the level negative, then sleeps in its own loop until the debt is
+    refilled. Reservations are served in FIFO order, so a large request is not starved by smaller ones.
+
+    Attributes:
+        rate_per_minute (float): The number of units added to the bucket per minute.
+        capacity (float): The maximum number of units the bucket can hold.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None) -> None:
+        """Initializes a full token bucket.
+
+        Args:
+            rate_per_minute (float): The number of units added to the bucket per minute.
+            capacity (float, optional): The burst size. Defaults to `rate_per_minute`.
+        """
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Waits until `amount` units are available and takes them from the bucket.
+
+        Requests larger than the capacity are clamped to it, so they wait for a full bucket instead of forever.
+
+        Args:
+            amount (float, optional): The number of units to take. Defaults to 1.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self._level -= amount
+            wait = max(0.0, -self._level) * 60 / self.rate_per_minute
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """Takes (or gives back, if negative) units without waiting, e.g. once the real cost of a request is known.
+
+        The level may become negative, in which case later callers wait until the debt is refilled.
+
+        Args:
+            amount (float): The number of units to take.
+        """
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - amount)
+
+    #######################################
+    ########### Private methods ###########
+    #######################################
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate_per_minute / 60)
+        self._updated = now
+
+
+class ConcurrencyLimiter():
+    """An asynchronous semaphore that can be shared between threads and event loops.
+
+    Used as `async with limiter:`. Waiters are woken in FIFO order, in their own event loop.
+
+    Attributes:
+        limit (int): The maximum number of holders at a time.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def __aenter__(self) -> None:
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            waiter = (asyncio.get_running_loop(), asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # The slot was handed over before the cancellation, pass it on
+            self._release()
+            raise
+
+    async def __aexit__(self, *exc) -> None:
+        self._release()
+
+    #######################################
+    ########### Private methods ###########
+    #######################################
+
+    def _release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    # The slot is handed over, so the number of holders does not change
+                    loop.call_soon_threadsafe(_wake, future)
+                    return
+                except RuntimeError:
+                    # The loop of the waiter is closed
+                    continue
+            self._active -= 1
+
+
+class RateLimiter():
+    """Limits requests per minute and tokens per minute of an API at the same time."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float) -> None:
+        """Initializes the rate limiter.
+
+        Args:
+            requests_per_minute (float): The maximum number of requests per minute.
+            tokens_per_minute (float): The maximum number of tokens per minute.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Waits until one request with the given estimated token cost can be sent.
+
+        Args:
+            estimated_tokens (int): The estimated number of tokens consumed by the request.
+        """
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, used_tokens: int) -> None:
+        """Corrects the token budget once the real usage of a request is known.
+
+        Args:
+            estimated_tokens (int): The number of tokens acquired for the request.
+            used_tokens (int): The number of tokens the request actually consumed.
+        """
+        self.tokens.adjust(used_tokens - estimated_tokens)
+
+
+# Limiters shared by all the clients of an API key and model in this process, see `shared_limiters`
+_shared_limiters = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def shared_limiters(
+    api_key: str, model: str, requests_per_minute: float, tokens_per_minute: float, max_concurrency: int
+) -> tuple[RateLimiter, ConcurrencyLimiter]:
+    """Returns the rate and concurrency limiters of an API key and model, shared by every caller in the process.
+
+    The limits of the first caller apply, concurrent jobs therefore stay within the configured limits together.
+
+    Args:
+        api_key (str): The API key, the limits of the provider apply per key.
+        model (str): The model, the limits of the provider apply per model.
+        requests_per_minute (float): The maximum number of requests per minute.
+        tokens_per_minute (float): The maximum number of tokens per minute.
+        max_concurrency (int): The maximum number of in-flight requests.
+
+    Returns:
+        tuple[RateLimiter, ConcurrencyLimiter]: The shared limiters.
+    """
+    # The key is hashed so that it is not kept in memory in clear
+    key = (hash_key(api_key), model)
+    with _shared_limiters_lock:
+        if key not in _shared_limiters:
+            _shared_limiters[key] = (RateLimiter(requests_per_minute, tokens_per_minute), ConcurrencyLimiter(max_concurrency))
+        return _shared_limiters[key]
+
+
+def estimate_tokens(messages: list[dict], completion_tokens: int = 150) -> int:
+    """Roughly estimates the token cost of a chat completion request (about 4 characters per token).
+
+    Args:
+        messages (list[dict]): The messages sent to the model.
+        completion_tokens (int, optional): The expected length of the answer. Defaults to 150.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return sum(len(message["content"]) // 4 + 4 for message in messages) + completion_tokens
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
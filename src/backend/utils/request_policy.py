@@ -0,0 +1,157 @@
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Optional
+from openai import APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, RateLimitError
+from utils.constants import LLM_TIMEOUT, LLM_MAX_ATTEMPTS, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX
+
+# Errors worth retrying, other API errors (authentication, permissions, ...) are raised immediately
+RETRYABLE_ERRORS = (APITimeoutError, APIConnectionError, RateLimitError, InternalServerError)
+
+
+class RequestPolicy():
+    """The retry, timeout and backoff policy shared by all LLM calls.
+
+    A call is attempted at most `max_attempts` times. Attempts that time out, fail with a transient API error
+    or return a response that cannot be parsed are retried after an exponential backoff with full jitter.
+    Once all attempts are used up (or the request is rejected as invalid), the given fallback is returned,
+    so the latency of a call is bounded by roughly `max_attempts * (timeout + backoff_max)`.
+
+    Counters are kept per stage (e.g. "classify", "title"), see `stats`.
+
+    Attributes:
+        timeout (float): The timeout of a single attempt in seconds.
+        max_attempts (int): The maximum number of attempts per call.
+        backoff_base (float): The backoff before the first retry in seconds, doubled for every further retry.
+        backoff_max (float): The maximum backoff in seconds.
+    """
+
+    COUNTERS = ["calls", "retries", "timeouts", "errors", "parse_failures", "fallbacks"]
+
+    def __init__(
+        self,
+        timeout: float = LLM_TIMEOUT,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX
+    ) -> None:
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._counters = defaultdict(lambda: dict.fromkeys(self.COUNTERS, 0))
+        self._lock = threading.Lock()
+
+    def call(self, stage: str, request: Callable[[float], str], parse: Callable[[str], Any], fallback: Any = None) -> Any:
+        """Calls an LLM within the policy.
+
+        Args:
+            stage (str): The name of the pipeline stage, used for the counters.
+            request (Callable[[float], str]): Sends the request with the given timeout and returns the response content.
+            parse (Callable[[str], Any]): Parses the response content, returns None if it is invalid.
+            fallback (Any, optional): The value returned if no attempt succeeds. Defaults to None.
+
+        Returns:
+            Any: The parsed response, or the fallback.
+        """
+        self.record(stage, "calls")
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.record(stage, "retries")
+                time.sleep(self.backoff(attempt))
+            try:
+                response = request(self.timeout)
+            except BadRequestError as e:
+                print(f"[ERROR] {stage} request rejected: {e}")
+                self.record(stage, "errors")
+                break
+            except RETRYABLE_ERRORS as e:
+                self.record(stage, "timeouts" if isinstance(e, APITimeoutError) else "errors")
+                continue
+
+            result = parse(response)
+            if result is not None:
+                return result
+            self.record(stage, "parse_failures")
+
+        self.record(stage, "fallbacks")
+        return fallback
+
+    async def acall(self, stage: str, request: Callable[[float], Awaitable[str]], parse: Callable[[str], Any], fallback: Any = None) -> Any:
+        """Calls an LLM within the policy, like `call` with an asynchronous request.
+
+        Args:
+            stage (str): The name of the pipeline stage, used for the counters.
+            request (Callable[[float], Awaitable[str]]): Sends the request with the given timeout and returns the response content.
+            parse (Callable[[str], Any]): Parses the response content, returns None if it is invalid.
+            fallback (Any, optional): The value returned if no attempt succeeds. Defaults to None.
+
+        Returns:
+            Any: The parsed response, or the fallback.
+        """
+        self.record(stage, "calls")
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.record(stage, "retries")
+                await asyncio.sleep(self.backoff(attempt))
+            # The timeout is enforced by the request itself, so that time spent waiting for a
+            # concurrency slot or the rate limiter does not count against it
+            try:
+                response = await request(self.timeout)
+            except BadRequestError as e:
+                print(f"[ERROR] {stage} request rejected: {e}")
+                self.record(stage, "errors")
+                break
+            except RETRYABLE_ERRORS as e:
+                self.record(stage, "timeouts" if isinstance(e, APITimeoutError) else "errors")
+                continue
+
+            result = parse(response)
+            if result is not None:
+                return result
+            self.record(stage, "parse_failures")
+
+        self.record(stage, "fallbacks")
+        return fallback
+
+    def backoff(self, attempt: int) -> float:
+        """Returns the delay before the given retry (exponential backoff with full jitter).
+
+        Args:
+            attempt (int): The number of attempts made so far.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def record(self, stage: str, counter: str, amount: int = 1) -> None:
+        """Increments a counter of a stage.
+
+        Args:
+            stage (str): The name of the pipeline stage.
+            counter (str): One of COUNTERS.
+            amount (int, optional): The increment. Defaults to 1.
+        """
+        with self._lock:
+            self._counters[stage][counter] += amount
+
+    def stats(self, stage: Optional[str] = None) -> dict:
+        """Returns the counters of one or all stages.
+
+        Args:
+            stage (Optional[str], optional): The name of the stage, None for all stages. Defaults to None.
+
+        Returns:
+            dict: The counters of the stage, or a dictionary of the counters of every stage.
+        """
+        with self._lock:
+            if stage is not None:
+                return dict(self._counters[stage])
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+
+# Policy shared by every LLM call of the process, so that the counters cover the whole pipeline
+request_policy = RequestPolicy()
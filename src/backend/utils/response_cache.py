@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class CachedResponse():
+    """A serialized, gzip-compressed response body.
+
+    Attributes:
+        etag (str): The digest of the uncompressed body, unquoted.
+        gzip_body (bytes): The compressed body.
+        created_at (float): When the body was serialized.
+    """
+
+    def __init__(self, body: bytes) -> None:
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.gzip_body = gzip.compress(body, compresslevel=6)
+        self.created_at = time.monotonic()
+
+    @property
+    def body(self) -> bytes:
+        """The uncompressed body, for clients that do not accept gzip."""
+        return gzip.decompress(self.gzip_body)
+
+
+class ResponseCache():
+    """An in-process LRU cache of response bodies, keyed by notebook name and query variant.
+
+    Entries of a notebook are dropped by `invalidate` when it is written, and after `ttl` seconds
+    in case it was written by another process (e.g. the CLI). A response read from the database before
+    an invalidation is not stored, see `generation`. Entries are evicted in least-recently-used
+    order once their compressed bodies take more than `max_bytes`. The cache is safe to share between threads.
+
+    Attributes:
+        max_bytes (int): The maximum total size of the compressed bodies.
+        ttl (float): How long an entry is served, in seconds.
+        hits (int): The number of successful lookups since creation.
+        misses (int): The number of failed lookups since creation.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, notebook_name: str, variant: str = "") -> Optional[CachedResponse]:
+        """Looks up the response of a query.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+            variant (str, optional): Identifies the query (projection, filters, page, ...). Defaults to "".
+
+        Returns:
+            Optional[CachedResponse]: The cached response, or None.
+        """
+        key = (notebook_name, variant)
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None and time.monotonic() - response.created_at > self.ttl:
+                self._remove(key)
+                response = None
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def generation(self, notebook_name: str) -> int:
+        """Returns the number of invalidations of a notebook, to be read before reading the notebook and passed to `put`."""
+        with self._lock:
+            return self._generations.get(notebook_name, 0)
+
+    def put(self, notebook_name: str, variant: str, body: bytes, generation: Optional[int] = None) -> CachedResponse:
+        """Compresses and stores the response of a query.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+            variant (str): Identifies the query.
+            body (bytes): The serialized response.
+            generation (Optional[int], optional): The `generation` of the notebook when it was read, the response
+                is not stored if the notebook was invalidated since. Defaults to None (always stored).
+
+        Returns:
+            CachedResponse: The cached response.
+        """
+        response = CachedResponse(body)
+        key = (notebook_name, variant)
+        with self._lock:
+            if generation is not None and generation != self._generations.get(notebook_name, 0):
+                return response
+            if key in self._entries:
+                self._remove(key)
+            if len(response.gzip_body) <= self.max_bytes:
+                self._entries[key] = response
+                self._size += len(response.gzip_body)
+                while self._size > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+        return response
+
+    def invalidate(self, notebook_name: str) -> None:
+        """Drops every cached response of a notebook.
+
+        Args:
+            notebook_name (str): The name of the notebook.
+        """
+        with self._lock:
+            self._generations[notebook_name] = self._generations.get(notebook_name, 0) + 1
+            for key in [key for key in self._entries if key[0] == notebook_name]:
+                self._remove(key)
+
+    def stats(self) -> dict:
+        """Returns the number of entries, their size and the hit counters."""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _remove(self, key: tuple) -> None:
+        self._size -= len(self._entries.pop(key).gzip_body)
@@ -0,0 +1,346 @@
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from typing import Iterable, List, Optional
+import numpy as np
+
+VIZ_STORE_VERSION = 2
+EMBEDDING_DTYPES = ["float16", "float32", "float64"]
+
+# Cell fields stored as columns when every cell has them, see `_column_fields`
+INT_FIELDS = ["cell_id", "cluster"]
+STRING_FIELDS = ["code", "desc"]
+VECTOR_FIELDS = ["embedding", "coords"]
+
+
+class VizStore():
+    """A columnar, compressed variant of the .viz format (version 2) with random access.
+
+    The cells of all notebooks are stored in notebook order as columns of a NumPy .npz archive:
+        - `cell_id` and `cluster` as int32 arrays,
+        - `class` as int16 ids into the `classes` vocabulary,
+        - `code` and `desc` as one UTF-8 block each, with int64 offsets,
+        - `embedding` and `coords` as contiguous (n_cells, dim) matrices, when every cell has them with the
+          same length, as int64 if all their values are integers and at the chosen `embedding_dtype` otherwise,
+        - any other cell field (e.g. `testing`) as one JSON object per cell in an `extra` block.
+    A field that some cell lacks or holds with another type (e.g. a vector mixing integers and floats)
+    is kept in `extra` instead, so the conversion back to JSON is lossless, except that float vectors
+    are rounded to `embedding_dtype` (float64 keeps them exact).
+    The notebooks (without their cells) and the metadata are stored in a JSON header.
+
+    Columns are loaded (and decompressed) on first access and kept in memory, so reading the
+    cells of one notebook, class or cluster only touches the columns it needs.
+
+    Attributes:
+        path (str): The path of the archive.
+        classes (List[str]): The class vocabulary.
+        notebooks (List[dict]): The notebooks, without their cells.
+        metadata (dict): The metadata of the corpus.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Opens a store written by `VizStore.save`.
+
+        Args:
+            path (str): The path of the archive.
+
+        Raises:
+            ValueError: If the file is not a .viz store of a supported version.
+        """
+        self.path = path
+        self._archive = np.load(path, allow_pickle=False)
+        self._columns = {}
+        self._lock = threading.Lock()
+        header = json.loads(self._archive["header"].tobytes().decode("utf-8"))
+        if header.get("version") != VIZ_STORE_VERSION:
+            raise ValueError(f"Unsupported .viz store version {header.get('version')} in {path}")
+        self.classes = header["classes"]
+        self.notebooks = header["notebooks"]
+        self.metadata = header["metadata"]
+        self._fields = header["fields"]
+
+    @classmethod
+    def save(cls, final_json: dict, path: str, embedding_dtype: str = "float32") -> None:
+        """Writes a final JSON as a store, atomically.
+
+        Args:
+            final_json (dict): The final JSON, as written to a .viz file.
+            path (str): The path of the archive.
+            embedding_dtype (str, optional): One of EMBEDDING_DTYPES, the precision of every float vector field
+                (`embedding` and `coords`), float64 keeps JSON floats exact. Defaults to "float32".
+
+        Raises:
+            ValueError: If the embedding dtype is unknown.
+        """
+        if embedding_dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{embedding_dtype}', expected one of {EMBEDDING_DTYPES}")
+
+        cells = [cell for notebook in final_json["notebooks"] for cell in notebook["cells"]]
+        fields = _column_fields(cells)
+        classes = sorted({cell["class"] for cell in cells}) if "class" in fields else []
+        class_ids = {name: i for i, name in enumerate(classes)}
+
+        arrays = {
+            "notebook_offsets": np.cumsum([0] + [len(notebook["cells"]) for notebook in final_json["notebooks"]], dtype=np.int64)
+        }
+        for field in fields:
+            if field in INT_FIELDS:
+                arrays[field] = np.array([cell[field] for cell in cells], dtype=np.int32)
+            elif field == "class":
+                arrays[field] = np.array([class_ids[cell[field]] for cell in cells], dtype=np.int16)
+            elif field in STRING_FIELDS:
+                arrays[f"{field}_data"], arrays[f"{field}_offsets"] = _encode_strings(cell[field] for cell in cells)
+            elif field in VECTOR_FIELDS:
+                dtype = np.int64 if _vector_kind(cells, field) == "int" else embedding_dtype
+                # The dimension is explicit, since it cannot be inferred from zero-length vectors
+                arrays[field] = np.array([cell[field] for cell in cells], dtype=dtype).reshape(len(cells), len(cells[0][field]))
+        arrays["extra_data"], arrays["extra_offsets"] = _encode_strings(
+            json.dumps({key: value for key, value in cell.items() if key not in fields}) for cell in cells
+        )
+
+        header = {
+            "version": VIZ_STORE_VERSION,
+            "classes": classes,
+            "fields": fields,
+            "notebooks": [{key: value for key, value in notebook.items() if key != "cells"} for notebook in final_json["notebooks"]],
+            "metadata": final_json.get("metadata", {})
+        }
+        arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def __len__(self) -> int:
+        return int(self._column("notebook_offsets")[-1])
+
+    def column(self, field: str) -> np.ndarray:
+        """Returns a whole column.
+
+        Args:
+            field (str): "notebook" (the notebook index of every cell), "class" (class ids into `classes`),
+                "cell_id", "cluster", "embedding" or "coords".
+
+        Returns:
+            np.ndarray: The column, in cell order.
+
+        Raises:
+            KeyError: If the field is not stored as a column.
+        """
+        if field == "notebook":
+            return np.repeat(np.arange(len(self.notebooks)), np.diff(self._column("notebook_offsets")))
+        if field not in self._fields or field in STRING_FIELDS:
+            raise KeyError(f"'{field}' is not a column of {self.path}, columns are {self._fields}")
+        return self._column(field)
+
+    def notebook(self, notebook_idx: int) -> dict:
+        """Returns a notebook with its cells, as in the JSON format.
+
+        Args:
+            notebook_idx (int): The index of the notebook.
+
+        Returns:
+            dict: The notebook.
+        """
+        offsets = self._column("notebook_offsets")
+        return {**self.notebooks[notebook_idx], "cells": self.cells(range(offsets[notebook_idx], offsets[notebook_idx + 1]))}
+
+    def class_indices(self, class_name: str) -> np.ndarray:
+        """Returns the indices of the cells of a class.
+
+        Args:
+            class_name (str): The name of the class.
+
+        Returns:
+            np.ndarray: The cell indices, in cell order.
+        """
+        if class_name not in self.classes:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.column("class") == self.classes.index(class_name))
+
+    def cluster_indices(self, class_name: str, cluster: int) -> np.ndarray:
+        """Returns the indices of the cells of a cluster.
+
+        Args:
+            class_name (str): The name of the class.
+            cluster (int): The cluster label within the class.
+
+        Returns:
+            np.ndarray: The cell indices, in cell order.
+        """
+        idx = self.class_indices(class_name)
+        return idx[self.column("cluster")[idx] == cluster]
+
+    def cells(self, indices: Iterable[int]) -> List[dict]:
+        """Returns cells, as in the JSON format.
+
+        Args:
+            indices (Iterable[int]): The cell indices.
+
+        Returns:
+            List[dict]: The cells.
+        """
+        indices = np.fromiter(indices, dtype=np.int64)
+        columns = {field: self._column(field) for field in self._fields if field not in STRING_FIELDS}
+        strings = {field: self._strings(field) for field in self._fields if field in STRING_FIELDS}
+        extra = self._strings("extra")
+
+        cells = []
+        for i in indices:
+            cell = {}
+            for field in self._fields:
+                if field in STRING_FIELDS:
+                    cell[field] = strings[field](i)
+                elif field == "class":
+                    cell[field] = self.classes[columns[field][i]]
+                else:
+                    cell[field] = columns[field][i].tolist()
+            cell.update(json.loads(extra(i)))
+            cells.append(cell)
+        return cells
+
+    def to_json(self) -> dict:
+        """Converts the store back to the final JSON format.
+
+        Returns:
+            dict: The final JSON.
+        """
+        return {
+            "notebooks": [self.notebook(i) for i in range(len(self.notebooks))],
+            "metadata": self.metadata
+        }
+
+    def close(self) -> None:
+        """Closes the archive."""
+        self._archive.close()
+
+    def __enter__(self) -> "VizStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    ##############################
+    ###### Private methods #######
+    ##############################
+
+    def _column(self, name: str) -> np.ndarray:
+        with self._lock:
+            if name not in self._columns:
+                self._columns[name] = self._archive[name]
+            return self._columns[name]
+
+    def _strings(self, field: str):
+        """
+        Returns a function decoding the string of a cell from a string block.
+        """
+        data, offsets = self._column(f"{field}_data"), self._column(f"{field}_offsets")
+        return lambda i: data[offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+
+def is_viz_store(path: str) -> bool:
+    """Tells a .viz store (a zip archive) from a JSON .viz file.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        bool: True if the file is a store.
+    """
+    return zipfile.is_zipfile(path)
+
+
+def load_viz(path: str) -> dict:
+    """Loads a .viz file of either format as a final JSON.
+
+    Args:
+        path (str): The path of the JSON .viz file or of the store.
+
+    Returns:
+        dict: The final JSON.
+    """
+    if is_viz_store(path):
+        with VizStore(path) as store:
+            return store.to_json()
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+#####################################
+######### Private Functions #########
+#####################################
+
+def _column_fields(cells: List[dict]) -> List[str]:
+    """
+    Returns the fields that every cell holds with the type of their column, the others are stored per cell in `extra`.
+    """
+    def is_int(value):
+        return isinstance(value, (int, np.integer)) and not isinstance(value, bool) and -2**31 <= value < 2**31
+
+    def is_vector(value):
+        return isinstance(value, list)
+
+    fields = []
+    if not cells:
+        return fields
+    checks = {"class": lambda value: isinstance(value, str)}
+    checks.update({field: is_int for field in INT_FIELDS})
+    checks.update({field: lambda value: isinstance(value, str) for field in STRING_FIELDS})
+    checks.update({field: is_vector for field in VECTOR_FIELDS})
+    for field, check in checks.items():
+        if all(field in cell and check(cell[field]) for cell in cells):
+            if field in VECTOR_FIELDS and (len({len(cell[field]) for cell in cells}) != 1 or _vector_kind(cells, field) is None):
+                continue
+            fields.append(field)
+    return fields
+
+def _vector_kind(cells: List[dict], field: str) -> Optional[str]:
+    """
+    Returns "int" if the vectors of a field hold only integers that fit in int64, "float" if they hold only
+    floats (or are empty), and None otherwise, since a column of either dtype would change some values.
+    """
+    def kind(x):
+        if isinstance(x, float):
+            return "float"
+        if isinstance(x, int) and not isinstance(x, bool) and -2**63 <= x < 2**63:
+            return "int"
+        return None
+
+    kinds = {kind(x) for cell in cells for x in cell[field]}
+    if not kinds:
+        return "float"
+    return kinds.pop() if len(kinds) == 1 and None not in kinds else None
+
+def _encode_strings(strings: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenates UTF-8 encoded strings into one block.
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The uint8 block and the int64 offsets of every string (n + 1 values).
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.cumsum([0] + [len(data) for data in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Converts between JSON .viz files and .viz stores (version 2).")
+    parser.add_argument("source", help="The file to convert, of either format")
+    parser.add_argument("destination", help="The converted file")
+    parser.add_argument("--embedding-dtype", default="float32", choices=EMBEDDING_DTYPES, help="The precision of stored float vectors (embeddings and coordinates)")
+    args = parser.parse_args()
+
+    if is_viz_store(args.source):
+        with VizStore(args.source) as store, open(args.destination, "w") as f:
+            json.dump(store.to_json(), f)
+    else:
+        VizStore.save(load_viz(args.source), args.destination, embedding_dtype=args.embedding_dtype)
+    print(f"{args.source} ({os.path.getsize(args.source) / 1e3:.0f} KB) -> {args.destination} ({os.path.getsize(args.destination) / 1e3:.0f} KB)")